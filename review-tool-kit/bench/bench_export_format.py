@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Compare export formats: bytes on disk, write time and load time.
+
+Builds a synthetic MR export (--files diffs of --diff-kb each, plus --notes
+comments; code-like lines drawn from a seeded vocabulary so compression ratios
+are realistic) and writes it as:
+
+  .mr.json          indent=2 (current default)
+  .mr.json          --compact (minified)
+  .mr.json.gz/.xz   --compact --compress gz|xz
+  .mr.json.zst      --compact --compress zst (only if `zstandard` is installed)
+  .mr.jsonl(.gz)    --stream
+
+For each it reports the file size, write time, load_export() time (the dict the
+SQLite store / sync code use) and read_export_text() time (the indent=2 text the
+prompt-pack builders inject), plus a check that the builder text is identical.
+
+Usage:
+  python bench/bench_export_format.py
+  python bench/bench_export_format.py --files 2000 --diff-kb 40 --repeat 3
+"""
+
+import argparse
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from export_io import write_json_file  # noqa: E402
+from mr_export_stream import StreamingExportWriter, load_export, read_export_text  # noqa: E402
+
+WORDS = ["self", "value", "result", "items", "config", "request", "response", "return", "if", "for", "in",
+         "None", "len", "path", "data", "error", "user", "count", "key", "name", "update", "# 修正", "payload"]
+
+def synth_payload(files: int, diff_kb: int, notes: int, seed: int = 1) -> Dict[str, Any]:
+    rnd = random.Random(seed)
+
+    def code_line() -> str:
+        indent = "    " * rnd.randint(0, 3)
+        return indent + " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 9)))
+
+    diffs = []
+    for i in range(files):
+        lines: List[str] = []
+        size = 0
+        while size < diff_kb * 1024:
+            line = rnd.choice("+- ") + code_line()
+            lines.append(line)
+            size += len(line) + 1
+        diffs.append({"old_path": f"src/pkg/f{i}.py", "new_path": f"src/pkg/f{i}.py", "new_file": False,
+                      "renamed_file": False, "deleted_file": False,
+                      "diff": f"@@ -1,{len(lines)} +1,{len(lines)} @@\n" + "\n".join(lines) + "\n"})
+    comments = [
+        {"discussion_id": f"d{i}", "note_id": i, "type": "DiffNote", "system": False, "resolvable": True,
+         "resolved": i % 3 == 0, "author": {"id": 7, "name": "Reviewer", "username": "rev", "web_url": "http://gl/rev"},
+         "created_at": "2026-01-01T00:00:00.000Z", "updated_at": "2026-01-02T00:00:00.000Z",
+         "body": "この変更は " + code_line() + " を確認してください。",
+         "position": {"new_path": f"src/pkg/f{i % max(files, 1)}.py", "new_line": i % 50 + 1}}
+        for i in range(notes)
+    ]
+    return {
+        "fetched_at": "2026-10-17T00:00:00+00:00",
+        "mr": {"project_path": "g/p", "iid": 1, "title": "Synthetic MR", "state": "opened",
+               "source_branch": "feature", "target_branch": "main",
+               "diff_refs": {"base_sha": "b", "start_sha": "s", "head_sha": "h"}},
+        "diffs": diffs,
+        "comments": comments,
+        "counts": {"diff_files": len(diffs), "comments": len(comments), "omitted_diffs": {}},
+    }
+
+def write_stream(path: str, payload: Dict[str, Any]) -> None:
+    w = StreamingExportWriter(path)
+    w.write_header(payload["fetched_at"], payload["mr"])
+    for d in payload["diffs"]:
+        w.write_diff(d)
+    for c in payload["comments"]:
+        w.write_comment(c)
+    w.close()
+
+def timed(fn, repeat: int) -> Tuple[float, Any]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Compare export formats: bytes on disk, write time and load time.")
+    ap.add_argument("--files", type=int, default=500)
+    ap.add_argument("--diff-kb", type=int, default=20)
+    ap.add_argument("--notes", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=3, help="Best of N for each timing")
+    args = ap.parse_args()
+
+    payload = synth_payload(args.files, args.diff_kb, args.notes)
+    variants = [
+        ("indent=2", "x.mr.json", False),
+        ("compact", "x.mr.json", True),
+        ("compact+gz", "x.mr.json.gz", True),
+        ("compact+xz", "x.mr.json.xz", True),
+    ]
+    try:
+        import zstandard  # noqa: F401
+        variants.append(("compact+zst", "x.mr.json.zst", True))
+    except ImportError:
+        print("INFO: zstandard not installed; skipping .zst", file=sys.stderr)
+    variants += [("stream", "x.mr.jsonl", None), ("stream+gz", "x.mr.jsonl.gz", None)]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        reference = None
+        for label, name, compact in variants:
+            path = os.path.join(tmp, label + "_" + name)
+            if compact is None:
+                write_sec, _ = timed(lambda: write_stream(path, payload), args.repeat)
+            else:
+                write_sec, _ = timed(lambda: write_json_file(path, payload, compact=compact), args.repeat)
+            load_sec, _ = timed(lambda: load_export(path), args.repeat)
+            text_sec, text = timed(lambda: read_export_text(path), args.repeat)
+            if reference is None:
+                reference = text
+            rows.append((label, os.path.getsize(path), write_sec, load_sec, text_sec, text == reference))
+
+    base = rows[0][1]
+    print(f"{args.files} files x {args.diff_kb} KiB diffs, {args.notes} comments (best of {args.repeat})")
+    print(f"{'format':<13}{'bytes':>13}{'ratio':>8}{'write':>9}{'load':>9}{'builder':>9}  same_text")
+    for label, size, write_sec, load_sec, text_sec, same in rows:
+        print(f"{label:<13}{size:>13,}{size / base:>8.2f}{write_sec:>8.2f}s{load_sec:>8.2f}s{text_sec:>8.2f}s  {same}")
+    return 0 if all(r[5] for r in rows) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
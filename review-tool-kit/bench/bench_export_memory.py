@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Compare peak RSS of gitlab_export_mr.py: classic .mr.json vs --stream (.mr.jsonl).
+
+Serves a synthetic MR (--files diffs of --diff-kb each, plus --notes comments)
+from a local fake GitLab, runs the real exporter in a child process for each
+mode (REVIEW_TOOLKIT_CONFIG points it at a temporary config), and reports the
+child's peak RSS from wait4(). The fake server runs in its own process so the
+benchmark parent stays small (a forked child's RSS starts at the parent's).
+
+Usage:
+  python bench/bench_export_memory.py
+  python bench/bench_export_memory.py --files 4000 --diff-kb 50
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+EXPORTER = ROOT / "scripts" / "gitlab_export_mr.py"
+
+def synth_bodies(files: int, diff_kb: int, notes: int) -> dict:
+    line = "+" + "x" * 78 + "\n"
+    diff = "@@ -1,1 +1,%d @@\n" % (diff_kb * 1024 // len(line)) + line * (diff_kb * 1024 // len(line))
+    changes = {
+        "id": 1,
+        "title": "Synthetic large MR",
+        "changes": [
+            {"old_path": f"src/f{i}.py", "new_path": f"src/f{i}.py", "new_file": False,
+             "renamed_file": False, "deleted_file": False, "diff": diff}
+            for i in range(files)
+        ],
+    }
+    discussions = [
+        {"id": f"d{i}", "notes": [{"id": i, "body": "comment %d " % i * 4, "system": False,
+                                   "created_at": "2026-01-01T00:00:00.000Z", "updated_at": "2026-01-01T00:00:00.000Z",
+                                   "author": {"id": 1, "name": "a", "username": "a"}}]}
+        for i in range(notes)
+    ]
+    return {
+        "mr": json.dumps({"iid": 1, "title": "Synthetic large MR", "source_branch": "f", "target_branch": "main",
+                          "diff_refs": {"base_sha": "b", "start_sha": "s", "head_sha": "h"}}).encode(),
+        "changes": json.dumps(changes).encode(),
+        "discussions": discussions,
+    }
+
+def make_handler(bodies: dict):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            u = urlparse(self.path)
+            headers = {}
+            if u.path.endswith("/changes"):
+                body = bodies["changes"]
+            elif u.path.endswith("/discussions"):
+                q = parse_qs(u.query)
+                per_page = int(q.get("per_page", ["20"])[0])
+                page = int(q.get("page", ["1"])[0])
+                items = bodies["discussions"]
+                total = max(1, (len(items) + per_page - 1) // per_page)
+                body = json.dumps(items[(page - 1) * per_page: page * per_page]).encode()
+                headers["X-Total-Pages"] = str(total)
+                if page < total:
+                    headers["X-Next-Page"] = str(page + 1)
+            else:
+                body = bodies["mr"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def run_child(config_path: str, base_url: str, extra: list) -> tuple:
+    env = dict(os.environ, REVIEW_TOOLKIT_CONFIG=config_path)
+    cmd = [sys.executable, str(EXPORTER), "--mr-url", f"{base_url}/g/p/-/merge_requests/1", *extra]
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - t0
+    if status != 0:
+        raise RuntimeError(f"exporter failed: {proc.stderr.read().decode(errors='replace')}")
+    return usage.ru_maxrss / 1024.0, elapsed  # ru_maxrss is KiB on Linux
+
+def serve(args: argparse.Namespace) -> int:
+    bodies = synth_bodies(args.files, args.diff_kb, args.notes)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(bodies))
+    print(server.server_address[1], len(bodies["changes"]), flush=True)
+    server.serve_forever()
+    return 0
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Peak RSS benchmark: classic vs streaming MR export.")
+    ap.add_argument("--files", type=int, default=2000)
+    ap.add_argument("--diff-kb", type=int, default=40)
+    ap.add_argument("--notes", type=int, default=2000)
+    ap.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.serve:
+        return serve(args)
+
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", "--files", str(args.files), "--diff-kb", str(args.diff_kb), "--notes", str(args.notes)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        port, size = server.stdout.readline().split()
+        base_url = f"http://127.0.0.1:{port}"
+        print(f"/changes payload: {int(size) / 1048576:.1f} MiB, {args.files} files, {args.notes} notes")
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "config.py")
+            with open(config_path, "w", encoding="utf-8") as f:
+                f.write(f"GITLAB_BASE_URL = {base_url!r}\nGITLAB_TOKEN = 'bench'\nMR_URLS = []\n"
+                        f"OUT_DIR = {os.path.join(tmp, 'out')!r}\nHTTP_CACHE_ENABLED = False\n")
+            for label, extra in (("classic (.mr.json)", []), ("stream (.mr.jsonl)", ["--stream"])):
+                rss, elapsed = run_child(config_path, base_url, extra)
+                print(f"{label:<20} peak RSS {rss:8.1f} MiB   {elapsed:6.2f}s")
+    finally:
+        server.terminate()
+        server.wait()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
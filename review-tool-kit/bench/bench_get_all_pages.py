@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Benchmark GitLabClient.get_all_pages sequential vs parallel paging.
+
+Starts a local fake GitLab list endpoint that sleeps --delay seconds per page
+and reports X-Total-Pages / X-Next-Page like GitLab. Sequential wall time grows
+with the page count; parallel wall time should stay close to ~2 round trips
+(page 1, then the rest in batches of --jobs). The run fails (exit 1) if parallel
+paging of the largest --pages takes more than one round trip over that.
+
+Usage:
+  python bench/bench_get_all_pages.py
+  python bench/bench_get_all_pages.py --delay 0.1 --pages 4 8 16 32 --jobs 8
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "scripts"))
+
+from gitlab_client import GitLabClient, build_session  # noqa: E402
+
+def make_handler(total_items: int, delay: float, report_total: bool):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            q = parse_qs(urlparse(self.path).query)
+            per_page = int(q.get("per_page", ["20"])[0])
+            page = int(q.get("page", ["1"])[0])
+            total_pages = max(1, (total_items + per_page - 1) // per_page)
+            start = (page - 1) * per_page
+            body = json.dumps([{"id": i} for i in range(start, min(start + per_page, total_items))]).encode()
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if report_total:
+                self.send_header("X-Total-Pages", str(total_pages))
+            if page < total_pages:
+                self.send_header("X-Next-Page", str(page + 1))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def run_once(pages: int, per_page: int, delay: float, jobs: int, report_total: bool) -> float:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(pages * per_page, delay, report_total))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        gl = GitLabClient(
+            base_url=f"http://127.0.0.1:{server.server_address[1]}",
+            token="bench",
+            session=build_session(pool_size=max(jobs, 10)),
+        )
+        t0 = time.perf_counter()
+        items = gl.get_all_pages("/projects/1/merge_requests/1/discussions", params={"per_page": per_page}, parallel=jobs)
+        elapsed = time.perf_counter() - t0
+        assert [it["id"] for it in items] == list(range(pages * per_page)), "pages reassembled out of order"
+        return elapsed
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark sequential vs parallel get_all_pages against a local fake server.")
+    ap.add_argument("--pages", type=int, nargs="+", default=[2, 4, 8, 16])
+    ap.add_argument("--per-page", type=int, default=20)
+    ap.add_argument("--delay", type=float, default=0.1, help="Forced server delay per page (seconds)")
+    ap.add_argument("--jobs", type=int, default=16, help="Workers for the parallel mode")
+    args = ap.parse_args()
+
+    print(f"{'pages':>5}  {'sequential':>10}  {'parallel':>10}  {'no-total':>10}")
+    par = 0.0
+    for pages in sorted(args.pages):
+        seq = run_once(pages, args.per_page, args.delay, 1, True)
+        par = run_once(pages, args.per_page, args.delay, args.jobs, True)
+        fallback = run_once(pages, args.per_page, args.delay, args.jobs, False)
+        print(f"{pages:>5}  {seq:>9.2f}s  {par:>9.2f}s  {fallback:>9.2f}s")
+    pages = max(args.pages)
+    round_trips = 1 + -(-(pages - 1) // args.jobs)
+    budget = (round_trips + 1) * args.delay
+    if par > budget:
+        print(f"FAIL: parallel paging of {pages} pages took {par:.2f}s > {budget:.2f}s ({round_trips} round trips + 1)", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
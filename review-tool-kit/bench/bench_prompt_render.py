@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Compare peak RSS and time of building an MR review prompt pack: chained str.replace vs the streaming renderer.
+
+Writes a synthetic MR export of about --mb MiB (code-like diffs plus Japanese
+review comments, so Python holds the text as 2-byte str like real data) as
+.mr.json and .mr.jsonl, then builds the prompt pack from each in a child
+process per mode and reports the child's peak RSS from wait4():
+
+  replace    the previous implementation: whole export text in memory, then
+             str.replace for each placeholder and write_text()
+  streaming  scripts/build_mr_review_prompt_pack.py (prompt_template.render_to_file)
+
+The outputs of both modes are checked to be byte-identical.
+
+Usage:
+  python bench/bench_prompt_render.py
+  python bench/bench_prompt_render.py --mb 50
+"""
+
+import argparse
+import hashlib
+import os
+import pathlib
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Tuple
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from export_io import open_text  # noqa: E402
+from mr_export_stream import StreamingExportWriter, iter_export_json_chunks, is_stream_export  # noqa: E402
+from prompt_prefix import PREFIX_VALUE  # noqa: E402
+
+BUILDER = ROOT / "scripts" / "build_mr_review_prompt_pack.py"
+WORDS = ["self", "value", "result", "items", "config", "request", "response", "return", "if", "for", "in",
+         "None", "len", "path", "data", "error", "user", "count", "key", "name", "update", "payload"]
+NOTES = ["この処理は例外を握りつぶしています。", "変数名が分かりにくいので修正してください。", "ここはループ内でI/Oしています。"]
+
+def write_synthetic(jsonl_path: str, json_path: str, mb: int, seed: int = 1) -> None:
+    """Stream a synthetic export of about `mb` MiB to both formats without holding it in memory."""
+    rnd = random.Random(seed)
+    w = StreamingExportWriter(jsonl_path)
+    w.write_header("2026-10-17T00:00:00+00:00", {
+        "project_path": "g/p", "iid": 1, "title": "Synthetic MR", "state": "opened", "source_branch": "feature",
+        "target_branch": "main", "diff_refs": {"base_sha": "b", "start_sha": "s", "head_sha": "h"}})
+    written = 0
+    i = 0
+    while written < mb * 1024 * 1024:
+        lines = []
+        for _ in range(400):
+            lines.append(rnd.choice("+- ") + "    " * rnd.randint(0, 3) + " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 9))))
+        diff = f"@@ -1,400 +1,400 @@\n" + "\n".join(lines) + "\n"
+        w.write_diff({"old_path": f"src/pkg/f{i}.py", "new_path": f"src/pkg/f{i}.py", "new_file": False,
+                      "renamed_file": False, "deleted_file": False, "diff": diff})
+        written += len(diff)
+        i += 1
+    for n in range(i * 2):
+        w.write_comment({"discussion_id": f"d{n}", "note_id": n, "type": "DiffNote", "system": False,
+                         "resolvable": True, "resolved": False, "author": {"id": 7, "name": "Reviewer", "username": "rev"},
+                         "created_at": "2026-01-01T00:00:00.000Z", "body": rnd.choice(NOTES),
+                         "position": {"new_path": f"src/pkg/f{n // 2}.py", "new_line": n % 400 + 1}})
+    w.close()
+    with open(json_path, "w", encoding="utf-8") as f:
+        for chunk in iter_export_json_chunks(jsonl_path):
+            f.write(chunk)
+
+def replace_build(mr_path: str, out_path: str) -> None:
+    """The chained str.replace build that the streaming renderer replaced."""
+    in_dir = ROOT / "in" / "mr_review"
+    read = lambda p: pathlib.Path(p).read_text(encoding="utf-8")  # noqa: E731
+    if is_stream_export(mr_path):
+        mr_json = "".join(iter_export_json_chunks(mr_path))
+    else:
+        with open_text(mr_path) as f:
+            mr_json = f.read()
+    compiled = read(in_dir / "prompt_pack_template.md")
+    compiled = compiled.replace("{{SYSTEM_PROMPT}}", read(in_dir / "system_prompt.md"))
+    compiled = compiled.replace("{{USER_PROMPT}}", read(in_dir / "user_prompt.md"))
+    rr = read(in_dir / "review_request.md")
+    rr = rr.replace("{{GUIDELINES_MD}}", read(ROOT / "in" / "guidelines.md"))
+    rr = rr.replace("{{CODING_RULES_JSON}}", read(ROOT / "rules" / "coding_rules.json"))
+    rr = rr.replace("{{PROMPT_PREFIX_END}}", PREFIX_VALUE).replace("{{MR_CODING_RULES}}", "")
+    rr = rr.replace("{{MR_JSON}}", mr_json)
+    compiled = compiled.replace("{{REVIEW_REQUEST}}", rr)
+    pathlib.Path(out_path).write_text(compiled, encoding="utf-8")
+
+def run_child(cmd: list, env: dict) -> Tuple[float, float]:
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, cwd=str(ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - t0
+    if status != 0:
+        raise RuntimeError(f"build failed: {proc.stderr.read().decode(errors='replace')}")
+    return usage.ru_maxrss / 1024.0, elapsed  # ru_maxrss is KiB on Linux
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Peak RSS / time: str.replace prompt build vs streaming renderer.")
+    ap.add_argument("--mb", type=int, default=200, help="Approximate size of the synthetic export (MiB)")
+    ap.add_argument("--replace-child", nargs=2, metavar=("MR", "OUT"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.replace_child:
+        replace_build(*args.replace_child)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl_path = os.path.join(tmp, "big.mr.jsonl")
+        json_path = os.path.join(tmp, "big.mr.json")
+        write_synthetic(jsonl_path, json_path, args.mb)
+        print(f"synthetic export: .mr.json {os.path.getsize(json_path) / 1048576:.1f} MiB, "
+              f".mr.jsonl {os.path.getsize(jsonl_path) / 1048576:.1f} MiB")
+
+        config_path = os.path.join(tmp, "config.py")
+        with open(config_path, "w", encoding="utf-8") as f:
+            f.write(f"OUT_DIR = {os.path.join(tmp, 'out')!r}\nRULES_TOP_K = 0\nPROMPT_MAX_TOKENS = 0\n"
+                    f"CODING_RULES_FILE = {str(ROOT / 'rules' / 'coding_rules.json')!r}\n"
+                    f"GUIDELINES_MD_FILE = {str(ROOT / 'in' / 'guidelines.md')!r}\n")
+        env = dict(os.environ, REVIEW_TOOLKIT_CONFIG=config_path)
+
+        ok = True
+        print(f"{'input':<10}{'mode':<11}{'peak RSS':>12}{'time':>9}")
+        for label, mr_path in (("mr.json", json_path), ("mr.jsonl", jsonl_path)):
+            digests = []
+            for mode in ("replace", "streaming"):
+                out_dir = os.path.join(tmp, mode)
+                os.makedirs(out_dir, exist_ok=True)
+                out_path = os.path.join(out_dir, "big.mr_review.prompt.md")
+                if mode == "replace":
+                    cmd = [sys.executable, __file__, "--replace-child", mr_path, out_path]
+                else:
+                    cmd = [sys.executable, str(BUILDER), "--mr-json", mr_path, "--out-dir", out_dir]
+                rss, elapsed = run_child(cmd, env)
+                built = os.path.join(out_dir, "big.mr.mr_review.prompt.md") if mode == "streaming" else out_path
+                digests.append(file_sha256(built))
+                os.unlink(built)
+                print(f"{label:<10}{mode:<11}{rss:>8.1f} MiB{elapsed:>8.2f}s")
+            same = digests[0] == digests[1]
+            ok = ok and same
+            print(f"{'':<10}identical output: {same}")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
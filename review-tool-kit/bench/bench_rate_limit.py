@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Check GitLabClient's rate limiter against a local fake GitLab that enforces a limit.
+
+The fake server allows --limit requests per --window seconds (fixed windows
+aligned to the epoch, like GitLab's Rack::Attack throttles), sends RateLimit-Limit /
+RateLimit-Remaining / RateLimit-Reset on every response, and answers 429 + Retry-After once the window is used up.
+--workers threads then issue --requests GETs in total, once with plain urllib3
+retries (no limiter) and once through the RateLimiter. The limiter run fails
+(exit 1) if the server sent any 429 or it took more than --slack times the
+ideal requests/limit*window seconds.
+
+Usage:
+  python bench/bench_rate_limit.py
+  python bench/bench_rate_limit.py --limit 50 --window 1 --requests 300 --workers 16
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "scripts"))
+
+from gitlab_client import GitLabClient, build_session  # noqa: E402
+from gitlab_ratelimit import RateLimiter, format_rate_stats  # noqa: E402
+
+class FixedWindow:
+    """Windows aligned to multiples of `window` since the epoch, as Rack::Attack (GitLab) counts them."""
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self.index = -1
+        self.count = 0
+        self.served = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def hit(self) -> tuple:
+        with self.lock:
+            index = int(time.time() // self.window)
+            if index != self.index:
+                self.index, self.count = index, 0
+            self.count += 1
+            reset = (index + 1) * self.window
+            ok = self.count <= self.limit
+            if ok:
+                self.served += 1
+            else:
+                self.rejected += 1
+            return ok, max(0, self.limit - self.count), reset
+
+def make_handler(win: FixedWindow, delay: float):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            ok, remaining, reset = win.hit()
+            time.sleep(delay)
+            body = json.dumps({"ok": ok}).encode()
+            self.send_response(200 if ok else 429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("RateLimit-Limit", str(win.limit))
+            self.send_header("RateLimit-Remaining", str(remaining))
+            self.send_header("RateLimit-Reset", str(int(reset + 0.999)))
+            if not ok:
+                self.send_header("Retry-After", str(max(1, int(reset - time.time() + 0.999))))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+def run_once(args: argparse.Namespace, use_limiter: bool) -> tuple:
+    """(elapsed seconds, 429s sent by the server)."""
+    win = FixedWindow(args.limit, args.window)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(win, args.delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        limiter = RateLimiter(max_rps=args.max_rps, max_concurrency=args.workers) if use_limiter else None
+        gl = GitLabClient(
+            base_url=f"http://127.0.0.1:{server.server_address[1]}",
+            token="bench",
+            session=build_session(pool_size=args.workers, retry_429=limiter is None),
+            limiter=limiter,
+        )
+        failed = 0
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for r in pool.map(lambda i: gl.get(f"/projects/1/merge_requests/{i}"), range(args.requests)):
+                failed += r.status_code != 200
+        elapsed = time.perf_counter() - t0
+        label = "limiter" if use_limiter else "urllib3 retry"
+        print(f"{label:<14} {elapsed:7.2f}s  ok={args.requests - failed:<5} failed={failed:<4} "
+              f"429 sent by server={win.rejected:<5} throughput={(args.requests - failed) / elapsed:6.1f} req/s")
+        if limiter is not None:
+            print("  " + format_rate_stats(limiter))
+        return elapsed, win.rejected
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Rate limiter vs plain retries against a rate-limited fake GitLab.")
+    ap.add_argument("--limit", type=int, default=40, help="Requests allowed per window")
+    ap.add_argument("--window", type=float, default=2.0, help="Window length (seconds)")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--delay", type=float, default=0.02, help="Server latency per request (seconds)")
+    ap.add_argument("--max-rps", type=float, default=100.0, help="Limiter ceiling (requests/second)")
+    ap.add_argument("--slack", type=float, default=1.2, help="Allowed limiter time as a multiple of the ideal time")
+    args = ap.parse_args()
+
+    ideal = args.requests / args.limit * args.window
+    print(f"limit {args.limit}/{args.window:g}s, {args.requests} requests, {args.workers} workers (ideal ~{ideal:.1f}s)")
+    run_once(args, use_limiter=False)
+    elapsed, rejected = run_once(args, use_limiter=True)
+    failures = []
+    if rejected:
+        failures.append(f"limiter run got {rejected} 429s (expected 0)")
+    if elapsed > ideal * args.slack:
+        failures.append(f"limiter run took {elapsed:.2f}s > {args.slack:g} x ideal {ideal:.1f}s")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -21,15 +21,125 @@ MR_URLS = [
   # "https://gitlab.com/group/subgroup/repo/-/merge_requests/17",
 ]
 
+# --discover：MR一覧APIから対象MRを自動列挙（MR_URLS の代わり）
+DISCOVER_PROJECTS = [
+  # "group/subgroup/repo",
+]
+DISCOVER_UPDATED_AFTER = "180d"   # ISO8601 日付/日時 または "<N>d"（N日前）。空なら無制限
+DISCOVER_UPDATED_BEFORE = ""
+DISCOVER_STATE = "merged"         # opened / closed / merged / locked / all
+DISCOVER_LABELS = []              # 指定ラベルをすべて持つMRのみ
+
 # 出力ディレクトリ
 OUT_DIR = "./out"
 REVIEW_OUT_DIR = "./review_out"
 
+# gitlab_export_mr.py の同時エクスポート数（--jobs の既定値）
+EXPORT_JOBS = 1
+
+# gitlab_export_mr.py / gitlab_fetch_mr_comments.py の間で、この秒数以内に取得済みのMRデータ（コメント）は
+# 再取得せず流用（0 で無効。--refresh で常に再取得）
+# 既定は無効。機能1・機能2を続けて実行する場合は 600 程度を設定すると、同じコメントを二重に取得しません
+SHARED_FETCH_MAX_AGE_SEC = 0
+
+# --incremental の削除ノート検出は件数比較による近似のため、差分同期がこの回数続くか、
+# 最後の全件同期からこの秒数が経つと discussions を全件取り直す（0 でそれぞれ無効）
+INCREMENTAL_FULL_SYNC_EVERY = 10
+INCREMENTAL_FULL_SYNC_MAX_AGE_SEC = 86400
+
+# gitlab_post_ai_review.py のインライン指摘の同時投稿数（--jobs の既定値）
+POST_JOBS = 4
+# gitlab_post_ai_review.py --batch で同時に投稿するMR数（--mr-jobs の既定値）
+POST_MR_JOBS = 4
+
+# インライン指摘の行が差分の表示行にない場合、この行数以内なら最も近い差分行へ寄せて投稿（0 で寄せない）
+# 寄せられない指摘はMR全体ノートに「差分上の位置を特定できなかった指摘」として記載されます
+POSITION_SNAP_LINES = 3
+
+# ページング取得（discussions 等）の同時リクエスト数
+# 1 = 従来通り 1 ページずつ取得。2 以上で X-Total-Pages を使い残りページを並列取得します。
+PAGE_FETCH_JOBS = 1
+
+# クライアント側レートリミッタ（RateLimit-Remaining / RateLimit-Reset を見て送信ペースと同時接続数を自動調整）
+# 有効時は 429 の再試行もリミッタ経由で行い、全スレッドで待機を共有します。
+# 既定は無効（従来通り urllib3 の再試行）。並列度を上げて 429 が出る場合に True にしてください。
+RATE_LIMIT_ENABLED = False
+RATE_LIMIT_MAX_RPS = 20           # 送信レートの上限（req/s）
+RATE_LIMIT_MAX_CONCURRENCY = 16   # 同時リクエスト数の上限
+
+# GitLab GET レスポンスのディスクキャッシュ（<OUT_DIR>/.http_cache）
+# ETag / Last-Modified で条件付きリクエストを送り、304 の場合はディスクから返します。
+# 既定は無効。同じMRを繰り返し取得する（定期実行・パイプライン）場合は True にしてください。
+HTTP_CACHE_ENABLED = False
+HTTP_CACHE_MAX_MB = 512
+
+# 差分の取得元
+# "changes" = /merge_requests/:iid/changes（1レスポンス。巨大MRでは GitLab が overflow で切り詰める）
+# "diffs"   = /merge_requests/:iid/diffs（ページング。GitLab 15.7+）。--diffs-api でも指定可
+DIFF_SOURCE = "changes"
+DIFF_PAGE_SIZE = 20
+
+# 差分フィルタ（除外・サイズ超過のファイルは diff=null + omitted 理由付きで出力に残ります）
+DIFF_INCLUDE_GLOBS = []            # 空 = 全ファイル。例: ["src/*", "*.py"]
+DIFF_EXCLUDE_GLOBS = []            # 例: ["*.lock", "package-lock.json", "*.min.js"]
+DIFF_MAX_BYTES = 0                 # 0 = 無制限
+
+# 出力JSONの形式（gitlab_export_mr.py / gitlab_fetch_mr_comments.py の --compact / --compress の既定値）
+# EXPORT_COMPACT = True で改行・インデントなし。EXPORT_COMPRESSION は "" / "gz" / "xz" / "zst"（zst は zstandard が必要）
+EXPORT_COMPACT = False
+EXPORT_COMPRESSION = ""
+
+# 取得したMR・差分・コメントを SQLite にも保存（(project, iid) 単位で上書き）。空なら無効
+# 例: "./out/mr_store.sqlite"
+MR_DB_PATH = ""
+
 # system note（自動生成メモ等）も含めるか
 INCLUDE_SYSTEM_NOTES = False
 
+# MRレビュー用プロンプトの上限トークン数（概算）。超えるMRは関連ファイル単位で複数のプロンプトに分割（0 で分割しない）
+# build_mr_review_prompt_pack.py --max-tokens / run_review_pipeline.py の既定値。分割レビューは merge_shard_reviews.py で統合
+PROMPT_MAX_TOKENS = 0
+
+# MRレビュー用プロンプトへのMRデータの埋め込み形式（build_mr_review_prompt_pack.py --mr-format / run_review_pipeline.py）
+# "json" = エクスポートJSONをそのまま、"compact" = URL・ID・日時等を省いたテキスト（コメントは path:line 単位のスレッド）
+PROMPT_MR_FORMAT = "json"
+# compact 形式で変更行の前後に残す未変更行数（-1 でエクスポートの差分のまま）
+PROMPT_DIFF_CONTEXT = 3
+
+# build_*_prompt_pack.py --batch の並列プロセス数（--jobs の既定値、0 でCPU数）
+PROMPT_BUILD_JOBS = 0
+
 # コーディングルール（JSON）ファイル
 CODING_RULES_FILE = "./rules/coding_rules.json"
 
+# MRレビュー用プロンプトに入れるコーディングルールを、MRの変更パス・差分に関連する上位 N 件に絞る（0 で全件）
+# ルールの title / description / category / tags の BM25 索引を <OUT_DIR>/.rule_index.json（RULE_INDEX_FILE で変更可）に保存し、
+# ルールファイルの内容が変わったときだけ再構築します。ルール数が N 以下なら従来通り全件を入れます
+# 既定は 0（全件）。ルールが多くプロンプトが大きい場合に 30 程度を設定してください
+RULES_TOP_K = 0
+# importance がこの値以上のルールは関連度にかかわらず必ず入れる（0 で無効）
+RULES_ALWAYS_IMPORTANCE = 5
+RULE_INDEX_FILE = ""
+
+# ルール更新用プロンプトの前処理（build_rules_update_prompt_pack.py --dedup / --no-dedup の既定値）
+# system note・bot・AIレビュー（【By AI reviewer】）・「LGTM」等を除き、ほぼ同じ文面のコメントをまとめ（MinHash）、
+# 既存ルールのタイトルに一致したものは importance の加算だけを指示し、新しい指摘のまとまりだけを件数付きでAIに渡します
+# 既定は無効（従来通りコメントJSONをそのまま渡す）
+RULES_UPDATE_DEDUP = False
+# bot とみなすユーザー名（"bot" / "[bot]" で終わるものは常に除外）
+COMMENT_BOT_USERNAMES = []
+# まとめる類似度（文字3-gramのJaccard、0〜1）と、既存ルールのタイトルとの一致度（タイトルの3-gramのうちコメントに含まれる割合）
+COMMENT_CLUSTER_THRESHOLD = 0.5
+RULE_MATCH_THRESHOLD = 0.6
+# build_rules_update_prompt_pack.py --aggregate の1packの上限トークン数（概算、--max-tokens の既定値、0 で1つにまとめる）
+# packごとのAI出力は merge_rules_updates.py で CODING_RULES_FILE に反映
+RULES_UPDATE_MAX_TOKENS = 0
+# ルール更新のAI出力をルールJSON全体ではなくパッチ（add / bump / merge_tags / edit）にする（--patch / --no-patch の既定値）
+# パッチは merge_rules_updates.py が検証してから CODING_RULES_FILE に反映（ID採番・updated_at 更新もローカルで行う）
+RULES_UPDATE_PATCH = False
+
 # MRレビュー用：コーディングガイドライン（Markdown）
 GUIDELINES_MD_FILE = "./in/guidelines.md"
+
+# run_review_pipeline.py のモデル: "stub"（LLMを呼ばない）または "module:function"
+REVIEW_MODEL = "stub"
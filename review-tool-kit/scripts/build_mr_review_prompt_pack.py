@@ -4,28 +4,54 @@ from __future__ import annotations
 """Build a single prompt pack for MR review by injecting:
 - system/user templates
 - guidelines.md
-- findings stock json
-- MR export json
+- findings stock json (--rules-top-k: only the rules relevant to the MR, see rule_index.py)
+- MR export json (--mr-format compact: threaded compact text, see prompt_compact.py)
 
 Output: ./in/compiled/<mr_stem>.mr_review.prompt.md
+        (--max-tokens: <mr_stem>.shard<i>of<n>.mr_review.prompt.md when the MR does not fit, see prompt_shards.py)
+        (--batch: every export in OUT_DIR/mr, unchanged ones skipped via <out-dir>/.mr_review.manifest.json, see prompt_batch.py)
 
 Usage:
   python scripts/build_mr_review_prompt_pack.py --mr-json ./out/mr/foo__iid_17.mr.json
+  python scripts/build_mr_review_prompt_pack.py --from-db "group/repo!17" --path-glob "*.py"   (config.MR_DB_PATH)
+  python scripts/build_mr_review_prompt_pack.py --mr-json ./out/mr/foo__iid_17.mr.json --max-tokens 100000
+  python scripts/build_mr_review_prompt_pack.py --mr-json ./out/mr/foo__iid_17.mr.json --rules-top-k 30
+  python scripts/build_mr_review_prompt_pack.py --mr-json ./out/mr/foo__iid_17.mr.json --mr-format compact --diff-context 1
+  python scripts/build_mr_review_prompt_pack.py --batch --jobs 8
 """
 
 import argparse
+import json
 import pathlib
 
 import importlib.util
+import os
 import pathlib
 import shutil
 import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from export_io import output_stem, strip_compression
+from mr_db import open_mr_store, parse_mr_ref
+from mr_export_stream import iter_export_text, iter_json_text, load_export
+from prompt_batch import find_exports, run_batch, shared_key
+from prompt_compact import compact_mr_text, iter_compact_mr
+from prompt_prefix import PREFIX_PLACEHOLDER, PREFIX_VALUE, prefix_report, prompt_file_stats
+from prompt_shards import estimate_tokens, estimate_tokens_iter, shard_payloads, shard_stem
+from prompt_template import Template, Value, check_values, iter_render, parse_template, render, render_to_file
+from rule_index import RuleSelector, open_rule_selector
 
 HERE = pathlib.Path(__file__).resolve().parent.parent
-CONFIG_FILE = HERE / "config.py"
+MR_FORMATS = ("json", "compact")
+# REVIEW_TOOLKIT_CONFIG lets CI jobs / benchmarks point at a generated config file.
+CONFIG_FILE = pathlib.Path(os.environ.get("REVIEW_TOOLKIT_CONFIG") or HERE / "config.py")
 TEMPLATE_FILE = HERE / "config.template.py"
 
 def load_config_module():
+    # Scripts imported into one process (run_review_pipeline.py) share a single config module.
+    cached = sys.modules.get("review_toolkit_config")
+    if cached is not None:
+        return cached
     if not CONFIG_FILE.exists():
         if TEMPLATE_FILE.exists():
             shutil.copyfile(TEMPLATE_FILE, CONFIG_FILE)
@@ -39,6 +65,7 @@ def load_config_module():
         raise RuntimeError("config.py の読み込みに失敗しました。")
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    sys.modules["review_toolkit_config"] = module
     return module
 
 config = load_config_module()
@@ -46,47 +73,237 @@ config = load_config_module()
 def read_text(p: pathlib.Path) -> str:
     return p.read_text(encoding="utf-8")
 
-def main() -> int:
-    ap = argparse.ArgumentParser(description="Build prompt pack for MR review (guidelines + stock + MR json).")
-    ap.add_argument("--mr-json", required=True, help="Path to MR export json (from gitlab_export_mr.py)")
-    ap.add_argument("--out-dir", default="./in/compiled", help="Output directory")
-    args = ap.parse_args()
-
+def load_prompt_inputs() -> Dict[str, str]:
+    """Read the MR-independent inputs (templates, guidelines, coding rules) once."""
     in_dir = HERE / "in" / "mr_review"
-    template = read_text(in_dir / "prompt_pack_template.md")
-    system_prompt = read_text(in_dir / "system_prompt.md")
-    user_prompt = read_text(in_dir / "user_prompt.md")
-    review_req = read_text(in_dir / "review_request.md")
-
     guidelines_file = pathlib.Path(str(getattr(config, "GUIDELINES_MD_FILE", "./in/guidelines.md")))
     # Use coding rules as the authoritative historical stock for MR review.
     stock_file = pathlib.Path(str(getattr(config, "CODING_RULES_FILE", "./rules/coding_rules.json")))
-    mr_file = pathlib.Path(args.mr_json)
 
     if not guidelines_file.exists():
         raise FileNotFoundError(f"GUIDELINES_MD_FILE not found: {guidelines_file}")
     if not stock_file.exists():
         raise FileNotFoundError(f"CODING_RULES_FILE not found: {stock_file}")
-    if not mr_file.exists():
+
+    return {
+        "template": read_text(in_dir / "prompt_pack_template.md"),
+        "system_prompt": read_text(in_dir / "system_prompt.md"),
+        "user_prompt": read_text(in_dir / "user_prompt.md"),
+        "review_request": read_text(in_dir / "review_request.md"),
+        "review_request_compact": read_text(in_dir / "review_request_compact.md") if (in_dir / "review_request_compact.md").exists() else "",
+        "mr_coding_rules": read_text(in_dir / "mr_coding_rules.md") if (in_dir / "mr_coding_rules.md").exists() else "",
+        "guidelines_md": read_text(guidelines_file),
+        "coding_rules_json": read_text(stock_file),
+    }
+
+def prompt_template(inputs: Dict[str, str], mr_data: Value, mr_format: str = "json") -> Tuple[Template, Dict[str, Value]]:
+    """(template, values): prompt_pack_template.md with the prompt files as nested templates.
+
+    mr_format "json" embeds mr_data as {{MR_JSON}} (review_request.md), "compact"
+    as {{MR_COMPACT}} (review_request_compact.md, see prompt_compact.py).
+    Rules picked for the MR (inputs["mr_coding_rules_json"], see inputs_for_mr())
+    go after the shared prefix via mr_coding_rules.md (see prompt_prefix.py).
+    """
+    if mr_format not in MR_FORMATS:
+        raise ValueError(f"unknown MR prompt format: {mr_format} (choose from {', '.join(MR_FORMATS)})")
+    if mr_format == "compact":
+        if not inputs.get("review_request_compact"):
+            raise FileNotFoundError("in/mr_review/review_request_compact.md not found")
+        request = parse_template(inputs["review_request_compact"], "review_request_compact.md")
+    else:
+        request = parse_template(inputs["review_request"], "review_request.md")
+    mr_rules = inputs.get("mr_coding_rules_json") or ""
+    if mr_rules and not inputs.get("mr_coding_rules"):
+        raise FileNotFoundError("in/mr_review/mr_coding_rules.md not found")
+    return parse_template(inputs["template"], "prompt_pack_template.md"), {
+        "SYSTEM_PROMPT": parse_template(inputs["system_prompt"], "system_prompt.md"),
+        "USER_PROMPT": parse_template(inputs["user_prompt"], "user_prompt.md"),
+        "REVIEW_REQUEST": request,
+        "GUIDELINES_MD": inputs["guidelines_md"],
+        "CODING_RULES_JSON": inputs["coding_rules_json"],
+        PREFIX_PLACEHOLDER: PREFIX_VALUE,
+        "MR_CODING_RULES": parse_template(inputs["mr_coding_rules"], "mr_coding_rules.md") if mr_rules else "",
+        "MR_CODING_RULES_JSON": mr_rules,
+        "MR_COMPACT" if mr_format == "compact" else "MR_JSON": mr_data,
+    }
+
+def compile_prompt(inputs: Dict[str, str], mr_data: Value, mr_format: str = "json") -> str:
+    return render(*prompt_template(inputs, mr_data, mr_format))
+
+def write_prompt(inputs: Dict[str, str], mr_data: Value, out_path: pathlib.Path, mr_format: str = "json") -> None:
+    """compile_prompt() streamed into out_path; pass mr_data as a chunk callable to avoid the full text in memory."""
+    render_to_file(*prompt_template(inputs, mr_data, mr_format), str(out_path))
+
+def estimate_prompt_tokens(inputs: Dict[str, str], mr_data: Value, mr_format: str = "json") -> int:
+    template, values = prompt_template(inputs, mr_data, mr_format)
+    check_values(template, values)
+    return estimate_tokens_iter(iter_render(template, values))
+
+def mr_prompt_text(payload: Dict[str, Any], mr_format: str = "json", diff_context: int = 3) -> str:
+    """The MR part of the prompt for an in-memory payload."""
+    if mr_format == "compact":
+        return compact_mr_text(payload, diff_context)
+    return json.dumps(payload, ensure_ascii=False, indent=2)
+
+def inputs_for_mr(inputs: Dict[str, str], payload: Dict[str, Any], selector: Optional[RuleSelector]) -> Dict[str, str]:
+    """inputs with the coding rules narrowed to the ones relevant to this MR (see rule_index.py); unchanged without a selector.
+
+    CODING_RULES_JSON (shared prefix) gets the always-include rules, MR_CODING_RULES_JSON the ones picked for the MR.
+    """
+    if selector is None:
+        return inputs
+    rules_json, kept = selector.rules_json(payload)
+    print(f"INFO: coding rules {len(selector.always) + kept}/{len(selector.rules)} injected"
+          f" ({len(selector.always)} shared, {kept} for this MR; top-k={selector.top_k})", file=sys.stderr)
+    return dict(inputs, coding_rules_json=selector.shared_json, mr_coding_rules_json=rules_json)
+
+def compile_shards(
+    inputs: Dict[str, str],
+    payload: Dict[str, Any],
+    max_tokens: int,
+    mr_format: str = "json",
+    diff_context: int = 3,
+) -> List[Tuple[Dict[str, Any], str]]:
+    """(MR payload, prompt) per shard so that each prompt is estimated within max_tokens (see prompt_shards.py).
+
+    Shards are sized on the JSON form, so compact prompts come out smaller than the budget.
+    """
+    budget = max_tokens - estimate_tokens(compile_prompt(inputs, "", mr_format))
+    if budget <= 0:
+        raise ValueError(f"--max-tokens {max_tokens} is smaller than the shared preamble (guidelines, rules, prompts)")
+    return [
+        (p, compile_prompt(inputs, mr_prompt_text(p, mr_format, diff_context), mr_format))
+        for p in shard_payloads(payload, budget)
+    ]
+
+def build_pack(
+    inputs: Dict[str, str],
+    selector: Optional[RuleSelector],
+    mr_json: Value,
+    load_payload: Callable[[], Dict[str, Any]],
+    stem: str,
+    out_dir: pathlib.Path,
+    max_tokens: int = 0,
+    mr_format: str = "json",
+    diff_context: int = 3,
+) -> List[str]:
+    """Write the prompt pack (or its shards) of one MR into out_dir; returns the written paths.
+
+    mr_json is the export JSON text as chunks; load_payload() is called only when
+    the rule selector, sharding or the compact format needs the parsed export.
+    Raises ValueError (TemplateError, budget smaller than the preamble).
+    """
+    compact = mr_format == "compact"
+    payload = load_payload() if (selector is not None or max_tokens > 0 or compact) else {}
+    inputs = inputs_for_mr(inputs, payload, selector)
+    mr_data: Value = mr_json
+    if compact:
+        mr_data = lambda: iter_compact_mr(payload, diff_context)
+        raw = estimate_tokens_iter(mr_json())  # type: ignore[operator]
+        small = estimate_tokens_iter(mr_data())  # type: ignore[operator]
+        print(f"INFO: MR data ~{small} tokens compact (diff context {diff_context}) vs ~{raw} tokens raw JSON"
+              f" ({(raw - small) / raw * 100 if raw else 0:.0f}% saved)")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    total = estimate_prompt_tokens(inputs, mr_data, mr_format) if max_tokens > 0 else 0
+    if max_tokens <= 0 or total <= max_tokens:
+        out_path = out_dir / (stem + ".mr_review.prompt.md")
+        write_prompt(inputs, mr_data, out_path, mr_format)
+        print(f"OK: wrote {out_path}" + (f" (~{total} tokens)" if max_tokens > 0 else ""))
+        return [str(out_path)]
+    shards = compile_shards(inputs, payload, max_tokens, mr_format, diff_context)
+    print(f"INFO: ~{total} tokens > --max-tokens {max_tokens}; split into {len(shards)} shards")
+
+    written: List[str] = []
+    for n, (_, prompt) in enumerate(shards, start=1):
+        out_path = out_dir / (shard_stem(stem, n, len(shards)) + ".mr_review.prompt.md")
+        out_path.write_text(prompt, encoding="utf-8")
+        written.append(str(out_path))
+        print(f"OK: wrote {out_path} (~{estimate_tokens(prompt)} tokens)")
+        if estimate_tokens(prompt) > max_tokens:
+            print(f"WARN: {out_path.name} は上限を超えています（1ファイルの差分、またはファイルに紐付かないコメントが大きいため分割できません）。", file=sys.stderr)
+    print("INFO: 各shardのレビュー結果は scripts/merge_shard_reviews.py で1つの review json に統合してください。")
+    return written
+
+def build_file_pack(inputs: Dict[str, str], selector: Optional[RuleSelector], mr_file: str, out_dir: pathlib.Path, **options: Any) -> List[str]:
+    """build_pack() for an export file (.mr.json / .mr.jsonl, compact / compressed)."""
+    if not os.path.exists(mr_file):
         raise FileNotFoundError(f"MR json not found: {mr_file}")
+    # .mr.jsonl (--stream) and compact / compressed exports are re-rendered into the classic .mr.json text.
+    stem = pathlib.Path(strip_compression(mr_file)).stem
+    return build_pack(inputs, selector, lambda: iter_export_text(mr_file), lambda: load_export(mr_file), stem, out_dir, **options)
 
-    compiled = template
-    compiled = compiled.replace("{{SYSTEM_PROMPT}}", system_prompt)
-    compiled = compiled.replace("{{USER_PROMPT}}", user_prompt)
+# --batch: what every pool worker needs, installed once per process by _init_batch_worker().
+_BATCH: Dict[str, Any] = {}
 
-    rr = review_req
-    rr = rr.replace("{{GUIDELINES_MD}}", read_text(guidelines_file))
-    rr = rr.replace("{{CODING_RULES_JSON}}", read_text(stock_file))
-    rr = rr.replace("{{MR_JSON}}", read_text(mr_file))
+def _init_batch_worker(inputs: Dict[str, str], selector: Optional[RuleSelector], out_dir: str, options: Dict[str, Any]) -> None:
+    _BATCH.update(inputs=inputs, selector=selector, out_dir=pathlib.Path(out_dir), options=options)
 
-    compiled = compiled.replace("{{REVIEW_REQUEST}}", rr)
+def _build_batch_pack(mr_file: str) -> Dict[str, Dict[str, Any]]:
+    paths = build_file_pack(_BATCH["inputs"], _BATCH["selector"], mr_file, _BATCH["out_dir"], **_BATCH["options"])
+    return {p: prompt_file_stats(p) for p in paths}
 
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Build prompt pack for MR review (guidelines + stock + MR json).")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--mr-json", help="Path to MR export .mr.json / .mr.jsonl (from gitlab_export_mr.py)")
+    src.add_argument("--from-db", metavar="PROJECT!IID", help="Read the MR from the SQLite store (config.MR_DB_PATH), e.g. group/repo!17")
+    src.add_argument("--batch", nargs="?", const="", metavar="DIR",
+                     help="Build every export in DIR (default: OUT_DIR/mr); packs whose inputs are unchanged are skipped")
+    ap.add_argument("--path-glob", action="append", default=[],
+                    help="With --from-db: only diffs/comments on matching paths (repeatable, SQLite GLOB)")
+    ap.add_argument("--db", help="SQLite store path (default: config.MR_DB_PATH)")
+    ap.add_argument("--out-dir", default="./in/compiled", help="Output directory")
+    ap.add_argument("--max-tokens", type=int, default=int(getattr(config, "PROMPT_MAX_TOKENS", 0) or 0),
+                    help="Split the MR into several prompt packs of at most ~N tokens each (default: config.PROMPT_MAX_TOKENS, 0 = no limit)")
+    ap.add_argument("--rules-top-k", type=int, default=int(getattr(config, "RULES_TOP_K", 0) or 0),
+                    help="Inject only the N coding rules most relevant to the MR, plus always-include ones (default: config.RULES_TOP_K, 0 = all)")
+    ap.add_argument("--mr-format", choices=MR_FORMATS, default=str(getattr(config, "PROMPT_MR_FORMAT", "json") or "json"),
+                    help="MR data in the prompt: raw export JSON, or compact threaded text (default: config.PROMPT_MR_FORMAT)")
+    ap.add_argument("--diff-context", type=int, default=int(getattr(config, "PROMPT_DIFF_CONTEXT", 3)),
+                    help="With --mr-format compact: unchanged lines kept around each change (-1 = as exported; default: config.PROMPT_DIFF_CONTEXT)")
+    ap.add_argument("--jobs", type=int, default=int(getattr(config, "PROMPT_BUILD_JOBS", 0) or 0),
+                    help="With --batch: packs built in parallel processes (default: config.PROMPT_BUILD_JOBS, 0 = CPU count)")
+    ap.add_argument("--force", action="store_true", help="With --batch: rebuild every pack, ignoring the manifest")
+    args = ap.parse_args()
+
+    inputs = load_prompt_inputs()
+    selector = open_rule_selector(config, args.rules_top_k)
     out_dir = pathlib.Path(args.out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
+    options = {"max_tokens": args.max_tokens, "mr_format": args.mr_format, "diff_context": args.diff_context}
+
+    if args.batch is not None:
+        mr_dir = args.batch or os.path.join(str(getattr(config, "OUT_DIR", "./out")).strip(), "mr")
+        sources = [os.path.abspath(p) for p in find_exports(mr_dir, (".mr.json", ".mr.jsonl"))]
+        if not sources:
+            print(f"ERROR: {mr_dir} に *.mr.json / *.mr.jsonl がありません。", file=sys.stderr)
+            return 2
+        # The rules actually injected depend on the selector settings, so they are part of the key.
+        key = shared_key(inputs, options, [selector.top_k, selector.always_importance] if selector else None)
+        result = run_batch(
+            sources, str(out_dir / ".mr_review.manifest.json"), key, _build_batch_pack, _init_batch_worker,
+            (inputs, selector, str(out_dir.resolve()), options), args.jobs or os.cpu_count() or 1, args.force)
+        report, same_prefix = prefix_report({os.path.basename(p): st for p, st in result.outputs.items()})
+        print(report, file=sys.stdout if same_prefix else sys.stderr)
+        print(f"DONE: {result.built} built, {result.skipped} skipped, {result.failed} failed")
+        return 1 if result.failed or not same_prefix else 0
 
-    out_path = out_dir / (mr_file.stem + ".mr_review.prompt.md")
-    out_path.write_text(compiled, encoding="utf-8")
-    print(f"OK: wrote {out_path}")
+    try:
+        if args.from_db:
+            db = open_mr_store(config, args.db)
+            if db is None:
+                raise FileNotFoundError("MR_DB_PATH is not set (config.py) and --db was not given")
+            project_path, iid = parse_mr_ref(args.from_db)
+            payload = db.export_payload(project_path, iid, path_globs=args.path_glob)
+            if payload is None:
+                raise FileNotFoundError(f"MR not in store: {args.from_db}")
+            build_pack(inputs, selector, lambda: iter_json_text(payload), lambda: payload,
+                       output_stem(payload["mr"]) + ".mr", out_dir, **options)
+        else:
+            build_file_pack(inputs, selector, args.mr_json, out_dir, **options)
+    except ValueError as e:  # TemplateError, budget smaller than the preamble
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
     return 0
 
 if __name__ == "__main__":
@@ -3,27 +3,53 @@
 from __future__ import annotations
 """Build a single prompt pack for 'coding rules update' by injecting:
 - existing coding rules JSON
-- fetched MR comments JSON
+- fetched MR comments JSON (--dedup: clusters of near-duplicate comments, see comment_clusters.py)
 
 Output: ./in/compiled/<name>.rules_update.prompt.md
+        (--batch: every export in OUT_DIR/comments, unchanged ones skipped via <out-dir>/.rules_update.manifest.json, see prompt_batch.py)
+        (--aggregate: <name>[.shard<i>of<n>].rules_update.prompt.md over many MRs, merged back with merge_rules_updates.py)
 
 Usage:
   python scripts/build_rules_update_prompt_pack.py --comments-json ./out/comments/foo__iid_17.comments.json
+  python scripts/build_rules_update_prompt_pack.py --comments-json ./out/comments/foo__iid_17.comments.json.gz
+  python scripts/build_rules_update_prompt_pack.py --from-db "group/repo!17" --unresolved-only   (config.MR_DB_PATH)
+  python scripts/build_rules_update_prompt_pack.py --batch --jobs 8
+  python scripts/build_rules_update_prompt_pack.py --comments-json ./out/comments/foo__iid_17.comments.json --dedup --apply-increments
+  python scripts/build_rules_update_prompt_pack.py --aggregate ./out/comments --with-db --max-tokens 60000
+  python scripts/build_rules_update_prompt_pack.py --comments-json ./out/comments/foo__iid_17.comments.json --patch
 """
 
 import argparse
+import glob
+import json
 import pathlib
 
 import importlib.util
+import os
 import pathlib
 import shutil
 import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from comment_clusters import CLUSTER_THRESHOLD, RULE_MATCH_THRESHOLD, apply_increments, digest_comments, load_rules, mr_ref, save_rules
+from export_io import output_stem, strip_compression
+from mr_db import note_matches, open_mr_store, parse_mr_ref
+from mr_export_stream import iter_export_text, iter_json_text, load_export
+from prompt_batch import file_digest, find_exports, run_batch, shared_key
+from prompt_prefix import PREFIX_PLACEHOLDER, PREFIX_VALUE, prefix_report, prompt_file_stats
+from prompt_shards import estimate_tokens, estimate_tokens_iter, pack_items, shard_stem
+from prompt_template import Template, TemplateError, Value, check_values, file_chunks, iter_render, parse_template, render_to_file
 
 HERE = pathlib.Path(__file__).resolve().parent.parent
-CONFIG_FILE = HERE / "config.py"
+# REVIEW_TOOLKIT_CONFIG lets CI jobs / benchmarks point at a generated config file.
+CONFIG_FILE = pathlib.Path(os.environ.get("REVIEW_TOOLKIT_CONFIG") or HERE / "config.py")
 TEMPLATE_FILE = HERE / "config.template.py"
 
 def load_config_module():
+    # Scripts imported into one process (run_review_pipeline.py) share a single config module.
+    cached = sys.modules.get("review_toolkit_config")
+    if cached is not None:
+        return cached
     if not CONFIG_FILE.exists():
         if TEMPLATE_FILE.exists():
             shutil.copyfile(TEMPLATE_FILE, CONFIG_FILE)
@@ -37,6 +63,7 @@ def load_config_module():
         raise RuntimeError("config.py の読み込みに失敗しました。")
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    sys.modules["review_toolkit_config"] = module
     return module
 
 config = load_config_module()
@@ -44,39 +71,329 @@ config = load_config_module()
 def read_text(p: pathlib.Path) -> str:
     return p.read_text(encoding="utf-8")
 
-def main() -> int:
-    ap = argparse.ArgumentParser(description="Build prompt pack for coding rules merge/update.")
-    ap.add_argument("--comments-json", required=True, help="Path to comments json (from gitlab_fetch_mr_comments.py)")
-    ap.add_argument("--out-dir", default="./in/compiled", help="Output directory")
-    args = ap.parse_args()
+def load_prompt_inputs(patch: bool = False) -> Dict[str, Any]:
+    """Read the comments-independent inputs (templates; the rules file is streamed) once.
 
+    patch=True: the prompts ask for a rule patch (output_patch.md, applied by
+    merge_rules_updates.py) instead of the full updated rules JSON.
+    """
     in_dir = HERE / "in" / "rules_update"
-    template = read_text(in_dir / "prompt_pack_template.md")
-    system_prompt = read_text(in_dir / "system_prompt.md")
-    user_prompt = read_text(in_dir / "user_prompt.md")
-    update_req = read_text(in_dir / "update_request.md")
-
     rules_file = pathlib.Path(str(getattr(config, "CODING_RULES_FILE", "./rules/coding_rules.json")))
     if not rules_file.exists():
         raise FileNotFoundError(f"CODING_RULES_FILE not found: {rules_file}")
+    suffix = "_patch" if patch else ""
+    return {
+        "template": read_text(in_dir / "prompt_pack_template.md"),
+        "system_prompt": read_text(in_dir / f"system_prompt{suffix}.md"),
+        "user_prompt": read_text(in_dir / f"user_prompt{suffix}.md"),
+        "output_format": read_text(in_dir / ("output_patch.md" if patch else "output_rules.md")),
+        "patch": patch,
+        "update_request": read_text(in_dir / "update_request.md"),
+        "update_request_clusters": read_text(in_dir / "update_request_clusters.md") if (in_dir / "update_request_clusters.md").exists() else "",
+        "rules_file": str(rules_file.resolve()),
+    }
+
+def dedup_options(args: argparse.Namespace, force: bool = False) -> Optional[Dict[str, Any]]:
+    """comment_clusters.digest_comments() settings from the CLI / config, or None without --dedup (and not force)."""
+    if not (args.dedup or force):
+        return None
+    return {
+        "bot_usernames": [str(u) for u in getattr(config, "COMMENT_BOT_USERNAMES", []) or []],
+        "cluster_threshold": float(getattr(config, "COMMENT_CLUSTER_THRESHOLD", CLUSTER_THRESHOLD)),
+        "rule_threshold": float(getattr(config, "RULE_MATCH_THRESHOLD", RULE_MATCH_THRESHOLD)),
+        "apply": bool(getattr(args, "apply_increments", False)),
+    }
+
+def clusters_payload(inputs: Dict[str, Any], payloads: List[Dict[str, Any]], dedup: Dict[str, Any], raw_tokens: int) -> Dict[str, Any]:
+    """MR_COMMENT_CLUSTERS_JSON for comments payloads (see comment_clusters.py); prints what was removed.
+
+    With dedup["apply"] the importance increments are written to CODING_RULES_FILE
+    here (atomically, with updated_at) instead of being left to the AI.
+    """
+    stock = load_rules(inputs["rules_file"])
+    rules = [r for r in stock["rules"] if isinstance(r, dict)]
+    digest = digest_comments(payloads, rules, dedup["bot_usernames"], dedup["cluster_threshold"], dedup["rule_threshold"])
+    increments = digest.increments
+    if dedup["apply"] and increments:
+        for rule_id, old, new in apply_increments(stock, increments):
+            print(f"INFO: {rule_id} importance {old} -> {new}")
+        save_rules(inputs["rules_file"], stock)
+        print(f"OK: wrote {inputs['rules_file']}")
+        increments = []
+    payload: Dict[str, Any] = {"mr": payloads[0].get("mr")} if len(payloads) == 1 else {"mrs": len(payloads)}
+    payload.update(importance_increments=increments, clusters=digest.clusters, stats=digest.stats)
 
-    comments_file = pathlib.Path(args.comments_json)
-    if not comments_file.exists():
+    st = digest.stats
+    small = estimate_tokens_iter(iter_json_text(payload))
+    dropped = ", ".join(f"{k} {v}" for k, v in st["dropped"].items()) or "none"
+    print(f"INFO: comments {st['comments']} -> {st['novel_clusters']} novel clusters ({st['novel_comments']} comments);"
+          f" dropped: {dropped}; {st['matched_comments']} comments matched {st['matched_rules']} existing rules")
+    print(f"INFO: MR comments ~{raw_tokens} -> ~{small} tokens ({(raw_tokens - small) / raw_tokens * 100 if raw_tokens else 0:.0f}% reduction)")
+    if not digest.clusters:
+        print("INFO: no novel comment clusters; the AI has nothing new to learn from this input.")
+    return payload
+
+def pack_template(inputs: Dict[str, Any], comments_json: Value, clusters: bool = False) -> Tuple[Template, Dict[str, Value]]:
+    """(template, values) of a rules update prompt.
+
+    clusters=True: comments_json is a clusters_payload() and goes through update_request_clusters.md.
+    """
+    if clusters and not inputs.get("update_request_clusters"):
+        raise FileNotFoundError("in/rules_update/update_request_clusters.md not found")
+    request = "update_request_clusters" if clusters else "update_request"
+    update_request = parse_template(inputs[request], f"{request}.md")
+    if inputs.get("patch") and "OUTPUT_FORMAT" not in update_request.placeholders:
+        raise TemplateError(f"{request}.md has no {{{{OUTPUT_FORMAT}}}}; the prompt would not ask for a patch")
+    return parse_template(inputs["template"], "prompt_pack_template.md"), {
+        "SYSTEM_PROMPT": parse_template(inputs["system_prompt"], "system_prompt.md"),
+        "USER_PROMPT": parse_template(inputs["user_prompt"], "user_prompt.md"),
+        "UPDATE_REQUEST": update_request,
+        "OUTPUT_FORMAT": parse_template(inputs["output_format"], "output_format.md"),
+        "CODING_RULES_JSON": file_chunks(inputs["rules_file"]),
+        PREFIX_PLACEHOLDER: PREFIX_VALUE,
+        "MR_COMMENT_CLUSTERS_JSON" if clusters else "MR_COMMENTS_JSON": comments_json,
+    }
+
+def build_pack(inputs: Dict[str, Any], comments_json: Value, stem: str, out_dir: pathlib.Path, clusters: bool = False) -> List[str]:
+    """Write the rules update prompt pack of one MR into out_dir; returns the written paths (TemplateError on a bad template)."""
+    template, values = pack_template(inputs, comments_json, clusters)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / (stem + ".rules_update.prompt.md")
+    render_to_file(template, values, str(out_path))
+    print(f"OK: wrote {out_path}")
+    return [str(out_path)]
+
+def build_file_pack(inputs: Dict[str, Any], comments_file: str, out_dir: pathlib.Path, dedup: Optional[Dict[str, Any]] = None) -> List[str]:
+    """build_pack() for a .comments.json file (compact / compressed ones are re-rendered into the indent=2 text)."""
+    if not os.path.exists(comments_file):
         raise FileNotFoundError(f"comments json not found: {comments_file}")
+    stem = pathlib.Path(strip_compression(comments_file)).stem
+    if dedup is None:
+        return build_pack(inputs, lambda: iter_export_text(comments_file), stem, out_dir)
+    raw = estimate_tokens_iter(iter_export_text(comments_file))
+    payload = clusters_payload(inputs, [load_export(comments_file)], dedup, raw)
+    return build_pack(inputs, lambda: iter_json_text(payload), stem, out_dir, clusters=True)
+
+def aggregate_files(patterns: List[str]) -> List[str]:
+    """.comments.json files for --aggregate: directories (newest variant per MR, as --batch) and globs, first occurrence kept."""
+    files: List[str] = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = find_exports(pattern, (".comments.json",))
+        else:
+            found = sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else [])
+        files.extend(os.path.abspath(p) for p in found)
+    return list(dict.fromkeys(files))
+
+def aggregate_payloads(files: List[str], db: Any = None, unresolved_only: bool = False, path_globs: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """Comments payloads of the files, then of every MR in the store; an MR met twice is read from its first source only.
+
+    unresolved_only / path_globs narrow the comments of both sources the same way;
+    unreadable files are skipped with a WARN.
+    """
+    payloads: List[Dict[str, Any]] = []
+    seen = set()
+    repeated = 0
+    for f in files:
+        try:
+            payload = load_export(f)
+        except (OSError, ValueError) as e:
+            print(f"WARN: skipped {f}: {e}", file=sys.stderr)
+            continue
+        if not isinstance(payload, dict):
+            print(f"WARN: skipped {f}: not a comments JSON object", file=sys.stderr)
+            continue
+        ref = mr_ref(payload)
+        if ref in seen:
+            repeated += 1
+            continue
+        seen.add(ref)
+        if unresolved_only or path_globs:
+            comments = [c for c in payload.get("comments") or [] if isinstance(c, dict) and note_matches(c, unresolved_only, path_globs)]
+            payload = {**payload, "comments": comments, "counts": {**(payload.get("counts") or {}), "comments": len(comments)}}
+        payloads.append(payload)
+    if db is not None:
+        for mr in db.list_mrs():
+            if f"{mr['project_path']}!{mr['iid']}" in seen:
+                repeated += 1
+                continue
+            payload = db.comments_payload(mr["project_path"], mr["iid"], unresolved_only=unresolved_only, path_globs=path_globs)
+            if payload is not None:
+                seen.add(mr_ref(payload))
+                payloads.append(payload)
+    if repeated:
+        print(f"INFO: {repeated} MRs appeared in more than one input and were read once")
+    return payloads
 
-    compiled = template
-    compiled = compiled.replace("{{SYSTEM_PROMPT}}", system_prompt)
-    compiled = compiled.replace("{{USER_PROMPT}}", user_prompt)
-    compiled = compiled.replace("{{UPDATE_REQUEST}}", update_req)
-    compiled = compiled.replace("{{CODING_RULES_JSON}}", read_text(rules_file))
-    compiled = compiled.replace("{{MR_COMMENTS_JSON}}", read_text(comments_file))
+def build_aggregate(
+    inputs: Dict[str, Any],
+    payloads: List[Dict[str, Any]],
+    name: str,
+    out_dir: pathlib.Path,
+    dedup: Dict[str, Any],
+    max_tokens: int = 0,
+) -> List[str]:
+    """Rules update packs for the comments of many MRs at once; returns the written paths.
 
+    The comments of all MRs are clustered together (see comment_clusters.py) and the
+    novel clusters are spread over as few packs of at most ~max_tokens as fit (0 =
+    one pack). The importance increments go into pack 1 only, so each pack can be
+    answered on its own and the outputs merged with merge_rules_updates.py.
+    """
+    raw = sum(estimate_tokens_iter(iter_json_text(p)) for p in payloads)
+    digest = clusters_payload(inputs, payloads, dedup, raw)
+    clusters = digest["clusters"]
+
+    def pack_payload(index: int, total: int, members: List[Dict[str, Any]]) -> Dict[str, Any]:
+        first = index == 1
+        return {
+            "mrs": len(payloads),
+            "pack": {"index": index, "total": total},
+            "importance_increments": digest["importance_increments"] if first else [],
+            "clusters": members,
+            **({"stats": digest["stats"]} if first else {}),
+        }
+
+    plan = [list(range(len(clusters)))]
+    if max_tokens > 0:
+        empty = pack_payload(1, 1, [])
+        template, values = pack_template(inputs, lambda: iter_json_text(empty), clusters=True)
+        check_values(template, values)
+        budget = max_tokens - estimate_tokens_iter(iter_render(template, values))
+        if budget <= 0:
+            raise ValueError(f"--max-tokens {max_tokens} is smaller than the shared preamble (rules, prompts, increments)")
+        # One cluster in the indent=2 "clusters" list: its text indented by 4, plus the separator.
+        costs = []
+        for c in clusters:
+            text = json.dumps(c, ensure_ascii=False, indent=2)
+            costs.append(estimate_tokens(text) + text.count("\n") + 2)
+        plan = pack_items(costs, budget)
+
+    written: List[str] = []
+    for n, members in enumerate(plan, start=1):
+        payload = pack_payload(n, len(plan), [clusters[i] for i in members])
+        written += build_pack(inputs, lambda p=payload: iter_json_text(p), shard_stem(name, n, len(plan)), out_dir, clusters=True)
+    # Packs of a previous run with a different pack count.
+    for old in glob.glob(str(out_dir / f"{glob.escape(name)}.shard*of*.rules_update.prompt.md")) + [str(out_dir / f"{name}.rules_update.prompt.md")]:
+        if old not in written and os.path.exists(old):
+            os.unlink(old)
+
+    stats = {os.path.basename(p): prompt_file_stats(p) for p in written}
+    for path, st in stats.items():
+        if max_tokens > 0 and st["tokens"] > max_tokens:
+            print(f"WARN: {path} は上限を超えています（~{st['tokens']} tokens、1つのクラスタが大きいため分割できません）。", file=sys.stderr)
+    if len(written) > 1:
+        print(prefix_report(stats)[0])
+    print(f"INFO: {len(clusters)} novel clusters from {len(payloads)} MRs in {len(written)} packs (one pack per MR: {len(payloads)})")
+    print("INFO: 各packのAI出力は scripts/merge_rules_updates.py で CODING_RULES_FILE にまとめて反映してください。")
+    return written
+
+# --batch: what every pool worker needs, installed once per process by _init_batch_worker().
+_BATCH: Dict[str, Any] = {}
+
+def _init_batch_worker(inputs: Dict[str, Any], out_dir: str, dedup: Optional[Dict[str, Any]]) -> None:
+    _BATCH.update(inputs=inputs, out_dir=pathlib.Path(out_dir), dedup=dedup)
+
+def _build_batch_pack(comments_file: str) -> Dict[str, Dict[str, Any]]:
+    paths = build_file_pack(_BATCH["inputs"], comments_file, _BATCH["out_dir"], _BATCH["dedup"])
+    return {p: prompt_file_stats(p) for p in paths}
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Build prompt pack for coding rules merge/update.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--comments-json", help="Path to comments json (from gitlab_fetch_mr_comments.py)")
+    src.add_argument("--from-db", metavar="PROJECT!IID", help="Read comments from the SQLite store (config.MR_DB_PATH), e.g. group/repo!17")
+    src.add_argument("--batch", nargs="?", const="", metavar="DIR",
+                     help="Build every *.comments.json in DIR (default: OUT_DIR/comments); packs whose inputs are unchanged are skipped")
+    src.add_argument("--aggregate", nargs="*", metavar="DIR_OR_GLOB",
+                     help="One de-duplicated rules update over the *.comments.json of all given directories / globs"
+                          " (default: OUT_DIR/comments), split into --max-tokens packs")
+    ap.add_argument("--unresolved-only", action="store_true", help="With --from-db / --aggregate: only unresolved comments")
+    ap.add_argument("--path-glob", action="append", default=[],
+                    help="With --from-db / --aggregate: only comments on matching paths (repeatable, SQLite GLOB)")
+    ap.add_argument("--with-db", action="store_true", help="With --aggregate: also every MR in the SQLite store")
+    ap.add_argument("--max-tokens", type=int, default=int(getattr(config, "RULES_UPDATE_MAX_TOKENS", 0) or 0),
+                    help="With --aggregate: packs of at most ~N tokens each (default: config.RULES_UPDATE_MAX_TOKENS, 0 = one pack)")
+    ap.add_argument("--name", default="aggregate", help="With --aggregate: output name (<name>[.shard<i>of<n>].rules_update.prompt.md)")
+    ap.add_argument("--db", help="SQLite store path (default: config.MR_DB_PATH)")
+    ap.add_argument("--out-dir", default="./in/compiled", help="Output directory")
+    ap.add_argument("--jobs", type=int, default=int(getattr(config, "PROMPT_BUILD_JOBS", 0) or 0),
+                    help="With --batch: packs built in parallel processes (default: config.PROMPT_BUILD_JOBS, 0 = CPU count)")
+    ap.add_argument("--force", action="store_true", help="With --batch: rebuild every pack, ignoring the manifest")
+    ap.add_argument("--dedup", action=argparse.BooleanOptionalAction, default=bool(getattr(config, "RULES_UPDATE_DEDUP", False)),
+                    help="Drop bot/AI/chatter notes, cluster near-duplicate comments and match them to existing rules locally;"
+                         " only novel clusters go to the AI (default: config.RULES_UPDATE_DEDUP)")
+    ap.add_argument("--patch", action=argparse.BooleanOptionalAction, default=bool(getattr(config, "RULES_UPDATE_PATCH", False)),
+                    help="Ask the AI for a rule patch (add / bump / merge_tags / edit by id) instead of the full rules JSON;"
+                         " apply it with merge_rules_updates.py (default: config.RULES_UPDATE_PATCH)")
+    ap.add_argument("--apply-increments", action="store_true",
+                    help="With --dedup: write the importance increments of matched rules to CODING_RULES_FILE now (not with --batch)")
+    args = ap.parse_args()
+    aggregate = args.aggregate is not None
+    if args.apply_increments and ((not args.dedup and not aggregate) or args.batch is not None):
+        print("ERROR: --apply-increments は --dedup 付きの1件ずつの生成または --aggregate でのみ使用できます（--batch 不可）。", file=sys.stderr)
+        return 2
+
+    inputs = load_prompt_inputs(args.patch)
     out_dir = pathlib.Path(args.out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
+    # --aggregate always de-duplicates: that is what makes one prompt over many MRs affordable.
+    dedup = dedup_options(args, force=aggregate)
 
-    out_path = out_dir / (comments_file.stem + ".rules_update.prompt.md")
-    out_path.write_text(compiled, encoding="utf-8")
-    print(f"OK: wrote {out_path}")
+    if aggregate:
+        patterns = args.aggregate or [os.path.join(str(getattr(config, "OUT_DIR", "./out")).strip(), "comments")]
+        db = None
+        if args.with_db:
+            db = open_mr_store(config, args.db)
+            if db is None:
+                print("ERROR: MR_DB_PATH is not set (config.py) and --db was not given", file=sys.stderr)
+                return 2
+        payloads = aggregate_payloads(aggregate_files(patterns), db, args.unresolved_only, args.path_glob)
+        if not payloads:
+            print(f"ERROR: {', '.join(patterns)} に *.comments.json がありません。", file=sys.stderr)
+            return 2
+        try:
+            build_aggregate(inputs, payloads, args.name, out_dir, dedup, args.max_tokens)  # type: ignore[arg-type]
+        except ValueError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 2
+        return 0
+
+    if args.batch is not None:
+        comments_dir = args.batch or os.path.join(str(getattr(config, "OUT_DIR", "./out")).strip(), "comments")
+        sources = [os.path.abspath(p) for p in find_exports(comments_dir, (".comments.json",))]
+        if not sources:
+            print(f"ERROR: {comments_dir} に *.comments.json がありません。", file=sys.stderr)
+            return 2
+        # The rules file is streamed by the workers, so hash its content here.
+        key = shared_key({k: v for k, v in inputs.items() if k != "rules_file"}, file_digest(inputs["rules_file"])["sha256"], dedup)
+        result = run_batch(
+            sources, str(out_dir / ".rules_update.manifest.json"), key, _build_batch_pack, _init_batch_worker,
+            (inputs, str(out_dir.resolve()), dedup), args.jobs or os.cpu_count() or 1, args.force)
+        report, same_prefix = prefix_report({os.path.basename(p): st for p, st in result.outputs.items()})
+        print(report, file=sys.stdout if same_prefix else sys.stderr)
+        print(f"DONE: {result.built} built, {result.skipped} skipped, {result.failed} failed")
+        return 1 if result.failed or not same_prefix else 0
+
+    try:
+        if args.from_db:
+            db = open_mr_store(config, args.db)
+            if db is None:
+                raise FileNotFoundError("MR_DB_PATH is not set (config.py) and --db was not given")
+            project_path, iid = parse_mr_ref(args.from_db)
+            payload = db.comments_payload(project_path, iid, unresolved_only=args.unresolved_only, path_globs=args.path_glob)
+            if payload is None:
+                raise FileNotFoundError(f"MR not in store: {args.from_db}")
+            stem = output_stem(payload["mr"]) + ".comments"
+            if dedup is None:
+                build_pack(inputs, lambda: iter_json_text(payload), stem, out_dir)
+            else:
+                clusters = clusters_payload(inputs, [payload], dedup, estimate_tokens_iter(iter_json_text(payload)))
+                build_pack(inputs, lambda: iter_json_text(clusters), stem, out_dir, clusters=True)
+        else:
+            build_file_pack(inputs, args.comments_json, out_dir, dedup)
+    except TemplateError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Local de-duplication of MR comments before the rules update prompt (--dedup).
+
+1. Drop notes that carry no reviewer knowledge: system notes, bot authors
+   (username ending in "bot" or listed in config.COMMENT_BOT_USERNAMES),
+   notes posted by gitlab_post_ai_review.py (【By AI reviewer】 / ai-review
+   marker) and chit-chat ("LGTM", "修正しました", ...).
+2. Normalize bodies: NFKC, lower case, without code blocks, URLs, @mentions,
+   HTML comments and punctuation.
+3. Cluster near-duplicates: character 3-gram shingles, MinHash signatures
+   with LSH banding for candidate pairs, confirmed by the exact Jaccard
+   similarity of the shingle sets (>= cluster_threshold).
+4. Match clusters to the existing rules: a cluster matches the rule whose
+   normalized title it contains best (share of the title's shingles found in
+   the cluster's comments >= rule_threshold). A matched rule gets +1
+   importance per MR it was raised in, the same as one per-MR update run.
+
+Only the clusters that matched no rule go to the AI, each with its count.
+"""
+
+import datetime
+import random
+import re
+import unicodedata
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from export_io import load_json, write_json_file
+
+# Header of every note posted by gitlab_post_ai_review.py.
+AI_REVIEW_HEADER = "【By AI reviewer】"
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+LSH_BANDS = 16  # 16 bands x 4 rows: pairs above ~0.5 Jaccard become candidates
+CLUSTER_THRESHOLD = 0.5
+RULE_MATCH_THRESHOLD = 0.6
+MAX_VARIANTS = 3
+MAX_PATHS = 5
+MAX_TEXT_CHARS = 600
+
+_HTML_COMMENT_RE = re.compile(r"<!--.*?-->", re.S)
+_CODE_BLOCK_RE = re.compile(r"```.*?(?:```|$)", re.S)
+_URL_RE = re.compile(r"https?://\S+")
+_MENTION_RE = re.compile(r"(?<!\w)@[\w.\-]+")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+# Compared after normalize_body().
+_CHATTER = {
+    "lgtm", "1", "thanks", "thank you", "ty", "done", "fixed", "ok", "okay", "nit",
+    "ありがとうございます", "了解", "了解です", "承知しました", "対応しました", "修正しました", "確認しました",
+}
+_P = (1 << 61) - 1
+_rnd = random.Random(20240601)
+_PERMS = [(_rnd.randrange(1, _P), _rnd.randrange(0, _P)) for _ in range(NUM_PERM)]
+
+@dataclass
+class Note:
+    mr: str
+    body: str
+    text: str
+    path: Optional[str]
+
+@dataclass
+class CommentDigest:
+    clusters: List[Dict[str, Any]]  # novel clusters, most frequent first
+    increments: List[Dict[str, Any]]  # [{id, title, by, comments}] for matched rules, file order
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+def normalize_body(body: str) -> str:
+    text = unicodedata.normalize("NFKC", body or "")
+    text = _HTML_COMMENT_RE.sub(" ", text)
+    text = _CODE_BLOCK_RE.sub(" ", text)
+    text = _URL_RE.sub(" ", text)
+    text = _MENTION_RE.sub(" ", text)
+    return " ".join(_NON_WORD_RE.sub(" ", text.lower()).split())
+
+def is_bot(author: Any, bot_usernames: Set[str]) -> bool:
+    username = str((author or {}).get("username") or "").lower() if isinstance(author, dict) else ""
+    return bool(username) and (username in bot_usernames or username.endswith("bot") or username.endswith("[bot]"))
+
+def is_ai_note(body: str) -> bool:
+    return (body or "").lstrip().startswith(AI_REVIEW_HEADER) or "<!-- ai-review:" in (body or "")
+
+def mr_ref(payload: Dict[str, Any]) -> str:
+    mr = payload.get("mr") or {}
+    return f"{mr.get('project_path') or ''}!{mr.get('iid')}"
+
+def collect_notes(payloads: Iterable[Dict[str, Any]], bot_usernames: Sequence[str] = ()) -> Tuple[List[Note], Counter]:
+    """(notes worth learning from, Counter of dropped notes by reason) over .comments.json payloads."""
+    bots = {b.lower() for b in bot_usernames}
+    notes: List[Note] = []
+    dropped: Counter = Counter()
+    for payload in payloads:
+        ref = mr_ref(payload)
+        for c in payload.get("comments") or []:
+            if not isinstance(c, dict):
+                continue
+            body = c.get("body") or ""
+            if c.get("system"):
+                dropped["system"] += 1
+            elif is_ai_note(body):
+                dropped["ai_reviewer"] += 1
+            elif is_bot(c.get("author"), bots):
+                dropped["bot"] += 1
+            else:
+                text = normalize_body(body)
+                if not text or text in _CHATTER:
+                    dropped["chatter"] += 1
+                    continue
+                pos = c.get("position") if isinstance(c.get("position"), dict) else {}
+                notes.append(Note(ref, body.strip(), text, pos.get("new_path") or pos.get("old_path")))
+    return notes, dropped
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def minhash(shingle_set: Set[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingle_set]
+    return tuple(min((a * h + b) % _P for h in hashes) for a, b in _PERMS)
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def cluster_texts(texts: List[str], threshold: float = CLUSTER_THRESHOLD) -> List[List[int]]:
+    """Groups of indexes into `texts` (distinct normalized bodies) that are near-duplicates, in first-seen order."""
+    sets = [shingles(t) for t in texts]
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = NUM_PERM // LSH_BANDS
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    for i, s in enumerate(sets):
+        sig = minhash(s)
+        for band in range(LSH_BANDS):
+            buckets.setdefault((band, sig[band * rows:(band + 1) * rows]), []).append(i)
+    checked: Set[Tuple[int, int]] = set()
+    for members in buckets.values():
+        for x in range(1, len(members)):
+            for y in range(x):
+                i, j = members[y], members[x]
+                if (i, j) in checked or find(i) == find(j):
+                    continue
+                checked.add((i, j))
+                if jaccard(sets[i], sets[j]) >= threshold:
+                    parent[max(find(i), find(j))] = min(find(i), find(j))
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+def match_rule(cluster_shingles: Set[str], rule_shingles: List[Set[str]], threshold: float = RULE_MATCH_THRESHOLD) -> Optional[int]:
+    """Index of the rule whose title shingles the cluster contains best (>= threshold), first rule on ties."""
+    best, best_score = None, threshold
+    for k, title in enumerate(rule_shingles):
+        if not title:
+            continue
+        score = len(title & cluster_shingles) / len(title)
+        if score > best_score or (score == best_score and best is None):
+            best, best_score = k, score
+    return best
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def digest_comments(
+    payloads: Iterable[Dict[str, Any]],
+    rules: List[Dict[str, Any]],
+    bot_usernames: Sequence[str] = (),
+    cluster_threshold: float = CLUSTER_THRESHOLD,
+    rule_threshold: float = RULE_MATCH_THRESHOLD,
+) -> CommentDigest:
+    notes, dropped = collect_notes(payloads, bot_usernames)
+    by_text: Dict[str, List[Note]] = {}
+    for n in notes:
+        by_text.setdefault(n.text, []).append(n)
+    texts = list(by_text)
+    rule_shingles = [shingles(normalize_body(str(r.get("title") or ""))) for r in rules]
+
+    novel: List[Dict[str, Any]] = []
+    matched: Dict[int, List[Note]] = {}
+    for group in cluster_texts(texts, cluster_threshold):
+        members = [n for i in group for n in by_text[texts[i]]]
+        rule = match_rule(set().union(*(shingles(texts[i]) for i in group)), rule_shingles, rule_threshold)
+        if rule is not None:
+            matched.setdefault(rule, []).extend(members)
+            continue
+        # Representative: the wording seen most often, earliest first.
+        ranked = sorted(group, key=lambda i: -len(by_text[texts[i]]))
+        variants = [by_text[texts[i]][0].body for i in ranked]
+        paths = Counter(n.path for n in members if n.path)
+        novel.append({
+            "count": len(members),
+            "mrs": len({n.mr for n in members}),
+            "text": _clip(variants[0], MAX_TEXT_CHARS),
+            "variants": [_clip(v, MAX_TEXT_CHARS // 2) for v in variants[1:1 + MAX_VARIANTS]],
+            "paths": [p for p, _ in paths.most_common(MAX_PATHS)],
+        })
+    novel.sort(key=lambda c: -c["count"])  # stable: ties keep first-seen order
+
+    increments = [
+        {"id": rules[k].get("id"), "title": rules[k].get("title"), "by": len({n.mr for n in matched[k]}), "comments": len(matched[k])}
+        for k in sorted(matched)
+    ]
+    stats = {
+        "comments": len(notes) + sum(dropped.values()),
+        "dropped": dict(sorted(dropped.items())),
+        "kept": len(notes),
+        "matched_rules": len(increments),
+        "matched_comments": sum(i["comments"] for i in increments),
+        "novel_clusters": len(novel),
+        "novel_comments": sum(c["count"] for c in novel),
+    }
+    return CommentDigest(novel, increments, stats)
+
+def load_rules(path: str) -> Dict[str, Any]:
+    stock = load_json(path)
+    if not isinstance(stock, dict) or not isinstance(stock.get("rules"), list):
+        raise ValueError(f"not a coding rules JSON (no 'rules' list): {path}")
+    return stock
+
+def save_rules(path: str, stock: Dict[str, Any]) -> None:
+    """Write the rules file atomically with a fresh updated_at."""
+    stock["updated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    write_json_file(path, stock)
+
+def apply_increments(stock: Dict[str, Any], increments: List[Dict[str, Any]]) -> List[Tuple[str, int, int]]:
+    """Add each increment's `by` to the rule's importance in place; returns (id, old, new) per rule changed."""
+    by_id = {str(i["id"]): int(i["by"]) for i in increments if i.get("id") is not None}
+    changed: List[Tuple[str, int, int]] = []
+    for rule in stock.get("rules") or []:
+        if isinstance(rule, dict) and str(rule.get("id")) in by_id:
+            try:
+                old = int(rule.get("importance") or 0)
+            except (TypeError, ValueError):
+                old = 0
+            rule["importance"] = old + by_id[str(rule.get("id"))]
+            changed.append((str(rule.get("id")), old, rule["importance"]))
+    return changed
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""File-level I/O for exports: compression by extension and compact JSON.
+
+  <name>.json / .jsonl          plain text
+  <name>.json.gz / .jsonl.gz    gzip (stdlib)
+  <name>.json.xz / .jsonl.xz    xz/lzma (stdlib; smaller, slower to write)
+  <name>.json.zst / .jsonl.zst  zstandard (optional: pip install zstandard)
+
+Readers pick the codec from the extension, so every consumer goes through
+open_text() and never needs to know how a file was written. Every output of an
+MR is named output_stem(mr) + its suffix (<title>__iid_<iid>.mr.json, ...).
+"""
+
+import argparse
+import gzip
+import io
+import json
+import lzma
+import os
+import re
+import tempfile
+from typing import IO, Any, Dict, Optional
+
+COMPRESSIONS = ("gz", "xz", "zst")
+_SUFFIXES = tuple("." + c for c in COMPRESSIONS)
+
+def compression_of(path: str) -> Optional[str]:
+    for c in COMPRESSIONS:
+        if str(path).endswith("." + c):
+            return c
+    return None
+
+def strip_compression(path: str) -> str:
+    """"a.mr.json.gz" -> "a.mr.json" (unchanged if not compressed)."""
+    c = compression_of(path)
+    return str(path)[: -len(c) - 1] if c else str(path)
+
+def with_compression(path: str, compression: Optional[str]) -> str:
+    return f"{path}.{compression}" if compression else path
+
+def sanitize_filename(name: str, max_len: int = 150) -> str:
+    name = (name or "").strip() or "output"
+    name = re.sub(r"[\x00-\x1f\x7f]", "", name)
+    name = re.sub(r"[\\/:*?\"<>|]+", "_", name)
+    name = re.sub(r"\s+", " ", name).strip().rstrip(". ")
+    return (name[:max_len].rstrip() if len(name) > max_len else name) or "output"
+
+def output_stem(mr: Dict[str, Any]) -> str:
+    """<title>__iid_<iid>: the file stem shared by an MR's export, comments, prompt packs and reviews."""
+    iid = mr.get("iid")
+    return f"{sanitize_filename(mr.get('title') or mr.get('source_branch') or f'mr_{iid}')}__iid_{iid}"
+
+def _zstd() -> Any:
+    try:
+        import zstandard  # type: ignore[import-not-found]
+    except ImportError:
+        raise RuntimeError("'.zst' exports need the optional 'zstandard' package: pip install zstandard")
+    return zstandard
+
+def _wrap_binary(raw: IO[bytes], compression: Optional[str], writing: bool) -> IO[bytes]:
+    if compression == "gz":
+        # Level 6: ~4x faster than the default 9 for ~3% larger files. mtime=0 keeps output reproducible.
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0) if writing else gzip.GzipFile(fileobj=raw, mode="rb")
+    if compression == "xz":
+        return lzma.LZMAFile(raw, mode="wb" if writing else "rb")
+    if compression == "zst":
+        zstd = _zstd()
+        return zstd.ZstdCompressor(level=10).stream_writer(raw, closefd=False) if writing else zstd.ZstdDecompressor().stream_reader(raw, closefd=False)
+    return raw
+
+def open_text(path: str) -> IO[str]:
+    """Open an export for reading as UTF-8 text, decompressing by extension."""
+    compression = compression_of(path)
+    if compression is None:
+        return open(path, "r", encoding="utf-8")
+    raw = open(path, "rb")
+    try:
+        return io.TextIOWrapper(_wrap_binary(raw, compression, writing=False), encoding="utf-8")
+    except BaseException:
+        raw.close()
+        raise
+
+class AtomicTextWriter:
+    """Text writer into a temp file next to `path`; commit() fsyncs, chmods 644 and renames into place.
+
+    Compression is chosen from `path`'s extension (the temp file gets the same one).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        compression = compression_of(path)
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", prefix=".tmp_", suffix=os.path.splitext(strip_compression(path))[1] + (f".{compression}" if compression else "")
+        )
+        self._raw = os.fdopen(fd, "wb")
+        try:
+            self._codec = _wrap_binary(self._raw, compression, writing=True)
+        except BaseException:
+            self._raw.close()
+            os.unlink(self.tmp_path)
+            raise
+        self.f = io.TextIOWrapper(self._codec, encoding="utf-8", write_through=False)
+
+    def commit(self, path: Optional[str] = None) -> str:
+        self.f.flush()
+        self.f.detach()
+        if self._codec is not self._raw:
+            self._codec.close()  # writes the compressed stream trailer; leaves self._raw open
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.chmod(self.tmp_path, 0o644)  # mkstemp creates 0600
+        target = path or self.path
+        os.replace(self.tmp_path, target)
+        return target
+
+    def abort(self) -> None:
+        for closer in (self.f.close, self._raw.close):
+            try:
+                closer()
+            except (OSError, ValueError):
+                pass
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+def dump_json(payload: Any, f: IO[str], compact: bool = False) -> None:
+    if compact:
+        json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+    else:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+def write_json_file(path: str, payload: Any, compact: bool = False) -> None:
+    """Atomically write JSON (compact = minified) with compression chosen by extension."""
+    w = AtomicTextWriter(path)
+    try:
+        dump_json(payload, w.f, compact)
+        w.commit()
+    except BaseException:
+        w.abort()
+        raise
+
+def load_json(path: str) -> Any:
+    with open_text(path) as f:
+        return json.load(f)
+
+def remove_other_variants(path: str) -> None:
+    """Delete the same export written with a different compression (e.g. a.mr.json when a.mr.json.gz was written)."""
+    base = strip_compression(path)
+    for candidate in (base, *(base + s for s in _SUFFIXES)):
+        if candidate != path and os.path.exists(candidate):
+            os.unlink(candidate)
+
+def add_format_args(ap: argparse.ArgumentParser, config: Any) -> None:
+    """--compact / --compress, defaulting to config.EXPORT_COMPACT / EXPORT_COMPRESSION."""
+    compression = str(getattr(config, "EXPORT_COMPRESSION", "") or "").strip().lstrip(".") or None
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"EXPORT_COMPRESSION must be one of {', '.join(COMPRESSIONS)} (or empty): {compression}")
+    g = ap.add_argument_group("output format")
+    g.add_argument("--compact", action="store_true", default=bool(getattr(config, "EXPORT_COMPACT", False)),
+                   help="Write minified JSON instead of indent=2 (default: config.EXPORT_COMPACT)")
+    g.add_argument("--compress", choices=COMPRESSIONS, default=compression,
+                   help="Compress the output and append .gz/.xz/.zst (default: config.EXPORT_COMPRESSION)")
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Persistent on-disk cache for GitLab GET responses.
+
+Each entry stores the response body plus ETag / Last-Modified. On the next
+request GitLabClient sends If-None-Match / If-Modified-Since; a 304 is served
+from disk, so unchanged MRs cost neither payload bytes nor much rate limit.
+
+Layout: <OUT_DIR>/.http_cache/<sha256(url+params)>.json
+Eviction: least-recently-used by file mtime once the total exceeds max_bytes.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Response headers needed to replay a cached page (paging + validators).
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Link", "X-Next-Page", "X-Page", "X-Per-Page", "X-Total", "X-Total-Pages")
+
+def cache_key(url: str, params: Optional[Dict[str, Any]]) -> str:
+    canon = json.dumps({"url": url, "params": sorted((str(k), str(v)) for k, v in (params or {}).items())}, ensure_ascii=False)
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total = sum(e.stat().st_size for e in os.scandir(cache_dir) if e.name.endswith(".json"))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def lookup(self, url: str, params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        path = self._path(cache_key(url, params))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def conditional_headers(self, entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if not entry:
+            return headers
+        stored = entry.get("headers") or {}
+        if stored.get("ETag"):
+            headers["If-None-Match"] = stored["ETag"]
+        if stored.get("Last-Modified"):
+            headers["If-Modified-Since"] = stored["Last-Modified"]
+        return headers
+
+    def replay(self, url: str, params: Optional[Dict[str, Any]], entry: Dict[str, Any], not_modified: requests.Response) -> requests.Response:
+        """Build a 200 response from a cached entry after the server answered 304."""
+        r = requests.Response()
+        r.status_code = 200
+        r._content = entry["body"].encode("utf-8")
+        r.encoding = "utf-8"
+        r.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        # Paging headers on the 304 are authoritative if present.
+        for name in KEPT_HEADERS:
+            if name in not_modified.headers:
+                r.headers[name] = not_modified.headers[name]
+        r.url = not_modified.url
+        r.request = not_modified.request
+        key = cache_key(url, params)
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(r._content)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return r
+
+    def store(self, url: str, params: Optional[Dict[str, Any]], r: requests.Response) -> None:
+        with self._lock:
+            self.misses += 1
+        if not (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+            return
+        entry = {
+            "url": url,
+            "params": {str(k): str(v) for k, v in (params or {}).items()},
+            "headers": {k: r.headers[k] for k in KEPT_HEADERS if k in r.headers},
+            "body": r.text,
+        }
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(cache_key(url, params))
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with self._lock:
+                try:
+                    self._total -= os.path.getsize(path)
+                except OSError:
+                    pass
+                os.replace(tmp_path, path)
+                self._total += len(data)
+                if self._total > self.max_bytes:
+                    self._evict()
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _evict(self) -> None:
+        # Caller holds self._lock.
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".json")]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for e in entries:
+            if self._total <= self.max_bytes:
+                break
+            try:
+                size = e.stat().st_size
+                os.unlink(e.path)
+            except OSError:
+                continue
+            self._total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+                "bytes_on_disk": self._total,
+            }
+
+def open_response_cache(config: Any) -> Optional[ResponseCache]:
+    """Create the cache from config (HTTP_CACHE_ENABLED / HTTP_CACHE_MAX_MB / OUT_DIR), or None if disabled."""
+    if not bool(getattr(config, "HTTP_CACHE_ENABLED", False)):
+        return None
+    out_dir = str(getattr(config, "OUT_DIR", "./out")).strip()
+    max_mb = int(getattr(config, "HTTP_CACHE_MAX_MB", 512) or 512)
+    return ResponseCache(os.path.join(out_dir, ".http_cache"), max_mb * 1024 * 1024)
+
+def format_cache_stats(cache: Optional[ResponseCache]) -> str:
+    if cache is None:
+        return ""
+    s = cache.stats()
+    return (
+        f"INFO: http cache hits={s['hits']} misses={s['misses']} evictions={s['evictions']} "
+        f"saved={s['bytes_saved'] / 1024:.1f}KiB on_disk={s['bytes_on_disk'] / 1024:.1f}KiB"
+    )
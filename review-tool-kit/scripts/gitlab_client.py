@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Shared GitLab REST client used by the gitlab_*.py scripts.
+
+The scripts are run as `python scripts/<name>.py`, so this module is importable
+as a top-level module (`from gitlab_client import GitLabClient`).
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    from gitlab_cache import ResponseCache
+    from gitlab_ratelimit import RateLimiter
+
+# 429 retries done by GitLabClient itself (every method with a RateLimiter, non-GET without one).
+RATE_LIMIT_RETRIES = 6
+# Sleep before the n-th unpaced 429 resend when there is no Retry-After (same curve as build_session).
+RATE_LIMIT_BACKOFF = 0.6
+
+def build_session(pool_size: int = 10, allowed_methods: Sequence[str] = ("GET",), retry_429: bool = True) -> requests.Session:
+    """retry_429=False leaves 429s to GitLabClient's rate limiter (see gitlab_ratelimit.py)."""
+    s = requests.Session()
+    retries = Retry(
+        total=6,
+        backoff_factor=0.6,
+        status_forcelist=([429] if retry_429 else []) + [500, 502, 503, 504],
+        allowed_methods=list(allowed_methods),
+        raise_on_status=False,
+        # urllib3 retries any 429 carrying Retry-After unless this is off.
+        respect_retry_after_header=retry_429,
+    )
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+def _retry_after(r: requests.Response, default: float) -> float:
+    try:
+        return max(0.0, float(r.headers.get("Retry-After") or default))
+    except ValueError:
+        return default
+
+class GitLabAPIError(RuntimeError):
+    pass
+
+@dataclass
+class GitLabClient:
+    base_url: str
+    token: str
+    session: requests.Session
+    timeout: int = 30
+    # Default worker count for get_all_pages(); 1 keeps strict sequential paging.
+    page_jobs: int = 1
+    # Optional on-disk ETag cache (see gitlab_cache.py); None disables it.
+    cache: Optional["ResponseCache"] = None
+    # Optional client-side scheduler (see gitlab_ratelimit.py); None sends requests unpaced.
+    limiter: Optional["RateLimiter"] = None
+
+    def _headers(self) -> Dict[str, str]:
+        return {"PRIVATE-TOKEN": self.token, "Accept": "application/json"}
+
+    def _url(self, path: str) -> str:
+        return self.base_url.rstrip("/") + "/api/v4" + path
+
+    def _send(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """All HTTP calls go through here so the rate limiter sees (and paces) every request."""
+        kwargs.setdefault("timeout", self.timeout)
+        if self.limiter is None:
+            r = self.session.request(method, url, **kwargs)
+            # urllib3 retries GET only: a POST must not be resent after a 5xx (it may have been
+            # created), but a 429 was rejected before processing, so it is resent here.
+            for attempt in range(RATE_LIMIT_RETRIES if method != "GET" else 0):
+                if r.status_code != 429:
+                    break
+                r.close()
+                time.sleep(_retry_after(r, RATE_LIMIT_BACKOFF * (2 ** attempt)))
+                r = self.session.request(method, url, **kwargs)
+            return r
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            self.limiter.acquire()
+            r: Optional[requests.Response] = None
+            try:
+                r = self.session.request(method, url, **kwargs)
+            finally:
+                self.limiter.release(r)
+            if r.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                return r
+            # A 429 was rejected before processing, so resending (even a POST) is safe.
+            r.close()
+        return r
+
+    def check(self, r: requests.Response) -> requests.Response:
+        if r.status_code >= 400:
+            raise GitLabAPIError(f"{r.request.method} {r.url} -> {r.status_code}\n{r.text[:2000]}")
+        return r
+
+    def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> requests.Response:
+        url = self._url(path)
+        if self.cache is None:
+            return self._send("GET", url, headers=self._headers(), params=params)
+
+        entry = self.cache.lookup(url, params)
+        headers = {**self._headers(), **self.cache.conditional_headers(entry)}
+        r = self._send("GET", url, headers=headers, params=params)
+        if r.status_code == 304 and entry is not None:
+            return self.cache.replay(url, params, entry, r)
+        if r.status_code == 200:
+            self.cache.store(url, params, r)
+        return r
+
+    def get_url(self, url: str) -> requests.Response:
+        """GET an absolute URL (e.g. a `Link: rel="next"` keyset URL)."""
+        return self._send("GET", url, headers=self._headers())
+
+    def get_stream(self, path: str, params: Optional[Dict[str, Any]] = None) -> requests.Response:
+        """Uncached GET with stream=True; the caller must close() the response."""
+        r = self._send("GET", self._url(path), headers=self._headers(), params=params, stream=True)
+        return self.check(r)
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        r = self.check(self.get(path, params=params))
+        return r.json() if r.text.strip() else None
+
+    def post_json(self, path: str, payload: Dict[str, Any]) -> Any:
+        r = self._send("POST", self._url(path), headers=self._headers(), json=payload)
+        r = self.check(r)
+        return r.json() if r.text.strip() else None
+
+    def get_all_pages(self, path: str, params: Optional[Dict[str, Any]] = None, parallel: Optional[int] = None) -> List[Any]:
+        """Fetch every page of a list endpoint.
+
+        With parallel > 1, page 1 is fetched first and, if GitLab reports
+        `X-Total-Pages`, the remaining pages are requested concurrently and
+        reassembled in page order. GitLab omits the total for very large
+        collections (and for keyset pagination); in that case paging falls
+        back to following `X-Next-Page` / `Link: rel="next"` one by one.
+        """
+        items: List[Any] = []
+        for page_items in self.iter_pages(path, params=params, parallel=parallel):
+            items.extend(page_items)
+        return items
+
+    def iter_pages(self, path: str, params: Optional[Dict[str, Any]] = None, parallel: Optional[int] = None) -> Iterator[List[Any]]:
+        """Yield one page (list) at a time, so callers can process and drop it before the next.
+
+        With parallel > 1 and `X-Total-Pages` reported, up to `parallel` pages are
+        in flight at once; pages are still yielded in order.
+        """
+        jobs = self.page_jobs if parallel is None else parallel
+        params = dict(params or {})
+        params.setdefault("per_page", 100)
+        params.setdefault("page", 1)
+        r = self.check(self.get(path, params=params))
+        data = r.json() if r.text.strip() else []
+        yield data if isinstance(data, list) else [data]
+        if not isinstance(data, list):
+            return
+
+        total = r.headers.get("X-Total-Pages")
+        first = int(params["page"])
+        if jobs > 1 and total and total.isdigit() and int(total) > first:
+            def fetch(page: int) -> List[Any]:
+                pr = self.check(self.get(path, params={**params, "page": page}))
+                pdata = pr.json() if pr.text.strip() else []
+                return pdata if isinstance(pdata, list) else [pdata]
+
+            # Sliding window: keep `jobs` requests in flight, yield strictly in page order.
+            pages = iter(range(first + 1, int(total) + 1))
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                pending = deque(pool.submit(fetch, p) for p in islice(pages, jobs))
+                while pending:
+                    result = pending.popleft().result()
+                    nxt = next(pages, None)
+                    if nxt is not None:
+                        pending.append(pool.submit(fetch, nxt))
+                    yield result
+            return
+        yield from self._follow_pages(path, params, r)
+
+    def _follow_pages(self, path: str, params: Dict[str, Any], r: requests.Response) -> Iterator[List[Any]]:
+        while True:
+            nxt = r.headers.get("X-Next-Page")
+            if nxt:
+                r = self.check(self.get(path, params={**params, "page": int(nxt)}))
+            elif "next" in r.links:
+                r = self.check(self.get_url(r.links["next"]["url"]))
+            else:
+                return
+            data = r.json() if r.text.strip() else []
+            if not isinstance(data, list):
+                yield [data]
+                return
+            yield data
@@ -4,34 +4,54 @@ from __future__ import annotations
 """Export GitLab MR data for AI review:
 - diffs (unified diff per file)
 - comments (discussions/notes)
-Output: ./out/mr/<MR>__iid_<iid>.mr.json
+Output: ./out/mr/<MR>__iid_<iid>.mr.json  (--stream: .mr.jsonl, see mr_export_stream.py;
+        --compact / --compress gz|xz|zst for minified and compressed files, see export_io.py)
 
 Usage:
   python scripts/gitlab_export_mr.py
+  python scripts/gitlab_export_mr.py --jobs 8
+  python scripts/gitlab_export_mr.py --incremental
+  python scripts/gitlab_export_mr.py --stream --diffs-api
+  python scripts/gitlab_export_mr.py --with-comments   (also writes ./out/comments/*.comments.json)
+  python scripts/gitlab_export_mr.py --compact --compress gz   (writes *.mr.json.gz)
   python scripts/gitlab_export_mr.py --mr-url "https://.../-/merge_requests/17"
+  python scripts/gitlab_export_mr.py --discover --project group/repo --updated-after 180d --jobs 8
 """
 
 import argparse
-import json
 import os
 import re
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import quote_plus, urlparse
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from export_io import add_format_args, output_stem, remove_other_variants, with_compression, write_json_file
+from gitlab_cache import format_cache_stats, open_response_cache
+from gitlab_client import GitLabClient, build_session
+from gitlab_ratelimit import format_rate_stats, open_rate_limiter
+from mr_discovery import add_discovery_args, iter_discovered_mr_urls, query_from_args, submit_bounded
+from mr_db import MRStore, open_mr_store
+from mr_diffs import DiffFilter, count_omitted, diff_records, iter_diff_pages
+from mr_export_stream import STREAM_SUFFIX, StreamingExportWriter, iter_json_array_items, load_export
+from mr_shared import COMMENTS_SUFFIX, comments_payload, find_fresh, max_age_from_config, shared_comments
+from mr_sync import FULL_SYNC_EVERY, FULL_SYNC_MAX_AGE_SEC, full_sync_policy, load_previous, stream_full_sync, sync_comments
 import importlib.util
 import pathlib
 import shutil
 import sys
 
 HERE = pathlib.Path(__file__).resolve().parent.parent
-CONFIG_FILE = HERE / "config.py"
+# REVIEW_TOOLKIT_CONFIG lets CI jobs / benchmarks point at a generated config file.
+CONFIG_FILE = pathlib.Path(os.environ.get("REVIEW_TOOLKIT_CONFIG") or HERE / "config.py")
 TEMPLATE_FILE = HERE / "config.template.py"
 
 def load_config_module():
+    # Scripts imported into one process (run_review_pipeline.py) share a single config module.
+    cached = sys.modules.get("review_toolkit_config")
+    if cached is not None:
+        return cached
     if not CONFIG_FILE.exists():
         if TEMPLATE_FILE.exists():
             shutil.copyfile(TEMPLATE_FILE, CONFIG_FILE)
@@ -45,6 +65,7 @@ def load_config_module():
         raise RuntimeError("config.py の読み込みに失敗しました。")
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    sys.modules["review_toolkit_config"] = module
     return module
 
 config = load_config_module()
@@ -71,147 +92,217 @@ def is_int_string(s: str) -> bool:
 def encode_project(project: str) -> str:
     return project if is_int_string(project) else quote_plus(project)
 
-def sanitize_filename(name: str, max_len: int = 150) -> str:
-    name = (name or "").strip() or "output"
-    name = re.sub(r"[\x00-\x1f\x7f]", "", name)
-    name = re.sub(r"[\\/:*?\"<>|]+", "_", name)
-    name = re.sub(r"\s+", " ", name).strip().rstrip(". ")
-    return (name[:max_len].rstrip() if len(name) > max_len else name) or "output"
-
-def build_session() -> requests.Session:
-    s = requests.Session()
-    retries = Retry(
-        total=6,
-        backoff_factor=0.6,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"],
-        raise_on_status=False,
-        respect_retry_after_header=True,
-    )
-    s.mount("http://", HTTPAdapter(max_retries=retries))
-    s.mount("https://", HTTPAdapter(max_retries=retries))
-    return s
-
-class GitLabAPIError(RuntimeError):
-    pass
+def mr_summary(project_path: str, iid: int, mr: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "project_path": project_path,
+        "iid": iid,
+        "title": (mr.get("title") or "").strip(),
+        "web_url": mr.get("web_url"),
+        "state": mr.get("state"),
+        "source_branch": mr.get("source_branch"),
+        "target_branch": mr.get("target_branch"),
+        "diff_refs": mr.get("diff_refs"),
+    }
 
 @dataclass
-class GitLabClient:
-    base_url: str
-    token: str
-    session: requests.Session
-    timeout: int = 30
-
-    def _headers(self) -> Dict[str, str]:
-        return {"PRIVATE-TOKEN": self.token, "Accept": "application/json"}
-
-    def _url(self, path: str) -> str:
-        return self.base_url.rstrip("/") + "/api/v4" + path
-
-    def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> requests.Response:
-        return self.session.get(self._url(path), headers=self._headers(), params=params, timeout=self.timeout)
-
-    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        r = self.get(path, params=params)
-        if r.status_code >= 400:
-            raise GitLabAPIError(f"GET {r.url} -> {r.status_code}\n{r.text[:2000]}")
-        return r.json() if r.text.strip() else None
-
-    def get_all_pages(self, path: str, params: Optional[Dict[str, Any]] = None) -> List[Any]:
-        items: List[Any] = []
-        page = 1
-        params = dict(params or {})
-        params.setdefault("per_page", 100)
-        while True:
-            params["page"] = page
-            r = self.get(path, params=params)
-            if r.status_code >= 400:
-                raise GitLabAPIError(f"GET {r.url} -> {r.status_code}\n{r.text[:2000]}")
-            data = r.json() if r.text.strip() else []
-            if isinstance(data, list):
-                items.extend(data)
-            else:
-                return items + [data]
-            nxt = r.headers.get("X-Next-Page")
-            if not nxt:
-                break
-            page = int(nxt)
-        return items
-
-def export_one_mr(gl: GitLabClient, project_path: str, iid: int, include_system_notes: bool) -> Dict[str, Any]:
+class ExportOptions:
+    include_system_notes: bool = False
+    incremental: bool = False
+    stream: bool = False
+    # "changes" = single /changes response, "diffs" = paginated /diffs (GitLab 15.7+)
+    diff_source: str = "changes"
+    diff_page_size: int = 20
+    diff_filter: DiffFilter = field(default_factory=DiffFilter)
+    # Reuse comments from a .comments.json fetched within this many seconds (0 = always fetch)
+    shared_max_age: int = 0
+    # Also write the derived .comments.json (feature 1 input) without extra API calls
+    write_comments: bool = False
+    # SQLite store (config.MR_DB_PATH) that every written export is upserted into
+    db: Optional[MRStore] = None
+    # Minified JSON / "gz" | "xz" | "zst" appended to the file name (see export_io.py)
+    compact: bool = False
+    compression: Optional[str] = None
+    # --incremental: force a full discussions sync after this many incremental runs / this age (see mr_sync.py)
+    full_sync_every: int = FULL_SYNC_EVERY
+    full_sync_max_age: int = FULL_SYNC_MAX_AGE_SEC
+
+def iter_mr_diffs(gl: GitLabClient, project_enc: str, iid: int, opts: ExportOptions, info: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield filtered diff records one by one; sets info["diff_overflow"] if /changes was truncated."""
+    if opts.diff_source == "diffs":
+        for page in iter_diff_pages(gl, project_enc, iid, opts.diff_page_size):
+            yield from diff_records(page, opts.diff_filter)
+        return
+
+    path = f"/projects/{project_enc}/merge_requests/{iid}/changes"
+    if opts.stream:
+        # Decode the (possibly huge) body straight from the socket; bypasses the HTTP cache.
+        others: Dict[str, Any] = {}
+        r = gl.get_stream(path)
+        try:
+            yield from diff_records(iter_json_array_items(r.iter_content(chunk_size=1 << 20), "changes", others), opts.diff_filter)
+        finally:
+            r.close()
+    else:
+        others = gl.get_json(path) or {}
+        others = others if isinstance(others, dict) else {}
+        yield from diff_records(others.get("changes") or [], opts.diff_filter)
+    if others.get("overflow"):
+        info["diff_overflow"] = True
+        print(f"WARN: /changes was truncated by GitLab (overflow) for iid={iid}; use --diffs-api", file=sys.stderr)
+
+def export_one_mr(
+    gl: GitLabClient,
+    project_path: str,
+    iid: int,
+    opts: ExportOptions,
+    previous: Optional[Dict[str, Any]] = None,
+    shared: Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Export one MR. With `previous` (an earlier export), only changed notes are fetched.
+
+    `shared` = (comments, sync info) already fetched by gitlab_fetch_mr_comments.py; discussions are then not fetched.
+    """
     project_enc = encode_project(project_path)
 
     mr = gl.get_json(f"/projects/{project_enc}/merge_requests/{iid}") or {}
-    changes_obj = gl.get_json(f"/projects/{project_enc}/merge_requests/{iid}/changes") or {}
-    changes = changes_obj.get("changes", []) if isinstance(changes_obj, dict) else []
-
-    diffs: List[Dict[str, Any]] = []
-    for ch in changes:
-        if not isinstance(ch, dict):
-            continue
-        diffs.append({
-            "old_path": ch.get("old_path"),
-            "new_path": ch.get("new_path"),
-            "new_file": ch.get("new_file"),
-            "renamed_file": ch.get("renamed_file"),
-            "deleted_file": ch.get("deleted_file"),
-            "diff": ch.get("diff"),
-        })
-
-    discussions = gl.get_all_pages(f"/projects/{project_enc}/merge_requests/{iid}/discussions")
-
-    comments: List[Dict[str, Any]] = []
-    for d in discussions:
-        if not isinstance(d, dict):
-            continue
-        discussion_id = d.get("id")
-        for n in (d.get("notes") or []):
-            if not isinstance(n, dict):
-                continue
-            if (not include_system_notes) and n.get("system") is True:
-                continue
-            author = n.get("author") or {}
-            comments.append({
-                "discussion_id": discussion_id,
-                "note_id": n.get("id"),
-                "created_at": n.get("created_at"),
-                "updated_at": n.get("updated_at"),
-                "author": {
-                    "id": author.get("id"),
-                    "name": author.get("name"),
-                    "username": author.get("username"),
-                    "web_url": author.get("web_url"),
-                },
-                "body": n.get("body"),
-                "position": n.get("position"),
-                "resolved": n.get("resolved"),
-                "system": n.get("system"),
-                "note_url": n.get("url"),
-            })
-
+    diff_info: Dict[str, Any] = {}
+    diffs = list(iter_mr_diffs(gl, project_enc, iid, opts, diff_info))
+
+    if shared is not None:
+        comments, sync_info = shared
+    else:
+        comments, sync_info = sync_comments(
+            gl, project_enc, iid, mr, previous, opts.include_system_notes, opts.full_sync_every, opts.full_sync_max_age
+        )
+
+    counts: Dict[str, Any] = {"diff_files": len(diffs), "comments": len(comments), "omitted_diffs": count_omitted(diffs)}
+    counts.update(diff_info)
     payload = {
         "fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-        "mr": {
-            "project_path": project_path,
-            "iid": iid,
-            "title": (mr.get("title") or "").strip(),
-            "web_url": mr.get("web_url"),
-            "state": mr.get("state"),
-            "source_branch": mr.get("source_branch"),
-            "target_branch": mr.get("target_branch"),
-            "diff_refs": mr.get("diff_refs"),
-        },
+        "mr": mr_summary(project_path, iid, mr),
         "diffs": diffs,
         "comments": comments,
-        "counts": {"diff_files": len(diffs), "comments": len(comments)},
+        "counts": counts,
+        "sync": sync_info,
     }
     return payload
 
+def export_one_mr_stream(
+    gl: GitLabClient,
+    project_path: str,
+    iid: int,
+    opts: ExportOptions,
+    writer: StreamingExportWriter,
+    previous: Optional[Dict[str, Any]] = None,
+    shared: Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Streaming variant of export_one_mr: diffs and comments go to `writer` as they arrive.
+
+    Diffs are decoded incrementally (from the /changes socket or page by page from
+    /diffs), so at most one file diff / one page is in memory at a time.
+    Returns (mr summary, sync info).
+    """
+    project_enc = encode_project(project_path)
+
+    mr = gl.get_json(f"/projects/{project_enc}/merge_requests/{iid}") or {}
+    summary = mr_summary(project_path, iid, mr)
+    writer.write_header(datetime.datetime.now(datetime.timezone.utc).isoformat(), summary)
+
+    diff_info: Dict[str, Any] = {}
+    for d in iter_mr_diffs(gl, project_enc, iid, opts, diff_info):
+        writer.write_diff(d)
+    writer.counts.update(diff_info)
+
+    include_system_notes = opts.include_system_notes
+    if shared is not None:
+        comments, sync_info = shared
+        for c in comments:
+            writer.write_comment(c)
+    elif previous is None:
+        sync_info = stream_full_sync(gl, project_enc, iid, include_system_notes, writer.write_comment)
+    else:
+        comments, sync_info = sync_comments(
+            gl, project_enc, iid, mr, previous, include_system_notes, opts.full_sync_every, opts.full_sync_max_age
+        )
+        for c in comments:
+            writer.write_comment(c)
+    return summary, sync_info
+
 import datetime
 
+def export_to_file(gl: GitLabClient, mr_url: str, out_dir: str, opts: ExportOptions) -> str:
+    mr_base, project_path, iid = parse_mr_url(mr_url)
+    if mr_base.rstrip("/") != gl.base_url.rstrip("/"):
+        raise ValueError(f"host mismatch: {mr_url}")
+
+    suffix = STREAM_SUFFIX if opts.stream else ".mr.json"
+    mr_dir = os.path.join(out_dir, "mr")
+    # Only the comments and the sync block of the previous export are used.
+    prev_path, previous = load_previous(mr_dir, project_path, iid, suffix, include_diffs=False) if opts.incremental else (None, None)
+    comments_dir = os.path.join(out_dir, "comments")
+    shared_path, shared_data = find_fresh(
+        comments_dir, project_path, iid, (COMMENTS_SUFFIX,), opts.include_system_notes, opts.shared_max_age
+    )
+    shared = shared_comments(shared_data) if shared_data is not None else None
+    if shared_path:
+        print(f"INFO: reusing comments from {shared_path}", file=sys.stderr)
+
+    if opts.stream:
+        writer = StreamingExportWriter(with_compression(os.path.join(mr_dir, f"mr_{iid}{suffix}"), opts.compression))
+        try:
+            summary, sync_info = export_one_mr_stream(gl, project_path, iid, opts, writer, previous=previous, shared=shared)
+        except BaseException:
+            writer.abort()
+            raise
+        stem = output_stem(summary)
+        out_path = writer.close(
+            sync=sync_info, final_path=with_compression(os.path.join(mr_dir, f"{stem}{suffix}"), opts.compression)
+        )
+        if opts.db is not None:
+            opts.db.upsert_stream_export(out_path)
+    else:
+        payload = export_one_mr(gl, project_path, iid, opts, previous=previous, shared=shared)
+        stem = output_stem(payload["mr"])
+        out_path = with_compression(os.path.join(mr_dir, f"{stem}{suffix}"), opts.compression)
+        write_json_file(out_path, payload, compact=opts.compact)
+        if opts.db is not None:
+            opts.db.upsert_export(payload)
+
+    if prev_path and os.path.abspath(prev_path) != os.path.abspath(out_path):
+        # MR was renamed (or the output format changed) since the last sync; drop the stale file.
+        os.unlink(prev_path)
+    remove_other_variants(out_path)
+
+    if opts.write_comments and shared_path is None:
+        export = payload if not opts.stream else load_export(out_path, include_diffs=False)
+        os.makedirs(comments_dir, exist_ok=True)
+        comments_path = with_compression(os.path.join(comments_dir, f"{stem}{COMMENTS_SUFFIX}"), opts.compression)
+        write_json_file(comments_path, comments_payload(export), compact=opts.compact)
+        remove_other_variants(comments_path)
+        print(f"OK: wrote {comments_path}")
+    return out_path
+
 def main() -> int:
     ap = argparse.ArgumentParser(description="Export GitLab MR (diffs + comments) for AI review.")
     ap.add_argument("--mr-url", help="Optional single MR URL. If omitted, uses config.MR_URLS.")
+    ap.add_argument("--jobs", type=int, default=int(getattr(config, "EXPORT_JOBS", 1) or 1),
+                    help="Number of MRs exported concurrently (default: config.EXPORT_JOBS or 1)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Merge into the existing .mr.json, fetching only notes changed since its sync watermark")
+    ap.add_argument("--stream", action="store_true",
+                    help="Write .mr.jsonl incrementally (constant memory for very large MRs)")
+    ap.add_argument("--with-comments", action="store_true",
+                    help="Also write out/comments/*.comments.json from the same fetch (input for feature 1)")
+    ap.add_argument("--refresh", action="store_true",
+                    help="Always fetch discussions, ignoring a fresh .comments.json (config.SHARED_FETCH_MAX_AGE_SEC)")
+    ap.add_argument("--diffs-api", action="store_true",
+                    help="Fetch diffs from the paginated /diffs endpoint instead of /changes (default: config.DIFF_SOURCE)")
+    add_discovery_args(ap)
+    try:
+        add_format_args(ap, config)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
     args = ap.parse_args()
 
     base_url = str(getattr(config, "GITLAB_BASE_URL", "")).strip()
@@ -223,27 +314,81 @@ def main() -> int:
     if not base_url or not token:
         print("ERROR: config.py の GITLAB_BASE_URL / GITLAB_TOKEN を設定してください。", file=sys.stderr)
         return 2
-    if not mr_urls:
+    if args.discover:
+        try:
+            query = query_from_args(args, config)
+        except ValueError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 2
+        if not query.projects:
+            print("ERROR: --discover には --project か config.py の DISCOVER_PROJECTS が必要です。", file=sys.stderr)
+            return 2
+    elif not mr_urls:
         print("ERROR: MR URL がありません。config.py の MR_URLS を設定してください。", file=sys.stderr)
         return 2
 
-    gl = GitLabClient(base_url=base_url, token=token, session=build_session())
-
-    os.makedirs(os.path.join(out_dir, "mr"), exist_ok=True)
+    if args.jobs < 1:
+        print("ERROR: --jobs は 1 以上を指定してください。", file=sys.stderr)
+        return 2
+    jobs = args.jobs if args.discover else min(args.jobs, len(mr_urls))
+
+    page_jobs = max(1, int(getattr(config, "PAGE_FETCH_JOBS", 1) or 1))
+    limiter = open_rate_limiter(config)
+    gl = GitLabClient(
+        base_url=base_url,
+        token=token,
+        session=build_session(pool_size=max(jobs * page_jobs, 10), retry_429=limiter is None),
+        page_jobs=page_jobs,
+        cache=open_response_cache(config),
+        limiter=limiter,
+    )
 
-    for mr_url in mr_urls:
-        mr_base, project_path, iid = parse_mr_url(mr_url)
-        if mr_base.rstrip("/") != base_url.rstrip("/"):
-            print(f"ERROR: host mismatch: {mr_url}", file=sys.stderr)
-            continue
+    opts = ExportOptions(
+        include_system_notes=include_system,
+        incremental=args.incremental,
+        stream=args.stream,
+        diff_source="diffs" if args.diffs_api else str(getattr(config, "DIFF_SOURCE", "changes") or "changes"),
+        diff_page_size=int(getattr(config, "DIFF_PAGE_SIZE", 20) or 20),
+        diff_filter=DiffFilter.from_config(config),
+        shared_max_age=0 if args.refresh else max_age_from_config(config),
+        write_comments=args.with_comments,
+        db=open_mr_store(config),
+        compact=args.compact,
+        compression=args.compress,
+    )
+    opts.full_sync_every, opts.full_sync_max_age = full_sync_policy(config)
 
-        payload = export_one_mr(gl, project_path, iid, include_system)
-        title = sanitize_filename(payload["mr"].get("title") or payload["mr"].get("source_branch") or f"mr_{iid}")
-        out_path = os.path.join(out_dir, "mr", f"{title}__iid_{iid}.mr.json")
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        print(f"OK: wrote {out_path}")
+    os.makedirs(os.path.join(out_dir, "mr"), exist_ok=True)
 
+    # Discovered URLs are consumed lazily: list pages are fetched as workers free up.
+    failures: List[Tuple[str, str]] = []
+    targets: Iterable[str] = iter_discovered_mr_urls(gl, query, errors=failures) if args.discover else mr_urls
+    written = 0
+    attempted = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        work = lambda mr_url: export_to_file(gl, mr_url, out_dir, opts)
+        for mr_url, fut in submit_bounded(pool, work, targets, jobs * 2):
+            attempted += 1
+            try:
+                out_path = fut.result()
+            except Exception as e:  # OSError / sqlite3.Error too: one MR must not abort the batch
+                failures.append((mr_url, str(e)))
+                print(f"ERROR: export failed: {mr_url}\n{e}", file=sys.stderr)
+                continue
+            written += 1
+            print(f"OK: wrote {out_path}")
+
+    if gl.cache is not None:
+        print(format_cache_stats(gl.cache), file=sys.stderr)
+    if gl.limiter is not None:
+        print(format_rate_stats(gl.limiter), file=sys.stderr)
+    if args.discover:
+        print(f"INFO: discovered {attempted} MRs", file=sys.stderr)
+    if failures:
+        print(f"DONE: {written} exported, {len(failures)} failed", file=sys.stderr)
+        for mr_url, _ in failures:
+            print(f"  FAILED: {mr_url}", file=sys.stderr)
+        return 1
     return 0
 
 if __name__ == "__main__":
@@ -8,19 +8,32 @@ Feature 1: コーディングルール生成の入力として、MRのコメン
 Usage:
   python scripts/gitlab_fetch_mr_comments.py
   python scripts/gitlab_fetch_mr_comments.py --mr-url "https://.../-/merge_requests/17"
+  python scripts/gitlab_fetch_mr_comments.py --incremental
+  python scripts/gitlab_fetch_mr_comments.py --compact --compress gz   (writes *.comments.json.gz)
+  python scripts/gitlab_fetch_mr_comments.py --discover --project group/repo --updated-after 180d --jobs 8
+
+A fresh export of the same MR in ./out/mr (see mr_shared.py) is reused as-is:
+the .comments.json is derived from it without any API call.
 """
 
 import argparse
-import json
+import datetime
 import os
 import re
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from urllib.parse import quote_plus, urlparse
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from export_io import add_format_args, output_stem, remove_other_variants, with_compression, write_json_file
+from gitlab_cache import format_cache_stats, open_response_cache
+from gitlab_client import GitLabClient, build_session
+from gitlab_ratelimit import format_rate_stats, open_rate_limiter
+from mr_db import MRStore, open_mr_store
+from mr_discovery import add_discovery_args, iter_discovered_mr_urls, query_from_args, submit_bounded
+from mr_export_stream import STREAM_SUFFIX
+from mr_shared import comments_payload, find_fresh, max_age_from_config
+from mr_sync import FULL_SYNC_EVERY, FULL_SYNC_MAX_AGE_SEC, full_sync_policy, load_previous, sync_comments
 
 import importlib.util
 import pathlib
@@ -28,10 +41,15 @@ import shutil
 import sys
 
 HERE = pathlib.Path(__file__).resolve().parent.parent
-CONFIG_FILE = HERE / "config.py"
+# REVIEW_TOOLKIT_CONFIG lets CI jobs / benchmarks point at a generated config file.
+CONFIG_FILE = pathlib.Path(os.environ.get("REVIEW_TOOLKIT_CONFIG") or HERE / "config.py")
 TEMPLATE_FILE = HERE / "config.template.py"
 
 def load_config_module():
+    # Scripts imported into one process (run_review_pipeline.py) share a single config module.
+    cached = sys.modules.get("review_toolkit_config")
+    if cached is not None:
+        return cached
     if not CONFIG_FILE.exists():
         if TEMPLATE_FILE.exists():
             shutil.copyfile(TEMPLATE_FILE, CONFIG_FILE)
@@ -45,6 +63,7 @@ def load_config_module():
         raise RuntimeError("config.py の読み込みに失敗しました。")
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    sys.modules["review_toolkit_config"] = module
     return module
 
 config = load_config_module()
@@ -71,109 +90,24 @@ def is_int_string(s: str) -> bool:
 def encode_project(project: str) -> str:
     return project if is_int_string(project) else quote_plus(project)
 
-def sanitize_filename(name: str, max_len: int = 150) -> str:
-    name = (name or "").strip() or "output"
-    name = re.sub(r"[\x00-\x1f\x7f]", "", name)
-    name = re.sub(r"[\\/:*?\"<>|]+", "_", name)
-    name = re.sub(r"\s+", " ", name).strip().rstrip(". ")
-    return (name[:max_len].rstrip() if len(name) > max_len else name) or "output"
-
-def build_session() -> requests.Session:
-    s = requests.Session()
-    retries = Retry(
-        total=6,
-        backoff_factor=0.6,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"],
-        raise_on_status=False,
-        respect_retry_after_header=True,
-    )
-    s.mount("http://", HTTPAdapter(max_retries=retries))
-    s.mount("https://", HTTPAdapter(max_retries=retries))
-    return s
-
-class GitLabAPIError(RuntimeError):
-    pass
-
-@dataclass
-class GitLabClient:
-    base_url: str
-    token: str
-    session: requests.Session
-    timeout: int = 30
-
-    def _headers(self) -> Dict[str, str]:
-        return {"PRIVATE-TOKEN": self.token, "Accept": "application/json"}
-
-    def _url(self, path: str) -> str:
-        return self.base_url.rstrip("/") + "/api/v4" + path
-
-    def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> requests.Response:
-        return self.session.get(self._url(path), headers=self._headers(), params=params, timeout=self.timeout)
-
-    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        r = self.get(path, params=params)
-        if r.status_code >= 400:
-            raise GitLabAPIError(f"GET {r.url} -> {r.status_code}\n{r.text[:2000]}")
-        return r.json() if r.text.strip() else None
-
-    def get_all_pages(self, path: str, params: Optional[Dict[str, Any]] = None) -> List[Any]:
-        items: List[Any] = []
-        page = 1
-        params = dict(params or {})
-        params.setdefault("per_page", 100)
-        while True:
-            params["page"] = page
-            r = self.get(path, params=params)
-            if r.status_code >= 400:
-                raise GitLabAPIError(f"GET {r.url} -> {r.status_code}\n{r.text[:2000]}")
-            data = r.json() if r.text.strip() else []
-            if isinstance(data, list):
-                items.extend(data)
-            else:
-                return items + [data]
-            nxt = r.headers.get("X-Next-Page")
-            if not nxt:
-                break
-            page = int(nxt)
-        return items
-
-def fetch_comments_for_mr(gl: GitLabClient, project_path: str, iid: int, include_system_notes: bool) -> Dict[str, Any]:
+def fetch_comments_for_mr(
+    gl: GitLabClient,
+    project_path: str,
+    iid: int,
+    include_system_notes: bool,
+    previous: Optional[Dict[str, Any]] = None,
+    full_sync_every: int = FULL_SYNC_EVERY,
+    full_sync_max_age: int = FULL_SYNC_MAX_AGE_SEC,
+) -> Dict[str, Any]:
+    """Fetch MR comments. With `previous` (an earlier .comments.json), only changed notes are fetched."""
     project_enc = encode_project(project_path)
     mr = gl.get_json(f"/projects/{project_enc}/merge_requests/{iid}") or {}
-    discussions = gl.get_all_pages(f"/projects/{project_enc}/merge_requests/{iid}/discussions")
-
-    comments: List[Dict[str, Any]] = []
-    for d in discussions:
-        if not isinstance(d, dict):
-            continue
-        discussion_id = d.get("id")
-        for n in (d.get("notes") or []):
-            if not isinstance(n, dict):
-                continue
-            if (not include_system_notes) and n.get("system") is True:
-                continue
-            author = n.get("author") or {}
-            comments.append({
-                "discussion_id": discussion_id,
-                "note_id": n.get("id"),
-                "created_at": n.get("created_at"),
-                "updated_at": n.get("updated_at"),
-                "author": {
-                    "id": author.get("id"),
-                    "name": author.get("name"),
-                    "username": author.get("username"),
-                },
-                "body": n.get("body"),
-                "position": n.get("position"),
-                "resolved": n.get("resolved"),
-                "system": n.get("system"),
-                "note_url": n.get("url"),
-            })
+    comments, sync_info = sync_comments(gl, project_enc, iid, mr, previous, include_system_notes, full_sync_every, full_sync_max_age)
 
     title = (mr.get("title") or "").strip()
     source_branch = (mr.get("source_branch") or "").strip()
     payload = {
+        "fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
         "mr": {
             "project_path": project_path,
             "iid": iid,
@@ -185,12 +119,61 @@ def fetch_comments_for_mr(gl: GitLabClient, project_path: str, iid: int, include
         },
         "comments": comments,
         "counts": {"comments": len(comments)},
+        "sync": sync_info,
     }
     return payload
 
+def fetch_to_file(
+    gl: GitLabClient,
+    mr_url: str,
+    out_dir: str,
+    include_system_notes: bool,
+    incremental: bool,
+    shared_max_age: int,
+    db: Optional[MRStore] = None,
+    compact: bool = False,
+    compression: Optional[str] = None,
+    full_sync: Tuple[int, int] = (FULL_SYNC_EVERY, FULL_SYNC_MAX_AGE_SEC),
+) -> str:
+    mr_base, project_path, iid = parse_mr_url(mr_url)
+    if mr_base.rstrip("/") != gl.base_url.rstrip("/"):
+        raise ValueError(f"host mismatch: {mr_url}")
+
+    comments_dir = os.path.join(out_dir, "comments")
+    prev_path, previous = load_previous(comments_dir, project_path, iid, ".comments.json") if incremental else (None, None)
+    shared_path, export = find_fresh(
+        os.path.join(out_dir, "mr"), project_path, iid, (".mr.json", STREAM_SUFFIX), include_system_notes, shared_max_age
+    )
+    if export is not None:
+        print(f"INFO: derived from {shared_path} (no API call)", file=sys.stderr)
+        payload = comments_payload(export)
+    else:
+        payload = fetch_comments_for_mr(gl, project_path, iid, include_system_notes, previous, *full_sync)
+    out_path = with_compression(os.path.join(comments_dir, f"{output_stem(payload['mr'])}.comments.json"), compression)
+    write_json_file(out_path, payload, compact=compact)
+    if db is not None:
+        db.upsert_export(payload)
+    if prev_path and os.path.abspath(prev_path) != os.path.abspath(out_path):
+        # MR was renamed (or the output format changed) since the last sync; drop the stale file.
+        os.unlink(prev_path)
+    remove_other_variants(out_path)
+    return out_path
+
 def main() -> int:
     ap = argparse.ArgumentParser(description="Fetch GitLab MR comments for coding-rule generation.")
     ap.add_argument("--mr-url", help="Optional single MR URL. If omitted, uses config.MR_URLS.")
+    ap.add_argument("--jobs", type=int, default=int(getattr(config, "EXPORT_JOBS", 1) or 1),
+                    help="Number of MRs fetched concurrently (default: config.EXPORT_JOBS or 1)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Merge into the existing .comments.json, fetching only notes changed since its sync watermark")
+    ap.add_argument("--refresh", action="store_true",
+                    help="Always fetch from GitLab, ignoring a fresh .mr.json export (config.SHARED_FETCH_MAX_AGE_SEC)")
+    add_discovery_args(ap)
+    try:
+        add_format_args(ap, config)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
     args = ap.parse_args()
 
     base_url = str(getattr(config, "GITLAB_BASE_URL", "")).strip()
@@ -202,27 +185,71 @@ def main() -> int:
     if not base_url or not token:
         print("ERROR: config.py の GITLAB_BASE_URL / GITLAB_TOKEN を設定してください。", file=sys.stderr)
         return 2
-    if not mr_urls:
+    if args.discover:
+        try:
+            query = query_from_args(args, config)
+        except ValueError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return 2
+        if not query.projects:
+            print("ERROR: --discover には --project か config.py の DISCOVER_PROJECTS が必要です。", file=sys.stderr)
+            return 2
+    elif not mr_urls:
         print("ERROR: MR URL がありません。config.py の MR_URLS を設定してください。", file=sys.stderr)
         return 2
 
-    gl = GitLabClient(base_url=base_url, token=token, session=build_session())
+    if args.jobs < 1:
+        print("ERROR: --jobs は 1 以上を指定してください。", file=sys.stderr)
+        return 2
+    jobs = args.jobs if args.discover else min(args.jobs, len(mr_urls))
+
+    page_jobs = max(1, int(getattr(config, "PAGE_FETCH_JOBS", 1) or 1))
+    limiter = open_rate_limiter(config)
+    gl = GitLabClient(
+        base_url=base_url,
+        token=token,
+        session=build_session(pool_size=max(jobs * page_jobs, 10), retry_429=limiter is None),
+        page_jobs=page_jobs,
+        cache=open_response_cache(config),
+        limiter=limiter,
+    )
 
     os.makedirs(os.path.join(out_dir, "comments"), exist_ok=True)
-
-    for mr_url in mr_urls:
-        mr_base, project_path, iid = parse_mr_url(mr_url)
-        if mr_base.rstrip("/") != base_url.rstrip("/"):
-            print(f"ERROR: host mismatch: {mr_url}", file=sys.stderr)
-            continue
-
-        payload = fetch_comments_for_mr(gl, project_path, iid, include_system)
-        title = sanitize_filename(payload["mr"].get("title") or payload["mr"].get("source_branch") or f"mr_{iid}")
-        out_path = os.path.join(out_dir, "comments", f"{title}__iid_{iid}.comments.json")
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        print(f"OK: wrote {out_path}")
-
+    shared_max_age = 0 if args.refresh else max_age_from_config(config)
+    full_sync = full_sync_policy(config)
+    db = open_mr_store(config)
+
+    # Discovered URLs are consumed lazily: list pages are fetched as workers free up.
+    failures: List[Tuple[str, str]] = []
+    targets: Iterable[str] = iter_discovered_mr_urls(gl, query, errors=failures) if args.discover else mr_urls
+    written = 0
+    attempted = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        work = lambda mr_url: fetch_to_file(
+            gl, mr_url, out_dir, include_system, args.incremental, shared_max_age, db, args.compact, args.compress, full_sync
+        )
+        for mr_url, fut in submit_bounded(pool, work, targets, jobs * 2):
+            attempted += 1
+            try:
+                out_path = fut.result()
+            except Exception as e:  # OSError / sqlite3.Error too: one MR must not abort the batch
+                failures.append((mr_url, str(e)))
+                print(f"ERROR: fetch failed: {mr_url}\n{e}", file=sys.stderr)
+                continue
+            written += 1
+            print(f"OK: wrote {out_path}")
+
+    if gl.cache is not None:
+        print(format_cache_stats(gl.cache), file=sys.stderr)
+    if gl.limiter is not None:
+        print(format_rate_stats(gl.limiter), file=sys.stderr)
+    if args.discover:
+        print(f"INFO: discovered {attempted} MRs", file=sys.stderr)
+    if failures:
+        print(f"DONE: {written} fetched, {len(failures)} failed", file=sys.stderr)
+        for mr_url, _ in failures:
+            print(f"  FAILED: {mr_url}", file=sys.stderr)
+        return 1
     return 0
 
 if __name__ == "__main__":
@@ -8,28 +8,55 @@ from __future__ import annotations
 Input: AI review JSON (mr_overall + inline_comments)
 Usage:
   python scripts/gitlab_post_ai_review.py --mr-url "https://.../-/merge_requests/17" --review-json "./review_out/foo.review.json"
+  python scripts/gitlab_post_ai_review.py ... --jobs 8
+  python scripts/gitlab_post_ai_review.py --review-json "./review_out/foo.review.json" --status
+  python scripts/gitlab_post_ai_review.py --batch --mr-jobs 4   (every *.review.json in REVIEW_OUT_DIR)
+
+Every posted body ends with a hidden marker (<!-- ai-review:<hash> -->) derived from
+its content and position. Existing discussions are fetched once before posting and
+items whose marker is already on the MR are skipped, so re-running is safe.
+POSTs are never retried automatically (a timed-out POST may still have been
+created); re-run instead and the marker check drops what already landed.
+
+Progress is checkpointed in <review>.journal.jsonl next to the review JSON
+(see post_journal.py); a re-run resumes from the first unposted item.
 """
 
 import argparse
+import glob
+import hashlib
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import quote_plus, urlparse
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from export_io import strip_compression
+from gitlab_cache import open_response_cache
+from gitlab_client import GitLabAPIError, GitLabClient, build_session
+from gitlab_ratelimit import format_rate_stats, open_rate_limiter
+from mr_export_stream import STREAM_SUFFIX, load_export
+from mr_hunks import SNAPPED, HunkIndex
+from mr_sync import load_previous
+from post_journal import PostJournal, journal_path
 import importlib.util
+import os
 import pathlib
 import shutil
 import sys
 
 HERE = pathlib.Path(__file__).resolve().parent.parent
-CONFIG_FILE = HERE / "config.py"
+# REVIEW_TOOLKIT_CONFIG lets CI jobs / benchmarks point at a generated config file.
+CONFIG_FILE = pathlib.Path(os.environ.get("REVIEW_TOOLKIT_CONFIG") or HERE / "config.py")
 TEMPLATE_FILE = HERE / "config.template.py"
 
 def load_config_module():
+    # Scripts imported into one process (run_review_pipeline.py) share a single config module.
+    cached = sys.modules.get("review_toolkit_config")
+    if cached is not None:
+        return cached
     if not CONFIG_FILE.exists():
         if TEMPLATE_FILE.exists():
             shutil.copyfile(TEMPLATE_FILE, CONFIG_FILE)
@@ -43,6 +70,7 @@ def load_config_module():
         raise RuntimeError("config.py の読み込みに失敗しました。")
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    sys.modules["review_toolkit_config"] = module
     return module
 
 config = load_config_module()
@@ -69,58 +97,25 @@ def is_int_string(s: str) -> bool:
 def encode_project(project: str) -> str:
     return project if is_int_string(project) else quote_plus(project)
 
-def build_session() -> requests.Session:
-    s = requests.Session()
-    retries = Retry(
-        total=6,
-        backoff_factor=0.6,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET", "POST"],
-        raise_on_status=False,
-        respect_retry_after_header=True,
-    )
-    s.mount("http://", HTTPAdapter(max_retries=retries))
-    s.mount("https://", HTTPAdapter(max_retries=retries))
-    return s
-
-class GitLabAPIError(RuntimeError):
-    pass
-
-@dataclass
-class GitLabClient:
-    base_url: str
-    token: str
-    session: requests.Session
-    timeout: int = 30
-
-    def _headers(self) -> Dict[str, str]:
-        return {"PRIVATE-TOKEN": self.token, "Accept": "application/json"}
-
-    def _url(self, path: str) -> str:
-        return self.base_url.rstrip("/") + "/api/v4" + path
-
-    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        r = self.session.get(self._url(path), headers=self._headers(), params=params, timeout=self.timeout)
-        if r.status_code >= 400:
-            raise GitLabAPIError(f"GET {r.url} -> {r.status_code}\n{r.text[:2000]}")
-        return r.json() if r.text.strip() else None
-
-    def post_json(self, path: str, payload: Dict[str, Any]) -> Any:
-        r = self.session.post(self._url(path), headers=self._headers(), json=payload, timeout=self.timeout)
-        if r.status_code >= 400:
-            raise GitLabAPIError(f"POST {r.url} -> {r.status_code}\n{r.text[:2000]}")
-        return r.json() if r.text.strip() else None
-
-def format_overall_comment(overall: Dict[str, Any]) -> str:
+def format_overall_comment(overall: Dict[str, Any], demoted: Optional[List[Dict[str, Any]]] = None) -> str:
     status = (overall.get("status") or "").strip() or "指摘あり"
     changes = (overall.get("changes_summary") or "").strip() or "（記載なし）"
     risk = (overall.get("risk_impact") or "").strip() or "（記載なし）"
-    return (
+    body = (
         "【By AI reviewer】\n"
         f"【ステータス（{status}）】\n"
         f"【変更内容】{changes}\n"
         f"【影響範囲・リスク】{risk}\n"
     )
+    if demoted:
+        # Inline findings whose position is not in the MR diff.
+        body += "【差分上の位置を特定できなかった指摘】\n"
+        for c in demoted:
+            loc = f"{(c.get('path') or '').strip() or '（ファイル不明）'}:{c.get('line') or '?'}"
+            sev = (c.get("severity") or "").strip() or "解説"
+            detail = " ".join((c.get("detail") or "").split()) or "（記載なし）"
+            body += f"- `{loc}`（{sev}）{detail}\n"
+    return body
 
 def format_inline_comment(c: Dict[str, Any]) -> str:
     sev = (c.get("severity") or "").strip() or "解説"
@@ -135,85 +130,443 @@ def format_inline_comment(c: Dict[str, Any]) -> str:
         f"{impact}\n"
     )
 
+MARKER_RE = re.compile(r"<!-- ai-review:([0-9a-f]{16}) -->")
+
+def item_marker(body: str, position: Optional[Dict[str, Any]] = None) -> str:
+    """Content hash identifying one posted item (body + side/file/line, not the commit SHAs)."""
+    key: List[Any] = [body]
+    if position:
+        # GitLab echoes both paths back; only the commented side identifies the line.
+        side = "new" if position.get("new_line") else "old"
+        key += [side, position.get(f"{side}_path"), position.get(f"{side}_line")]
+    return hashlib.sha256(json.dumps(key, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def with_marker(body: str, marker: str) -> str:
+    return f"{body}\n<!-- ai-review:{marker} -->"
+
+def existing_markers(gl: GitLabClient, project_enc: str, iid: int) -> Dict[str, Any]:
+    """Marker -> discussion id for AI notes already on the MR (older notes without a marker are re-hashed)."""
+    seen: Dict[str, Any] = {}
+    for d in gl.get_all_pages(f"/projects/{project_enc}/merge_requests/{iid}/discussions", params={"per_page": 100}):
+        for n in (d.get("notes") or []) if isinstance(d, dict) else []:
+            body = (n.get("body") or "") if isinstance(n, dict) else ""
+            found = MARKER_RE.findall(body)
+            if not found and body.startswith("【By AI reviewer】"):
+                position = n.get("position") if isinstance(n.get("position"), dict) else None
+                found = [item_marker(body, position)]
+            for marker in found:
+                seen[marker] = d.get("id")
+    return seen
+
+def inline_position(c: Dict[str, Any], diff_refs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    path = (c.get("path") or "").strip()
+    side = (c.get("side") or "new").strip()
+    line = c.get("line")
+    if not path or not isinstance(line, int) or line <= 0:
+        return None
+    position: Dict[str, Any] = {
+        "position_type": "text",
+        "base_sha": diff_refs.get("base_sha"),
+        "start_sha": diff_refs.get("start_sha"),
+        "head_sha": diff_refs.get("head_sha"),
+    }
+    if side == "old":
+        position["old_path"] = path
+        position["old_line"] = line
+    else:
+        position["new_path"] = path
+        position["new_line"] = line
+    return position
+
+@dataclass
+class ReviewItem:
+    key: str  # "overall" or "inline:<n>" (1-based index into inline_comments)
+    body: str
+    marker: str
+    position: Optional[Dict[str, Any]] = None
+    # Line the finding named when the hunk index moved it to the closest line shown in the diff
+    snapped_from: Optional[int] = None
+
+def review_items(
+    review: Dict[str, Any],
+    diff_refs: Dict[str, Any],
+    hunks: Optional[HunkIndex] = None,
+    snap_lines: int = 0,
+) -> Tuple[List[ReviewItem], List[int]]:
+    """(postable items in review order, 1-based indexes of inline comments demoted to the overall note).
+
+    Without `hunks` only a non-empty path and a positive line are required. With it,
+    every position must be a line shown in the exported diff (or within `snap_lines`
+    of one, then moved there); the rest are listed in the overall note instead.
+    """
+    inline: List[ReviewItem] = []
+    demoted: List[Tuple[int, Dict[str, Any]]] = []
+    for idx, c in enumerate(review.get("inline_comments") or [], start=1):
+        if not isinstance(c, dict):
+            continue
+        position = inline_position(c, diff_refs)
+        snapped_from = None
+        if position is not None and hunks is not None:
+            line = c.get("line")
+            status, fields = hunks.locate((c.get("path") or "").strip(), (c.get("side") or "new").strip(), line, snap_lines)
+            if fields is None:
+                position = None
+            else:
+                position = {k: position[k] for k in ("position_type", "base_sha", "start_sha", "head_sha")}
+                position.update(fields)
+                if status == SNAPPED:
+                    snapped_from = line
+        if position is None:
+            demoted.append((idx, c))
+            continue
+        body = format_inline_comment(c)
+        inline.append(ReviewItem(f"inline:{idx}", body, item_marker(body, position), position, snapped_from))
+    overall_body = format_overall_comment(review.get("mr_overall") or {}, [c for _, c in demoted])
+    return [ReviewItem("overall", overall_body, item_marker(overall_body))] + inline, [idx for idx, _ in demoted]
+
+def item_label(item: ReviewItem) -> str:
+    return "overall note" if item.key == "overall" else "inline " + item.key.split(":", 1)[1]
+
+def post_review(
+    gl: GitLabClient,
+    project_path: str,
+    iid: int,
+    review: Dict[str, Any],
+    diff_refs: Dict[str, Any],
+    dry_run: bool = False,
+    jobs: int = 1,
+    journal: Optional[PostJournal] = None,
+    hunks: Optional[HunkIndex] = None,
+    snap_lines: int = 0,
+) -> Dict[str, int]:
+    """Post the overall note and inline discussions of one review JSON.
+
+    Positions are validated offline first when `hunks` is given (see review_items);
+    findings that cannot be placed go into the overall note. Items recorded in
+    `journal` are skipped without any API call; the rest are checked against the
+    markers already on the MR (one paged discussions fetch). The overall note goes
+    first, then inline discussions from up to `jobs` threads; each success is
+    journaled immediately. Raises GitLabAPIError if any POST failed, after every
+    item has been attempted.
+    Returns {"posted", "skipped", "journaled", "demoted"} counts.
+    """
+    project_enc = encode_project(project_path)
+    items, demoted = review_items(review, diff_refs, hunks, snap_lines)
+    counts = {"posted": 0, "skipped": 0, "journaled": 0, "demoted": len(demoted)}
+    for idx in demoted:
+        print(f"WARN: inline[{idx}] is not on a line of the MR diff; moved to the overall note", file=sys.stderr)
+    for item in items:
+        if item.snapped_from is not None:
+            pos = item.position or {}
+            print(f"INFO: {item_label(item)} line {item.snapped_from} -> {pos.get('new_line') or pos.get('old_line')} (nearest diff line)")
+
+    pending: List[ReviewItem] = []
+    for item in items:
+        if journal is not None and journal.get(item.key, item.marker) is not None:
+            counts["journaled"] += 1
+        else:
+            pending.append(item)
+    if journal is not None and counts["journaled"]:
+        print(f"INFO: resuming from {journal.path}: {counts['journaled']} items already posted")
+
+    seen = existing_markers(gl, project_enc, iid) if pending else {}
+    todo: List[ReviewItem] = []
+    for item in pending:
+        if item.marker in seen:
+            counts["skipped"] += 1
+            print(f"SKIP: {item_label(item)} already posted")
+            if journal is not None and not dry_run and seen[item.marker] is not None:
+                journal.record(item.key, item.marker, seen[item.marker])
+            continue
+        seen[item.marker] = None  # the same finding twice in one review is posted once
+        if dry_run:
+            print(f"---- {'Overall' if item.position is None else 'Inline ' + item.key.split(':', 1)[1]} ----")
+            if item.position is not None:
+                print(json.dumps(item.position, ensure_ascii=False))
+            print(item.body)
+            continue
+        todo.append(item)
+
+    def post_one(item: ReviewItem) -> None:
+        if item.position is None:
+            note = gl.post_json(f"/projects/{project_enc}/merge_requests/{iid}/notes", {"body": with_marker(item.body, item.marker)})
+            posted_id = (note or {}).get("id")
+        else:
+            discussion = gl.post_json(
+                f"/projects/{project_enc}/merge_requests/{iid}/discussions",
+                {"body": with_marker(item.body, item.marker), "position": item.position},
+            )
+            posted_id = (discussion or {}).get("id")
+        if journal is not None:
+            journal.record(item.key, item.marker, posted_id)
+
+    failed: List[str] = []
+    # Overall note first so it stays on top of the MR activity.
+    if todo and todo[0].position is None:
+        try:
+            post_one(todo[0])
+        except (requests.RequestException, GitLabAPIError) as e:
+            failed.append(item_label(todo[0]))
+            print(f"ERROR: {item_label(todo[0])} failed\n{e}", file=sys.stderr)
+        else:
+            counts["posted"] += 1
+            print("OK: posted overall note")
+        todo = todo[1:]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(todo) or 1))) as pool:
+        for item, fut in [(item, pool.submit(post_one, item)) for item in todo]:
+            try:
+                fut.result()
+            except (requests.RequestException, GitLabAPIError) as e:
+                failed.append(item_label(item))
+                print(f"ERROR: {item_label(item)} failed\n{e}", file=sys.stderr)
+                continue
+            counts["posted"] += 1
+            print(f"OK: posted {item_label(item)}")
+    if failed:
+        raise GitLabAPIError(f"{len(failed)} items failed ({', '.join(failed)}); re-run to post the rest")
+    return counts
+
+def print_status(
+    review: Dict[str, Any],
+    journal: PostJournal,
+    hunks: Optional[HunkIndex] = None,
+    snap_lines: int = 0,
+) -> int:
+    """Offline progress view of a (possibly interrupted) posting run.
+
+    `hunks` (the MR export, as in post_file) decides which findings were demoted into
+    the overall note; without it every inline comment is listed as its own item.
+    """
+    items, demoted = review_items(review, {}, hunks, snap_lines)
+    done = 0
+    for item in items:
+        rec = journal.latest(item.key)
+        if rec is not None:
+            done += 1
+            print(f"  posted   {item_label(item):<14} id={rec.get('id')}  {rec.get('posted_at')}")
+        else:
+            print(f"  pending  {item_label(item)}")
+    if demoted:
+        print(f"  demoted  {len(demoted)} inline comments (in the overall note): {', '.join(str(i) for i in demoted)}")
+    print(f"DONE: {done}/{len(items)} posted, {len(items) - done} pending  ({journal.path})")
+    return 0
+
+def find_export(out_dir: str, project_path: str, iid: int, path: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """The MR export to validate against: `path` if given, else the newest one in out_dir/mr (or (None, None))."""
+    if path:
+        export = load_export(path)
+        mr = export.get("mr") or {}
+        if mr.get("project_path") != project_path or mr.get("iid") != iid:
+            raise ValueError(f"{path} is not an export of {project_path}!{iid}")
+        return path, export
+    # Newest of either format by mtime; only that one is loaded (with its diffs).
+    return load_previous(os.path.join(out_dir, "mr"), project_path, iid, (".mr.json", STREAM_SUFFIX))
+
+def post_file(
+    gl: GitLabClient,
+    mr_url: str,
+    review_path: str,
+    out_dir: str,
+    mr_json: Optional[str] = None,
+    dry_run: bool = False,
+    jobs: int = 1,
+    use_journal: bool = True,
+    snap_lines: int = 0,
+) -> Dict[str, int]:
+    """Validate and post one review JSON (see post_review); ValueError for local problems (stale export, ...)."""
+    mr_base, project_path, iid = parse_mr_url(mr_url)
+    if mr_base.rstrip("/") != gl.base_url.rstrip("/"):
+        raise ValueError(f"MR URL host({mr_base}) と config.GITLAB_BASE_URL({gl.base_url}) が不一致です。")
+    review = json.loads(pathlib.Path(review_path).read_text(encoding="utf-8"))
+    journal = PostJournal(journal_path(review_path)) if use_journal and not dry_run else None
+    export_path, export = find_export(out_dir, project_path, iid, mr_json)
+    hunks = HunkIndex.from_diffs(export.get("diffs") or []) if export is not None else None
+
+    if journal is not None:
+        # Everything already journaled: done without a single API call.
+        items, demoted = review_items(review, {}, hunks, snap_lines)
+        if all(journal.get(item.key, item.marker) is not None for item in items):
+            print(f"INFO: {review_path}: all {len(items)} items already posted ({journal.path})")
+            return {"posted": 0, "skipped": 0, "journaled": len(items), "demoted": len(demoted)}
+
+    # The MR is still fetched (ETag-cached) to compare head_sha: positions computed
+    # against an older diff could land on the wrong lines.
+    project_enc = encode_project(project_path)
+    mr = gl.get_json(f"/projects/{project_enc}/merge_requests/{iid}")
+    if not isinstance(mr, dict):
+        raise GitLabAPIError(f"MR metadata fetch failed: {mr_url}")
+    if export is not None:
+        diff_refs = (export.get("mr") or {}).get("diff_refs") or {}
+        current_head = (mr.get("diff_refs") or {}).get("head_sha")
+        if current_head and diff_refs.get("head_sha") != current_head:
+            raise ValueError(
+                f"{export_path} is stale (head_sha {diff_refs.get('head_sha')} != current {current_head}); "
+                "gitlab_export_mr.py で再取得してください。"
+            )
+        print(f"INFO: positions checked against {export_path}")
+    else:
+        print(f"WARN: no export of {project_path}!{iid} in OUT_DIR/mr; positions are not validated", file=sys.stderr)
+        diff_refs = mr.get("diff_refs") or {}
+    if not (diff_refs.get("base_sha") and diff_refs.get("start_sha") and diff_refs.get("head_sha")):
+        raise ValueError(f"MR diff_refs missing (base_sha/start_sha/head_sha): {mr_url}")
+
+    return post_review(
+        gl, project_path, iid, review, diff_refs, dry_run=dry_run, jobs=jobs,
+        journal=journal, hunks=hunks, snap_lines=snap_lines,
+    )
+
+def pair_reviews(review_dir: str, out_dir: str, mr_urls: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """(review JSON, MR URL or None) for every *.review.json in review_dir.
+
+    The MR comes from, in order: a top-level "mr_url" in the review JSON, the
+    `mr.web_url` of the export with the same stem (<title>__iid_<n>) in out_dir/mr,
+    or the only config.MR_URLS entry with that iid.
+    """
+    exports: Dict[str, str] = {}
+    for path in glob.glob(os.path.join(glob.escape(os.path.join(out_dir, "mr")), "*")):
+        name = os.path.basename(strip_compression(path))
+        for suffix in (".mr.json", STREAM_SUFFIX):
+            if name.endswith(suffix):
+                exports.setdefault(name[: -len(suffix)], path)
+    pairs: List[Tuple[str, Optional[str]]] = []
+    for review_path in sorted(glob.glob(os.path.join(glob.escape(review_dir), "*.review.json"))):
+        stem = os.path.basename(review_path)[: -len(".review.json")]
+        mr_url: Optional[str] = None
+        try:
+            review = json.loads(pathlib.Path(review_path).read_text(encoding="utf-8"))
+            mr_url = review.get("mr_url") if isinstance(review, dict) else None
+            if not mr_url and stem in exports:
+                mr_url = (load_export(exports[stem], include_diffs=False).get("mr") or {}).get("web_url")
+        except (OSError, ValueError):
+            pass
+        if not mr_url:
+            m = re.search(r"__iid_(\d+)$", stem)
+            same_iid = [u for u in mr_urls if m and u.rstrip("/").endswith(f"/merge_requests/{m.group(1)}")]
+            mr_url = same_iid[0] if len(same_iid) == 1 else None
+        pairs.append((review_path, mr_url))
+    return pairs
+
 def main() -> int:
     ap = argparse.ArgumentParser(description="Post AI review JSON to GitLab MR (overall note + inline discussions).")
-    ap.add_argument("--mr-url", required=True, help="MR URL")
-    ap.add_argument("--review-json", required=True, help="AI review JSON path")
+    ap.add_argument("--mr-url", help="MR URL (required unless --status / --batch)")
+    ap.add_argument("--review-json", help="AI review JSON path (required unless --batch)")
+    ap.add_argument("--batch", nargs="?", const="", metavar="DIR",
+                    help="Post every *.review.json in DIR (default: config.REVIEW_OUT_DIR), pairing each with its MR")
     ap.add_argument("--dry-run", action="store_true", help="Print only, do not post")
+    ap.add_argument("--jobs", type=int, default=int(getattr(config, "POST_JOBS", 4) or 4),
+                    help="Inline discussions posted concurrently per MR (default: config.POST_JOBS or 4)")
+    ap.add_argument("--mr-jobs", type=int, default=int(getattr(config, "POST_MR_JOBS", 4) or 4),
+                    help="With --batch: MRs posted concurrently (default: config.POST_MR_JOBS or 4)")
+    ap.add_argument("--status", action="store_true", help="Show posting progress from the journal (no API calls)")
+    ap.add_argument("--no-journal", action="store_true", help="Do not read or write <review>.journal.jsonl")
+    ap.add_argument("--mr-json", help="Export of this MR used for diff_refs and position checks (default: newest in OUT_DIR/mr)")
+    ap.add_argument("--snap-lines", type=int, default=int(getattr(config, "POSITION_SNAP_LINES", 3) or 0),
+                    help="Move a finding up to N lines to the nearest diff line (default: config.POSITION_SNAP_LINES or 3)")
     args = ap.parse_args()
 
+    if args.batch is None and not args.review_json:
+        print("ERROR: --review-json か --batch を指定してください。", file=sys.stderr)
+        return 2
+    if args.status:
+        if args.no_journal or args.batch is not None:
+            print("ERROR: --status は --review-json 1件に対してのみ使用でき、--no-journal とは同時に指定できません。", file=sys.stderr)
+            return 2
+        review = json.loads(pathlib.Path(args.review_json).read_text(encoding="utf-8"))
+        # The same export post_file would validate against, so demoted findings match the journal.
+        hunks = None
+        mr_url = args.mr_url or review.get("mr_url")
+        if mr_url:
+            try:
+                _, project_path, iid = parse_mr_url(mr_url)
+                _, export = find_export(str(getattr(config, "OUT_DIR", "./out")).strip(), project_path, iid, args.mr_json)
+            except (OSError, ValueError) as e:
+                print(f"ERROR: {e}", file=sys.stderr)
+                return 2
+            if export is not None:
+                hunks = HunkIndex.from_diffs(export.get("diffs") or [])
+        if hunks is None:
+            print("WARN: no MR export found (--mr-url / --mr-json); inline comments that would be demoted are listed as pending", file=sys.stderr)
+        return print_status(review, PostJournal(journal_path(args.review_json)), hunks, max(0, args.snap_lines))
+    if args.batch is None and not args.mr_url:
+        print("ERROR: --mr-url を指定してください。", file=sys.stderr)
+        return 2
+    if args.jobs < 1 or args.mr_jobs < 1:
+        print("ERROR: --jobs / --mr-jobs は 1 以上を指定してください。", file=sys.stderr)
+        return 2
+
     base_url = str(getattr(config, "GITLAB_BASE_URL", "")).strip()
     token = str(getattr(config, "GITLAB_TOKEN", "")).strip()
+    out_dir = str(getattr(config, "OUT_DIR", "./out")).strip()
     if not base_url or not token:
         print("ERROR: config.py の GITLAB_BASE_URL / GITLAB_TOKEN を設定してください。", file=sys.stderr)
         return 2
 
-    mr_base, project_path, iid = parse_mr_url(args.mr_url)
-    if mr_base.rstrip("/") != base_url.rstrip("/"):
-        print(f"ERROR: MR URL host({mr_base}) と config.GITLAB_BASE_URL({base_url}) が不一致です。", file=sys.stderr)
-        return 2
-
-    review = json.loads(pathlib.Path(args.review_json).read_text(encoding="utf-8"))
-    overall = review.get("mr_overall") or {}
-    inline_comments = review.get("inline_comments") or []
-
-    gl = GitLabClient(base_url=base_url, token=token, session=build_session())
-    project_enc = encode_project(project_path)
-
-    mr = gl.get_json(f"/projects/{project_enc}/merge_requests/{iid}")
-    if not isinstance(mr, dict):
-        print("ERROR: MR metadata fetch failed.", file=sys.stderr)
-        return 1
-
-    diff_refs = mr.get("diff_refs") or {}
-    base_sha = diff_refs.get("base_sha")
-    start_sha = diff_refs.get("start_sha")
-    head_sha = diff_refs.get("head_sha")
-    if not (base_sha and start_sha and head_sha):
-        print("ERROR: MR diff_refs missing (base_sha/start_sha/head_sha).", file=sys.stderr)
-        return 1
-
-    # Overall note
-    overall_body = format_overall_comment(overall)
-    if args.dry_run:
-        print("---- Overall ----")
-        print(overall_body)
+    if args.batch is not None:
+        review_dir = args.batch or str(getattr(config, "REVIEW_OUT_DIR", "./review_out")).strip()
+        targets = pair_reviews(review_dir, out_dir, list(getattr(config, "MR_URLS", []) or []))
+        if not targets:
+            print(f"ERROR: {review_dir} に *.review.json がありません。", file=sys.stderr)
+            return 2
+        mr_jobs = min(args.mr_jobs, len(targets))
     else:
-        gl.post_json(f"/projects/{project_enc}/merge_requests/{iid}/notes", {"body": overall_body})
-        print("OK: posted overall note")
-
-    # Inline discussions
-    for idx, c in enumerate(inline_comments, start=1):
-        path = (c.get("path") or "").strip()
-        side = (c.get("side") or "new").strip()
-        line = c.get("line")
-
-        if not path or not isinstance(line, int) or line <= 0:
-            print(f"WARN: skip inline[{idx}] invalid path/line", file=sys.stderr)
-            continue
-
-        position: Dict[str, Any] = {
-            "position_type": "text",
-            "base_sha": base_sha,
-            "start_sha": start_sha,
-            "head_sha": head_sha,
-        }
-        if side == "old":
-            position["old_path"] = path
-            position["old_line"] = line
-        else:
-            position["new_path"] = path
-            position["new_line"] = line
-
-        body = format_inline_comment(c)
-        if args.dry_run:
-            print(f"---- Inline {idx} ----")
-            print(json.dumps(position, ensure_ascii=False))
-            print(body)
-        else:
-            gl.post_json(f"/projects/{project_enc}/merge_requests/{iid}/discussions", {"body": body, "position": position})
-            print(f"OK: posted inline {idx}")
+        targets = [(args.review_json, args.mr_url)]
+        mr_jobs = 1
+
+    limiter = open_rate_limiter(config)
+    # One pooled client (and one limiter for the host) shared by every MR.
+    gl = GitLabClient(
+        base_url=base_url,
+        token=token,
+        # GET only: a retried POST after a 5xx/timeout can create a duplicate discussion.
+        session=build_session(pool_size=max(mr_jobs * args.jobs, 10), retry_429=limiter is None),
+        cache=open_response_cache(config),
+        limiter=limiter,
+    )
 
+    def work(review_path: str, mr_url: str) -> Dict[str, int]:
+        return post_file(
+            gl, mr_url, review_path, out_dir,
+            mr_json=args.mr_json if args.batch is None else None,
+            dry_run=args.dry_run, jobs=args.jobs, use_journal=not args.no_journal,
+            snap_lines=max(0, args.snap_lines),
+        )
+
+    totals = {"posted": 0, "skipped": 0, "journaled": 0, "demoted": 0}
+    failures: List[Tuple[str, str]] = []
+    with ThreadPoolExecutor(max_workers=mr_jobs) as pool:
+        futures = []
+        for review_path, mr_url in targets:
+            if not mr_url:
+                failures.append((review_path, "MR not found (no mr_url, no export with the same name, no unique MR_URLS match)"))
+                print(f"ERROR: {review_path}: 対応するMRが見つかりません。", file=sys.stderr)
+                continue
+            futures.append((review_path, mr_url, pool.submit(work, review_path, mr_url)))
+        for review_path, mr_url, fut in futures:
+            try:
+                counts = fut.result()
+            except (OSError, ValueError, requests.RequestException, GitLabAPIError) as e:
+                failures.append((review_path, str(e)))
+                print(f"ERROR: post failed: {review_path} -> {mr_url}\n{e}", file=sys.stderr)
+                continue
+            for k in totals:
+                totals[k] += counts[k]
+            if args.batch is not None:
+                print(f"OK: {review_path} -> {mr_url} posted={counts['posted']} skipped={counts['skipped']} "
+                      f"journaled={counts['journaled']} demoted={counts['demoted']}")
+
+    if gl.limiter is not None and args.batch is not None:
+        print(format_rate_stats(gl.limiter), file=sys.stderr)
+    print(
+        f"DONE: posted={totals['posted']} skipped={totals['skipped']} "
+        f"journaled={totals['journaled']} demoted={totals['demoted']}"
+        + (f" reviews={len(targets)} failed={len(failures)}" if args.batch is not None else "")
+    )
+    if failures:
+        if args.batch is not None:
+            for review_path, _ in failures:
+                print(f"  FAILED: {review_path}", file=sys.stderr)
+        return 1
     return 0
 
 if __name__ == "__main__":
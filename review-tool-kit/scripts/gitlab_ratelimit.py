@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Client-side request scheduler that keeps GitLabClient under the server rate limit.
+
+Three controls, all fed by every response:
+
+- Quota. When GitLab reports `RateLimit-Remaining` and `RateLimit-Reset`, the
+  remaining quota of the current window is counted down by each request; at 0,
+  new requests wait for the reset, after which the count starts again from
+  `RateLimit-Limit`. A lower Remaining (another client on the same token) lowers
+  the count; responses of an older window are ignored. Using the window's quota
+  up front and then waiting is what fixed windows (GitLab's throttles) reward.
+- Token bucket (requests/second), capped at max_rps. It only grows back
+  additively after a 429 halved it.
+- AIMD concurrency limit. Each successful response adds ~1/limit (about +1 per
+  round of requests); a 429 halves the limit and the rate and pauses everyone for
+  Retry-After / the reset time. Simultaneous 429s count as one decrease.
+
+Retrying 429s is done by GitLabClient through the limiter (build_session(retry_429=False)),
+so backoff is shared by all worker threads instead of each urllib3 retry sleeping alone.
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+MIN_RPS = 0.2
+ADDITIVE_RPS = 0.5
+# Resets closer than this (seconds) belong to the same window; RateLimit-Reset has 1s resolution.
+_SAME_WINDOW_SEC = 0.5
+# Treat RateLimit-Reset values below this as "seconds from now" instead of a Unix time.
+_EPOCH_THRESHOLD = 1_000_000_000
+
+def _header_float(r: requests.Response, name: str) -> Optional[float]:
+    value = r.headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def rate_headers(r: requests.Response) -> Tuple[Optional[float], Optional[float]]:
+    """(remaining, seconds until reset) from RateLimit-* headers, or None when absent."""
+    remaining = _header_float(r, "RateLimit-Remaining")
+    reset = _header_float(r, "RateLimit-Reset")
+    if reset is not None and reset >= _EPOCH_THRESHOLD:
+        reset = reset - time.time()
+    return remaining, (max(0.0, reset) if reset is not None else None)
+
+class RateLimiter:
+    def __init__(self, max_rps: float = 20.0, max_concurrency: int = 16, initial_concurrency: int = 4) -> None:
+        self.max_rps = max(MIN_RPS, float(max_rps))
+        self.rate = self.max_rps
+        self.burst = max(1.0, self.max_rps)
+        self.tokens = self.burst
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.limit = float(max(1, min(initial_concurrency, self.max_concurrency)))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        # Requests left in the current window (None: unknown), when it resets, and RateLimit-Limit.
+        self.quota: Optional[float] = None
+        self.quota_reset = 0.0
+        self.quota_limit: Optional[float] = None
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        # stats
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.waited_sec = 0.0
+        self.peak_in_flight = 0
+        self.min_remaining: Optional[float] = None
+
+    def _refill(self, now: float) -> None:
+        if now < self.blocked_until:
+            # No credit accrues while paused, so the reset is not followed by a burst.
+            self._last_refill = now
+            return
+        self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _quota_left(self, now: float) -> float:
+        if self.quota is not None and now >= self.quota_reset:
+            if self.quota_limit is None:
+                self.quota = None
+            else:
+                # A new window; its reset time is learnt from the next response.
+                self.quota = self.quota_limit - self.in_flight
+                self.quota_reset = float("inf")
+        return float("inf") if self.quota is None else self.quota
+
+    def acquire(self) -> None:
+        """Block until a concurrency slot and a token are available."""
+        with self._cond:
+            start = time.monotonic()
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    timeout: Optional[float] = self.blocked_until - now
+                elif self.in_flight >= int(self.limit):
+                    timeout = None  # woken by release()
+                elif self._quota_left(now) < 1.0:
+                    # Unknown reset: the next response tells (woken by release()).
+                    timeout = None if self.quota_reset == float("inf") else self.quota_reset - now
+                elif self.tokens < 1.0:
+                    timeout = (1.0 - self.tokens) / self.rate
+                else:
+                    break
+                self._cond.wait(timeout)
+            self.tokens -= 1.0
+            if self.quota is not None:
+                self.quota -= 1.0
+            self.in_flight += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.waited_sec += time.monotonic() - start
+
+    def release(self, r: Optional[requests.Response]) -> None:
+        """Free the slot taken by acquire(); r=None if the request raised."""
+        with self._cond:
+            self.in_flight -= 1
+            if r is not None:
+                self._observe(r)
+            self._cond.notify_all()
+
+    def _observe(self, r: requests.Response) -> None:
+        now = time.monotonic()
+        remaining, reset_in = rate_headers(r)
+        if remaining is not None:
+            self.min_remaining = remaining if self.min_remaining is None else min(self.min_remaining, remaining)
+
+        if r.status_code == 429:
+            self.throttled += 1
+            retry_after = _header_float(r, "Retry-After")
+            pause = retry_after if retry_after is not None else (reset_in if reset_in is not None else 1.0)
+            self.blocked_until = max(self.blocked_until, now + pause)
+            self.tokens = min(self.tokens, 0.0)
+            if now - self._last_decrease >= max(pause, 1.0):
+                self._last_decrease = now
+                self.decreases += 1
+                self.limit = max(1.0, self.limit / 2)
+                self.rate = max(MIN_RPS, self.rate / 2)
+            return
+
+        self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+        self.rate = min(self.max_rps, self.rate + ADDITIVE_RPS)
+        if remaining is None or not reset_in:
+            return  # no headers, or a window that has already reset
+        limit = _header_float(r, "RateLimit-Limit")
+        if limit is not None:
+            self.quota_limit = limit
+        reset_at = now + reset_in
+        if self.quota_reset == float("inf"):
+            # Counted down from RateLimit-Limit since the reset; only the reset time is new.
+            self.quota, self.quota_reset = min(self.quota, remaining), reset_at
+        elif self.quota is None or reset_at > self.quota_reset + _SAME_WINDOW_SEC:
+            # Joined a window midway: requests still in flight will consume quota too.
+            self.quota, self.quota_reset = remaining - self.in_flight, reset_at
+        elif reset_at >= self.quota_reset - _SAME_WINDOW_SEC:
+            # Other clients sharing the token show up as a Remaining below our own count.
+            self.quota = min(self.quota, remaining)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "requests": self.requests,
+                "throttled_429": self.throttled,
+                "decreases": self.decreases,
+                "waited_sec": round(self.waited_sec, 2),
+                "rate_rps": round(self.rate, 2),
+                "concurrency_limit": round(self.limit, 1),
+                "peak_in_flight": self.peak_in_flight,
+                "min_remaining": self.min_remaining,
+            }
+
+def open_rate_limiter(config: Any) -> Optional[RateLimiter]:
+    """RateLimiter configured from config.py (None when RATE_LIMIT_ENABLED is False)."""
+    if not bool(getattr(config, "RATE_LIMIT_ENABLED", False)):
+        return None
+    return RateLimiter(
+        max_rps=float(getattr(config, "RATE_LIMIT_MAX_RPS", 20) or 20),
+        max_concurrency=int(getattr(config, "RATE_LIMIT_MAX_CONCURRENCY", 16) or 16),
+    )
+
+def format_rate_stats(limiter: RateLimiter) -> str:
+    s = limiter.stats()
+    return (
+        f"INFO: rate limiter requests={s['requests']} 429={s['throttled_429']} decreases={s['decreases']} "
+        f"waited={s['waited_sec']:.1f}s rate={s['rate_rps']}/s concurrency={s['concurrency_limit']} "
+        f"peak_in_flight={s['peak_in_flight']} min_remaining={s['min_remaining']}"
+    )
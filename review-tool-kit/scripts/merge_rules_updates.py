@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Apply the AI outputs of rules update packs (one MR, or the packs of
+build_rules_update_prompt_pack.py --aggregate) to the coding rules file, see rules_merge.py.
+
+An output is either a rule patch ({"ops": [...]}, --patch packs), validated
+against the base rules file first (any error: nothing is written), or a full
+rules JSON, compared with the base rules file the packs were built from.
+The changes of all outputs are applied together: importance bumps add up,
+tags are united, new rules get fresh R-<n> ids and duplicates among them are
+merged, conflicting text edits keep the first output's (WARN). The file is
+replaced atomically with a new updated_at.
+
+Usage:
+  python scripts/merge_rules_updates.py ./review_out/foo__iid_17.rules_patch.json
+  python scripts/merge_rules_updates.py ./review_out/aggregate.shard*.rules.json
+  python scripts/merge_rules_updates.py a.json b.json --base ./rules/coding_rules.json --out ./rules/merged.json
+  python scripts/merge_rules_updates.py ./review_out/aggregate.shard*.rules.json --dry-run
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import pathlib
+import shutil
+import sys
+from typing import Any, Dict, List, Tuple
+
+from comment_clusters import load_rules, save_rules
+from prompt_shards import shard_number
+from rules_merge import apply_ops, rules_delta, validate_patch
+
+HERE = pathlib.Path(__file__).resolve().parent.parent
+CONFIG_FILE = pathlib.Path(os.environ.get("REVIEW_TOOLKIT_CONFIG") or HERE / "config.py")
+TEMPLATE_FILE = HERE / "config.template.py"
+
+def load_config_module():
+    cached = sys.modules.get("review_toolkit_config")
+    if cached is not None:
+        return cached
+    if not CONFIG_FILE.exists():
+        if TEMPLATE_FILE.exists():
+            shutil.copyfile(TEMPLATE_FILE, CONFIG_FILE)
+            print("ERROR: config.py が存在しなかったため config.template.py から生成しました。", file=sys.stderr)
+            print("config.py を編集して GITLAB_TOKEN / MR_URLS 等を設定後、再実行してください。", file=sys.stderr)
+            print(f"生成先: {CONFIG_FILE}", file=sys.stderr)
+            sys.exit(2)
+        raise RuntimeError("config.py / config.template.py が見つかりません。")
+    spec = importlib.util.spec_from_file_location("config", str(CONFIG_FILE))
+    if spec is None or spec.loader is None:
+        raise RuntimeError("config.py の読み込みに失敗しました。")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    sys.modules["review_toolkit_config"] = module
+    return module
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Apply AI rules update outputs (rule patches or full rules JSONs) to the coding rules JSON.")
+    ap.add_argument("outputs", nargs="+", help="AI output JSON files, rule patches or rules JSONs (globs are expanded)")
+    ap.add_argument("--base", help="Rules file the packs were built from (default: config.CODING_RULES_FILE)")
+    ap.add_argument("--out", help="Output path (default: --base, rewritten in place)")
+    ap.add_argument("--dry-run", action="store_true", help="Only print what would change")
+    args = ap.parse_args()
+
+    paths: List[str] = []
+    for pattern in args.outputs:
+        matched = sorted(glob.glob(pattern)) or [pattern]
+        paths.extend(p for p in matched if p not in paths)
+    # pack order decides which conflicting edit is kept; shard10 sorts after shard9
+    paths.sort(key=lambda p: shard_number(os.path.basename(p)) or (0, 0))
+
+    base_path = args.base or str(getattr(load_config_module(), "CODING_RULES_FILE", "./rules/coding_rules.json"))
+    try:
+        base = load_rules(base_path)
+        stock = load_rules(base_path)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {base_path}: {e}", file=sys.stderr)
+        return 1
+
+    patches: List[Tuple[str, List[Dict[str, Any]]]] = []
+    invalid = 0
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {path}: {e}", file=sys.stderr)
+            return 1
+        if isinstance(data, dict) and "ops" in data:
+            ops, errors = validate_patch(base, data)
+            for error in errors:
+                print(f"ERROR: {path}: {error}", file=sys.stderr)
+            invalid += bool(errors)
+            patches.append((os.path.basename(path), ops))
+            continue
+        if not isinstance(data, dict) or not isinstance(data.get("rules"), list):
+            print(f"ERROR: {path}: neither a rule patch ('ops' list) nor a coding rules JSON ('rules' list)", file=sys.stderr)
+            return 1
+        ops, missing = rules_delta(base, data)
+        if missing:
+            print(f"WARN: {os.path.basename(path)}: {len(missing)} rules missing from the output were kept: {', '.join(missing[:10])}", file=sys.stderr)
+        patches.append((os.path.basename(path), ops))
+    if invalid:
+        print(f"ERROR: {invalid} patches are invalid; nothing was written.", file=sys.stderr)
+        return 1
+
+    for message in apply_ops(stock, patches):
+        print(message, file=sys.stderr if message.startswith("WARN:") else sys.stdout)
+    before = len(base["rules"])
+    summary = f"{len(paths)} outputs, {sum(len(ops) for _, ops in patches)} changes, rules {before} -> {len(stock['rules'])}"
+    if args.dry_run:
+        print(f"DONE: {summary} (dry run, nothing written)")
+        return 0
+    out_path = args.out or base_path
+    save_rules(out_path, stock)
+    print(f"OK: wrote {out_path} ({summary})")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
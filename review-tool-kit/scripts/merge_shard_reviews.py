@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Merge the review JSONs of a sharded MR prompt (build_mr_review_prompt_pack.py --max-tokens)
+into one review JSON for gitlab_post_ai_review.py.
+
+- mr_overall.status: the most severe shard status (指摘あり > リファクタあり > マージ可能)
+- changes_summary / risk_impact: distinct shard texts, one per line
+- inline_comments: all shards, duplicates (same path/side/line/detail) removed
+
+Output: <name>.review.json next to the inputs (".shard<i>of<n>" dropped), or --out.
+
+Usage:
+  python scripts/merge_shard_reviews.py ./review_out/foo__iid_17.shard*.review.json
+  python scripts/merge_shard_reviews.py a.review.json b.review.json --out ./review_out/foo__iid_17.review.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from typing import Any, Dict, List
+
+from export_io import write_json_file
+from prompt_shards import merge_reviews, merged_name, shard_number
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Merge per-shard AI review JSONs into one review JSON.")
+    ap.add_argument("reviews", nargs="+", help="Shard review JSON files (globs are expanded)")
+    ap.add_argument("--out", help="Output path (default: first input without .shard<i>of<n>)")
+    args = ap.parse_args()
+
+    paths: List[str] = []
+    for pattern in args.reviews:
+        matched = sorted(glob.glob(pattern)) or [pattern]
+        paths.extend(p for p in matched if p not in paths)
+    # shard order decides which duplicate finding is kept; shard10 sorts after shard9
+    paths.sort(key=lambda p: shard_number(os.path.basename(p)) or (0, 0))
+
+    reviews: List[Dict[str, Any]] = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {path}: {e}", file=sys.stderr)
+            return 1
+        if not isinstance(data, dict):
+            print(f"ERROR: {path}: review JSON must be an object", file=sys.stderr)
+            return 1
+        reviews.append(data)
+
+    out_path = args.out
+    if not out_path:
+        name = os.path.basename(paths[0])
+        if not shard_number(name):
+            print("ERROR: 入力ファイル名に .shard<i>of<n> が含まれないため --out を指定してください。", file=sys.stderr)
+            return 2
+        out_path = os.path.join(os.path.dirname(paths[0]), merged_name(name))
+
+    merged = merge_reviews(reviews)
+    total = sum(len(r.get("inline_comments") or []) for r in reviews)
+    write_json_file(out_path, merged)
+    print(f"OK: wrote {out_path} ({len(reviews)} shards, {len(merged['inline_comments'])}/{total} inline comments after dedup)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Optional SQLite store for exported MRs, keyed by (project_path, iid).
+
+Enabled by config.MR_DB_PATH. gitlab_export_mr.py / gitlab_fetch_mr_comments.py
+upsert every MR they write, so the store always holds one row per MR no matter
+how often it was renamed (the JSON files are named after the title). Tables:
+
+  mrs    (project_path, iid) PK  - summary, diff_refs, counts, sync state
+  files  (project_path, iid, idx) - one row per diff entry; indexed by new_path
+  notes  (project_path, iid, note_id) - one row per comment; indexed by path,
+         resolved and author, so cross-MR questions ("unresolved notes on *.py")
+         are a single query instead of loading every export
+
+Each row keeps the original record as JSON next to the indexed columns, so
+`export_payload()` / `comments_payload()` rebuild the .mr.json / .comments.json
+shapes exactly. Path filters use SQLite GLOB (`*.py`, `src/*`; case-sensitive).
+"""
+
+import fnmatch
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mrs (
+    project_path TEXT NOT NULL,
+    iid INTEGER NOT NULL,
+    title TEXT,
+    web_url TEXT,
+    state TEXT,
+    source_branch TEXT,
+    target_branch TEXT,
+    diff_refs TEXT,
+    fetched_at TEXT,
+    notes_fetched_at TEXT,
+    counts TEXT,
+    sync TEXT,
+    has_diffs INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (project_path, iid)
+);
+CREATE INDEX IF NOT EXISTS mrs_state ON mrs (state);
+
+CREATE TABLE IF NOT EXISTS files (
+    project_path TEXT NOT NULL,
+    iid INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    old_path TEXT,
+    new_path TEXT,
+    omitted TEXT,
+    diff TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (project_path, iid, idx)
+);
+CREATE INDEX IF NOT EXISTS files_new_path ON files (new_path);
+
+CREATE TABLE IF NOT EXISTS notes (
+    project_path TEXT NOT NULL,
+    iid INTEGER NOT NULL,
+    note_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    discussion_id TEXT,
+    path TEXT,
+    line INTEGER,
+    author TEXT,
+    resolved INTEGER,
+    system INTEGER,
+    updated_at TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (project_path, iid, note_id)
+);
+CREATE INDEX IF NOT EXISTS notes_path ON notes (path);
+CREATE INDEX IF NOT EXISTS notes_resolved ON notes (resolved, system);
+CREATE INDEX IF NOT EXISTS notes_author ON notes (author);
+"""
+
+COMMENT_MR_KEYS = ("project_path", "iid", "title", "web_url", "source_branch", "target_branch", "state")
+
+def _dumps(value: Any) -> Optional[str]:
+    return None if value is None else json.dumps(value, ensure_ascii=False)
+
+def _loads(text: Optional[str]) -> Any:
+    return None if text is None else json.loads(text)
+
+def _bool(value: Any) -> Optional[int]:
+    return None if value is None else int(bool(value))
+
+def _note_location(c: Dict[str, Any]) -> Tuple[Optional[str], Optional[int]]:
+    pos = c.get("position") or {}
+    if not isinstance(pos, dict):
+        return None, None
+    path = pos.get("new_path") or pos.get("old_path")
+    line = pos.get("new_line") if pos.get("new_line") is not None else pos.get("old_line")
+    return path, line
+
+def _glob_clause(column: str, globs: Sequence[str]) -> Tuple[str, List[Any]]:
+    if not globs:
+        return "", []
+    return " AND (" + " OR ".join(f"{column} GLOB ?" for _ in globs) + ")", list(globs)
+
+def note_matches(c: Dict[str, Any], unresolved_only: bool = False, path_globs: Sequence[str] = ()) -> bool:
+    """query_notes()' unresolved / path filters for a comment read from a file (GLOB is case-sensitive, so is fnmatchcase)."""
+    if unresolved_only and _bool(c.get("resolved")) != 0:
+        return False
+    if not path_globs:
+        return True
+    path, _ = _note_location(c)
+    return path is not None and any(fnmatch.fnmatchcase(path, g) for g in path_globs)
+
+class MRStore:
+    """Thread-safe: every operation uses its own short-lived connection, writes are serialized."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # commit on success, rollback on error
+                yield conn
+        finally:
+            conn.close()
+
+    # ---- writes ----
+
+    def upsert(
+        self,
+        mr: Dict[str, Any],
+        fetched_at: Optional[str],
+        comments: Iterable[Dict[str, Any]],
+        sync: Optional[Dict[str, Any]] = None,
+        diffs: Optional[Iterable[Dict[str, Any]]] = None,
+        counts: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Insert or replace one MR. diffs=None (a comments-only fetch) keeps the stored files / diff_refs."""
+        key = (mr.get("project_path"), int(mr.get("iid")))
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                """INSERT INTO mrs (project_path, iid, title, web_url, state, source_branch, target_branch,
+                                    notes_fetched_at, sync)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (project_path, iid) DO UPDATE SET
+                     title = excluded.title, web_url = excluded.web_url, state = excluded.state,
+                     source_branch = excluded.source_branch, target_branch = excluded.target_branch,
+                     notes_fetched_at = excluded.notes_fetched_at, sync = excluded.sync""",
+                (*key, mr.get("title"), mr.get("web_url"), mr.get("state"), mr.get("source_branch"),
+                 mr.get("target_branch"), fetched_at, _dumps(sync)),
+            )
+            conn.execute("DELETE FROM notes WHERE project_path = ? AND iid = ?", key)
+            conn.executemany(
+                """INSERT OR REPLACE INTO notes (project_path, iid, note_id, idx, discussion_id, path, line, author,
+                                                 resolved, system, updated_at, record)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    (*key, c.get("note_id"), i, c.get("discussion_id"), *_note_location(c),
+                     (c.get("author") or {}).get("username"), _bool(c.get("resolved")), _bool(c.get("system")),
+                     c.get("updated_at"), _dumps(c))
+                    for i, c in enumerate(comments)
+                ),
+            )
+            if diffs is None:
+                return
+            conn.execute(
+                "UPDATE mrs SET diff_refs = ?, fetched_at = ?, counts = ?, has_diffs = 1 WHERE project_path = ? AND iid = ?",
+                (_dumps(mr.get("diff_refs")), fetched_at, _dumps(counts), *key),
+            )
+            conn.execute("DELETE FROM files WHERE project_path = ? AND iid = ?", key)
+            conn.executemany(
+                "INSERT INTO files (project_path, iid, idx, old_path, new_path, omitted, diff, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    # The diff text lives in its own column; `record` keeps the key order with a null placeholder.
+                    (*key, i, d.get("old_path"), d.get("new_path"), d.get("omitted"), d.get("diff"), _dumps({**d, "diff": None}))
+                    for i, d in enumerate(diffs)
+                ),
+            )
+
+    def upsert_export(self, payload: Dict[str, Any]) -> None:
+        """Upsert a .mr.json-shaped payload (or a .comments.json one, which has no "diffs")."""
+        self.upsert(
+            payload.get("mr") or {},
+            payload.get("fetched_at"),
+            payload.get("comments") or [],
+            sync=payload.get("sync"),
+            diffs=payload.get("diffs") if "diffs" in payload else None,
+            counts=payload.get("counts"),
+        )
+
+    def upsert_stream_export(self, path: str) -> None:
+        """Upsert a .mr.jsonl file, reading it twice (comments, then diffs) so nothing is materialized."""
+        from mr_export_stream import iter_records
+
+        header: Dict[str, Any] = {}
+        footer: Dict[str, Any] = {}
+        for kind, rec in iter_records(path):
+            if kind == "header":
+                header = rec
+            elif kind == "footer":
+                footer = rec
+        self.upsert(
+            header.get("mr") or {},
+            header.get("fetched_at"),
+            (rec for kind, rec in iter_records(path) if kind == "comment"),
+            sync=footer.get("sync"),
+            diffs=(rec for kind, rec in iter_records(path) if kind == "diff"),
+            counts=footer.get("counts"),
+        )
+
+    # ---- reads ----
+
+    def list_mrs(self, project_path: Optional[str] = None, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT project_path, iid, title, state, fetched_at, notes_fetched_at FROM mrs WHERE 1 = 1"
+        args: List[Any] = []
+        if project_path:
+            sql += " AND project_path = ?"
+            args.append(project_path)
+        if state:
+            sql += " AND state = ?"
+            args.append(state)
+        with self._connect() as conn:
+            rows = conn.execute(sql + " ORDER BY project_path, iid", args).fetchall()
+        cols = ("project_path", "iid", "title", "state", "fetched_at", "notes_fetched_at")
+        return [dict(zip(cols, r)) for r in rows]
+
+    def _mr_row(self, conn: sqlite3.Connection, project_path: str, iid: int) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            "SELECT title, web_url, state, source_branch, target_branch, diff_refs, fetched_at, notes_fetched_at, counts, sync "
+            "FROM mrs WHERE project_path = ? AND iid = ?",
+            (project_path, iid),
+        ).fetchone()
+        if row is None:
+            return None
+        title, web_url, state, source_branch, target_branch, diff_refs, fetched_at, notes_fetched_at, counts, sync = row
+        return {
+            "mr": {"project_path": project_path, "iid": iid, "title": title, "web_url": web_url, "state": state,
+                   "source_branch": source_branch, "target_branch": target_branch, "diff_refs": _loads(diff_refs)},
+            "fetched_at": fetched_at,
+            "notes_fetched_at": notes_fetched_at,
+            "counts": _loads(counts) or {},
+            "sync": _loads(sync),
+        }
+
+    def iter_diffs(self, project_path: str, iid: int, path_globs: Sequence[str] = ()) -> Iterator[Dict[str, Any]]:
+        where, args = _glob_clause("COALESCE(new_path, old_path)", path_globs)
+        with self._connect() as conn:
+            for record, diff in conn.execute(
+                f"SELECT record, diff FROM files WHERE project_path = ? AND iid = ?{where} ORDER BY idx",
+                [project_path, iid, *args],
+            ):
+                d = json.loads(record)
+                d["diff"] = diff
+                yield d
+
+    def query_notes(
+        self,
+        project_path: Optional[str] = None,
+        iid: Optional[int] = None,
+        unresolved_only: bool = False,
+        include_system: bool = True,
+        path_globs: Sequence[str] = (),
+        author: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Comment records matching every given filter, in MR / export order (adds project_path, iid)."""
+        sql = "SELECT project_path, iid, record FROM notes WHERE 1 = 1"
+        args: List[Any] = []
+        if project_path:
+            sql += " AND project_path = ?"
+            args.append(project_path)
+        if iid is not None:
+            sql += " AND iid = ?"
+            args.append(iid)
+        if unresolved_only:
+            sql += " AND resolved = 0"
+        if not include_system:
+            sql += " AND COALESCE(system, 0) = 0"
+        if author:
+            sql += " AND author = ?"
+            args.append(author)
+        where, glob_args = _glob_clause("path", path_globs)
+        with self._connect() as conn:
+            for project, mr_iid, record in conn.execute(sql + where + " ORDER BY project_path, iid, idx", args + glob_args):
+                yield {"project_path": project, "iid": mr_iid, **json.loads(record)}
+
+    # ---- JSON exporters (current file shapes) ----
+
+    def export_payload(self, project_path: str, iid: int, path_globs: Sequence[str] = ()) -> Optional[Dict[str, Any]]:
+        """The .mr.json payload for one MR; path_globs limits both diffs and (positioned) comments."""
+        with self._connect() as conn:
+            row = self._mr_row(conn, project_path, iid)
+        if row is None:
+            return None
+        diffs = list(self.iter_diffs(project_path, iid, path_globs))
+        comments = [self._strip(c) for c in self.query_notes(project_path, iid, path_globs=path_globs)]
+        counts = dict(row["counts"])
+        counts.update({"diff_files": len(diffs), "comments": len(comments)})
+        payload = {
+            "fetched_at": row["fetched_at"] or row["notes_fetched_at"],
+            "mr": row["mr"],
+            "diffs": diffs,
+            "comments": comments,
+            "counts": counts,
+        }
+        if row["sync"] is not None:
+            payload["sync"] = row["sync"]
+        return payload
+
+    def comments_payload(
+        self,
+        project_path: str,
+        iid: int,
+        unresolved_only: bool = False,
+        path_globs: Sequence[str] = (),
+    ) -> Optional[Dict[str, Any]]:
+        """The .comments.json payload for one MR, optionally narrowed to a slice of its notes."""
+        with self._connect() as conn:
+            row = self._mr_row(conn, project_path, iid)
+        if row is None:
+            return None
+        comments = [
+            self._strip(c)
+            for c in self.query_notes(project_path, iid, unresolved_only=unresolved_only, path_globs=path_globs)
+        ]
+        return {
+            "fetched_at": row["notes_fetched_at"],
+            "mr": {k: row["mr"].get(k) for k in COMMENT_MR_KEYS},
+            "comments": comments,
+            "counts": {"comments": len(comments)},
+            "sync": row["sync"],
+        }
+
+    @staticmethod
+    def _strip(c: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in c.items() if k not in ("project_path", "iid")}
+
+def parse_mr_ref(ref: str) -> Tuple[str, int]:
+    """"group/repo!17" (GitLab's MR reference syntax) -> ("group/repo", 17)."""
+    project, sep, iid = ref.strip().rpartition("!")
+    if not sep or not project or not iid.isdigit():
+        raise ValueError(f"MR reference must look like group/repo!17: {ref}")
+    return project, int(iid)
+
+def open_mr_store(config: Any, path: Optional[str] = None) -> Optional[MRStore]:
+    """MRStore at `path` or config.MR_DB_PATH (None when neither is set)."""
+    db_path = (path or str(getattr(config, "MR_DB_PATH", "") or "")).strip()
+    return MRStore(db_path) if db_path else None
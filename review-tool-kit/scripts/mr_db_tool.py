@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Maintain / query the SQLite MR store (config.MR_DB_PATH, see mr_db.py).
+
+Subcommands:
+  import   load existing ./out/mr/*.mr.json(l) and ./out/comments/*.comments.json (also .gz/.xz/.zst) into the store
+  list     MRs in the store
+  export   write one MR back as .mr.json (or .comments.json with --comments)
+  notes    comments across MRs as JSON Lines, filtered by project/iid/path/resolution/author
+
+Usage:
+  python scripts/mr_db_tool.py import
+  python scripts/mr_db_tool.py export "group/repo!17" --out ./out/mr/restored.mr.json
+  python scripts/mr_db_tool.py notes --unresolved-only --path-glob "*.py" --no-system
+"""
+
+import argparse
+import glob
+import json
+import os
+import pathlib
+import shutil
+import sys
+from typing import List, Tuple
+
+import importlib.util
+
+from export_io import output_stem, strip_compression, write_json_file
+from mr_db import open_mr_store, parse_mr_ref
+from mr_export_stream import STREAM_SUFFIX, is_stream_export, load_export
+
+HERE = pathlib.Path(__file__).resolve().parent.parent
+# REVIEW_TOOLKIT_CONFIG lets CI jobs / benchmarks point at a generated config file.
+CONFIG_FILE = pathlib.Path(os.environ.get("REVIEW_TOOLKIT_CONFIG") or HERE / "config.py")
+TEMPLATE_FILE = HERE / "config.template.py"
+
+def load_config_module():
+    # Scripts imported into one process (run_review_pipeline.py) share a single config module.
+    cached = sys.modules.get("review_toolkit_config")
+    if cached is not None:
+        return cached
+    if not CONFIG_FILE.exists():
+        if TEMPLATE_FILE.exists():
+            shutil.copyfile(TEMPLATE_FILE, CONFIG_FILE)
+            print("ERROR: config.py が存在しなかったため config.template.py から生成しました。", file=sys.stderr)
+            print("config.py を編集して GITLAB_TOKEN / MR_URLS 等を設定後、再実行してください。", file=sys.stderr)
+            print(f"生成先: {CONFIG_FILE}", file=sys.stderr)
+            sys.exit(2)
+        raise RuntimeError("config.py / config.template.py が見つかりません。")
+    spec = importlib.util.spec_from_file_location("config", str(CONFIG_FILE))
+    if spec is None or spec.loader is None:
+        raise RuntimeError("config.py の読み込みに失敗しました。")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    sys.modules["review_toolkit_config"] = module
+    return module
+
+config = load_config_module()
+
+def _exports(directory: str, suffixes: Tuple[str, ...]) -> List[str]:
+    """Exports in directory ending with one of suffixes, plain or compressed (see export_io.py)."""
+    found = glob.glob(os.path.join(glob.escape(directory), "*"))
+    return sorted((p for p in found if strip_compression(p).endswith(suffixes)), key=os.path.getmtime)
+
+def cmd_import(db, out_dir: str) -> int:
+    # Comments first, so a full export of the same MR (with diffs) is applied last.
+    paths = _exports(os.path.join(out_dir, "comments"), (".comments.json",))
+    paths += _exports(os.path.join(out_dir, "mr"), (".mr.json", STREAM_SUFFIX))
+    imported = 0
+    for path in paths:
+        try:
+            if is_stream_export(path):
+                db.upsert_stream_export(path)
+            else:
+                payload = load_export(path)
+                if not (payload.get("mr") or {}).get("project_path"):
+                    raise ValueError("mr.project_path missing")
+                db.upsert_export(payload)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"WARN: skipped {path}: {e}", file=sys.stderr)
+            continue
+        imported += 1
+    print(f"OK: imported {imported} files into {db.path}")
+    return 0
+
+def cmd_list(db, args: argparse.Namespace) -> int:
+    for row in db.list_mrs(args.project, args.state):
+        print(f"{row['project_path']}!{row['iid']}\t{row['state']}\t{row['fetched_at'] or '-'}\t{row['title']}")
+    return 0
+
+def cmd_export(db, args: argparse.Namespace, out_dir: str) -> int:
+    project_path, iid = parse_mr_ref(args.mr)
+    if args.comments:
+        payload = db.comments_payload(project_path, iid)
+        default_path = os.path.join(out_dir, "comments", f"{output_stem(payload['mr'])}.comments.json") if payload else ""
+    else:
+        payload = db.export_payload(project_path, iid)
+        default_path = os.path.join(out_dir, "mr", f"{output_stem(payload['mr'])}.mr.json") if payload else ""
+    if payload is None:
+        print(f"ERROR: MR not in store: {args.mr}", file=sys.stderr)
+        return 1
+    out_path = args.out or default_path
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    write_json_file(out_path, payload)  # a .gz/.xz/.zst --out is compressed
+    print(f"OK: wrote {out_path}")
+    return 0
+
+def cmd_notes(db, args: argparse.Namespace) -> int:
+    count = 0
+    for note in db.query_notes(
+        project_path=args.project,
+        iid=args.iid,
+        unresolved_only=args.unresolved_only,
+        include_system=not args.no_system,
+        path_globs=args.path_glob,
+        author=args.author,
+    ):
+        print(json.dumps(note, ensure_ascii=False))
+        count += 1
+    print(f"INFO: {count} notes", file=sys.stderr)
+    return 0
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Maintain / query the SQLite MR store.")
+    ap.add_argument("--db", help="SQLite store path (default: config.MR_DB_PATH)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("import", help="Import existing JSON exports from OUT_DIR")
+    p = sub.add_parser("list", help="List stored MRs")
+    p.add_argument("--project")
+    p.add_argument("--state")
+    p = sub.add_parser("export", help="Write one MR back to the JSON export format")
+    p.add_argument("mr", metavar="PROJECT!IID")
+    p.add_argument("--comments", action="store_true", help="Write .comments.json instead of .mr.json")
+    p.add_argument("--out", help="Output path (default: OUT_DIR/mr or OUT_DIR/comments)")
+    p = sub.add_parser("notes", help="Query comments across MRs (JSON Lines to stdout)")
+    p.add_argument("--project")
+    p.add_argument("--iid", type=int)
+    p.add_argument("--unresolved-only", action="store_true")
+    p.add_argument("--no-system", action="store_true", help="Exclude system notes")
+    p.add_argument("--path-glob", action="append", default=[], help="SQLite GLOB on the note's file path (repeatable)")
+    p.add_argument("--author", help="Author username")
+    args = ap.parse_args()
+
+    db = open_mr_store(config, args.db)
+    if db is None:
+        print("ERROR: config.py の MR_DB_PATH を設定するか --db を指定してください。", file=sys.stderr)
+        return 2
+    out_dir = str(getattr(config, "OUT_DIR", "./out")).strip()
+    if args.command == "import":
+        return cmd_import(db, out_dir)
+    if args.command == "list":
+        return cmd_list(db, args)
+    if args.command == "export":
+        return cmd_export(db, args, out_dir)
+    return cmd_notes(db, args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""MR diff retrieval: `/changes` (single response) or paginated `/diffs`, plus path/size filters.
+
+`/merge_requests/:iid/changes` returns every file in one response and GitLab
+truncates it on huge MRs (`overflow: true`). `/merge_requests/:iid/diffs`
+(GitLab 15.7+) returns the same file entries page by page, so each page can be
+filtered and written before the next one is requested.
+
+Files that are filtered out or too large are kept as entries with `diff: null`
+and an `omitted` reason instead of disappearing from the export:
+  excluded   - path matched DIFF_EXCLUDE_GLOBS / missed DIFF_INCLUDE_GLOBS
+  size_limit - diff larger than DIFF_MAX_BYTES
+  too_large / collapsed - GitLab itself withheld the diff
+"""
+
+import fnmatch
+import posixpath
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from gitlab_client import GitLabClient
+
+@dataclass
+class DiffFilter:
+    include_globs: List[str] = field(default_factory=list)
+    exclude_globs: List[str] = field(default_factory=list)
+    max_bytes: int = 0  # 0 = unlimited
+
+    @classmethod
+    def from_config(cls, config: Any) -> "DiffFilter":
+        return cls(
+            include_globs=list(getattr(config, "DIFF_INCLUDE_GLOBS", []) or []),
+            exclude_globs=list(getattr(config, "DIFF_EXCLUDE_GLOBS", []) or []),
+            max_bytes=int(getattr(config, "DIFF_MAX_BYTES", 0) or 0),
+        )
+
+    @staticmethod
+    def _match(path: str, globs: List[str]) -> bool:
+        base = posixpath.basename(path)
+        return any(fnmatch.fnmatch(path, g) or ("/" not in g and fnmatch.fnmatch(base, g)) for g in globs)
+
+    def omit_reason(self, record: Dict[str, Any]) -> Optional[str]:
+        paths = [p for p in (record.get("new_path"), record.get("old_path")) if p]
+        if self.include_globs and not any(self._match(p, self.include_globs) for p in paths):
+            return "excluded"
+        if self.exclude_globs and any(self._match(p, self.exclude_globs) for p in paths):
+            return "excluded"
+        diff = record.get("diff")
+        if self.max_bytes and diff and len(diff.encode("utf-8")) > self.max_bytes:
+            return "size_limit"
+        return None
+
+    def apply(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        if record.get("omitted"):
+            return record
+        reason = self.omit_reason(record)
+        if reason is None:
+            return record
+        diff = record.get("diff") or ""
+        return {**record, "diff": None, "omitted": reason, "diff_bytes": len(diff.encode("utf-8"))}
+
+def diff_record(ch: Dict[str, Any]) -> Dict[str, Any]:
+    record = {
+        "old_path": ch.get("old_path"),
+        "new_path": ch.get("new_path"),
+        "new_file": ch.get("new_file"),
+        "renamed_file": ch.get("renamed_file"),
+        "deleted_file": ch.get("deleted_file"),
+        "diff": ch.get("diff"),
+    }
+    if ch.get("too_large"):
+        record.update({"diff": None, "omitted": "too_large"})
+    elif ch.get("collapsed") and not ch.get("diff"):
+        record.update({"diff": None, "omitted": "collapsed"})
+    return record
+
+def diff_records(changes: Iterable[Any], filt: Optional[DiffFilter] = None) -> Iterator[Dict[str, Any]]:
+    for ch in changes:
+        if not isinstance(ch, dict):
+            continue
+        record = diff_record(ch)
+        yield filt.apply(record) if filt else record
+
+def iter_diff_pages(gl: GitLabClient, project_enc: str, iid: int, per_page: int) -> Iterator[List[Any]]:
+    """Pages of the paginated /diffs endpoint (concurrent per gl.page_jobs, yielded in order)."""
+    return gl.iter_pages(f"/projects/{project_enc}/merge_requests/{iid}/diffs", params={"per_page": per_page})
+
+def count_omitted(diffs: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for d in diffs:
+        reason = d.get("omitted")
+        if reason:
+            counts[reason] = counts.get(reason, 0) + 1
+    return counts
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Discover MRs through the project MR list API instead of listing MR_URLS by hand.
+
+`iter_discovered_mr_urls()` is a generator: MR list pages are requested only as
+the export / comment-fetch pool consumes URLs (`submit_bounded()` keeps at most a
+few MRs queued per worker), so hundreds of MRs never sit in one big list.
+
+Paging uses keyset pagination (`pagination=keyset`, following `Link: rel="next"`),
+which stays consistent while MRs are being updated. Instances that reject keyset
+for this resource (400/405) are paged by offset instead, ordered by created_at
+ascending: an MR updated mid-listing keeps its place and new MRs are appended
+at the end, so no page shifts and no MR is skipped (updated_at ordering would
+move an updated MR to page 1 and push one MR past the page boundary).
+"""
+
+import datetime
+import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote_plus
+
+import requests
+
+from gitlab_client import GitLabAPIError, GitLabClient
+
+MR_STATES = ("opened", "closed", "merged", "locked", "all")
+_RELATIVE_RE = re.compile(r"^(\d+)d$")
+
+@dataclass
+class DiscoveryQuery:
+    projects: List[str] = field(default_factory=list)
+    updated_after: Optional[str] = None
+    updated_before: Optional[str] = None
+    state: str = "merged"
+    labels: List[str] = field(default_factory=list)
+    per_page: int = 100
+
+    @classmethod
+    def from_config(cls, config: Any) -> "DiscoveryQuery":
+        return cls(
+            projects=list(getattr(config, "DISCOVER_PROJECTS", []) or []),
+            updated_after=normalize_time(getattr(config, "DISCOVER_UPDATED_AFTER", None)),
+            updated_before=normalize_time(getattr(config, "DISCOVER_UPDATED_BEFORE", None)),
+            state=str(getattr(config, "DISCOVER_STATE", "merged") or "merged"),
+            labels=list(getattr(config, "DISCOVER_LABELS", []) or []),
+        )
+
+    def params(self, order_by: str = "updated_at", sort: str = "desc") -> Dict[str, Any]:
+        params: Dict[str, Any] = {"state": self.state, "order_by": order_by, "sort": sort, "per_page": self.per_page}
+        if self.updated_after:
+            params["updated_after"] = self.updated_after
+        if self.updated_before:
+            params["updated_before"] = self.updated_before
+        if self.labels:
+            params["labels"] = ",".join(self.labels)
+        return params
+
+def normalize_time(value: Optional[str]) -> Optional[str]:
+    """ISO8601 date/datetime as-is, or "<N>d" = N days before now (UTC)."""
+    value = (value or "").strip()
+    if not value:
+        return None
+    m = _RELATIVE_RE.match(value)
+    if m:
+        ts = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=int(m.group(1)))
+        return ts.replace(microsecond=0).isoformat()
+    try:
+        datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"invalid date (ISO8601 or '<N>d'): {value}")
+    return value
+
+def iter_project_mrs(gl: GitLabClient, project_path: str, query: DiscoveryQuery) -> Iterator[Dict[str, Any]]:
+    path = f"/projects/{quote_plus(project_path)}/merge_requests"
+    try:
+        pages = gl.iter_pages(path, params={**query.params(), "pagination": "keyset"}, parallel=1)
+        first = next(pages)
+    except GitLabAPIError as e:
+        if " -> 400" not in str(e) and " -> 405" not in str(e):
+            raise
+        # Offset pages must not shift while listing; see the module docstring.
+        pages = gl.iter_pages(path, params=query.params("created_at", "asc"), parallel=1)
+        first = next(pages)
+    yield from (mr for mr in first if isinstance(mr, dict))
+    for page in pages:
+        yield from (mr for mr in page if isinstance(mr, dict))
+
+def iter_discovered_mr_urls(
+    gl: GitLabClient,
+    query: DiscoveryQuery,
+    errors: Optional[List[Tuple[str, str]]] = None,
+) -> Iterator[str]:
+    """MR URLs (on gl.base_url, so they pass the host check) for every matching MR, lazily.
+
+    A project whose listing fails is reported to stderr (and appended to `errors`); the others continue.
+    """
+    seen: Set[Tuple[str, Any]] = set()
+    for project_path in query.projects:
+        project_path = project_path.strip().strip("/")
+        try:
+            for mr in iter_project_mrs(gl, project_path, query):
+                iid = mr.get("iid")
+                if iid is None or (project_path, iid) in seen:
+                    continue  # a project listed twice
+                seen.add((project_path, iid))
+                yield f"{gl.base_url.rstrip('/')}/{project_path}/-/merge_requests/{iid}"
+        except (requests.RequestException, GitLabAPIError) as e:
+            print(f"ERROR: MR discovery failed: {project_path}\n{e}", file=sys.stderr)
+            if errors is not None:
+                errors.append((f"project:{project_path}", str(e)))
+
+def submit_bounded(
+    pool: Executor,
+    fn: Callable[[str], Any],
+    items: Iterable[str],
+    max_pending: int,
+) -> Iterator[Tuple[str, "Future[Any]"]]:
+    """Submit fn(item) for each item, keeping at most max_pending in flight; yield (item, future) as they finish."""
+    pending: Dict["Future[Any]", str] = {}
+    it = iter(items)
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_pending:
+            item = next(it, None)
+            if item is None:
+                exhausted = True
+                break
+            pending[pool.submit(fn, item)] = item
+        if not pending:
+            return
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield pending.pop(fut), fut
+
+def add_discovery_args(ap: Any) -> None:
+    ap.add_argument("--discover", action="store_true",
+                    help="List MRs via the MR list API (config.DISCOVER_*) instead of MR_URLS")
+    ap.add_argument("--project", action="append", help="Project path for --discover (repeatable; default: config.DISCOVER_PROJECTS)")
+    ap.add_argument("--updated-after", help="ISO8601 date/datetime or '<N>d' (e.g. 180d)")
+    ap.add_argument("--updated-before", help="ISO8601 date/datetime or '<N>d'")
+    ap.add_argument("--state", choices=MR_STATES, help="MR state (default: config.DISCOVER_STATE or merged)")
+    ap.add_argument("--label", action="append", help="Only MRs with this label (repeatable, AND)")
+
+def query_from_args(args: Any, config: Any) -> DiscoveryQuery:
+    query = DiscoveryQuery.from_config(config)
+    if args.project:
+        query.projects = list(args.project)
+    if args.updated_after:
+        query.updated_after = normalize_time(args.updated_after)
+    if args.updated_before:
+        query.updated_before = normalize_time(args.updated_before)
+    if args.state:
+        query.state = args.state
+    if args.label:
+        query.labels = list(args.label)
+    return query
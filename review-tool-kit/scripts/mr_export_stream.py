@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Streaming MR export format (`.mr.jsonl`) for very large MRs.
+
+One JSON record per line, written as data is fetched:
+
+  {"type": "header",  "format": "mr-export-stream/1", "fetched_at": ..., "mr": {...}}
+  {"type": "diff",    "data": {old_path, new_path, ..., diff}}        (repeated)
+  {"type": "comment", "data": {discussion_id, note_id, ...}}          (repeated)
+  {"type": "footer",  "counts": {...}, "sync": {...}}
+
+`iter_records()` reads it lazily; `load_export()` / `iter_export_json_chunks()`
+give the classic `.mr.json` shape so the prompt-pack builders accept either.
+Both formats may also be compressed (`.gz` / `.xz` / `.zst`, see export_io.py).
+"""
+
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from export_io import AtomicTextWriter, open_text, strip_compression
+
+FORMAT = "mr-export-stream/1"
+STREAM_SUFFIX = ".mr.jsonl"
+
+class StreamingExportWriter:
+    """Append records to a temp file; close() writes the footer and atomically renames."""
+
+    def __init__(self, out_path: str) -> None:
+        self.out_path = out_path
+        self.counts: Dict[str, Any] = {"diff_files": 0, "comments": 0, "omitted_diffs": {}}
+        self._writer = AtomicTextWriter(out_path)
+        self._f = self._writer.f
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(record, ensure_ascii=False))
+        self._f.write("\n")
+
+    def write_header(self, fetched_at: str, mr: Dict[str, Any]) -> None:
+        self._write({"type": "header", "format": FORMAT, "fetched_at": fetched_at, "mr": mr})
+
+    def write_diff(self, diff: Dict[str, Any]) -> None:
+        self._write({"type": "diff", "data": diff})
+        self.counts["diff_files"] += 1
+        reason = diff.get("omitted")
+        if reason:
+            self.counts["omitted_diffs"][reason] = self.counts["omitted_diffs"].get(reason, 0) + 1
+
+    def write_comment(self, comment: Dict[str, Any]) -> None:
+        self._write({"type": "comment", "data": comment})
+        self.counts["comments"] += 1
+
+    def close(self, sync: Optional[Dict[str, Any]] = None, final_path: Optional[str] = None) -> str:
+        """Finish the file. final_path overrides out_path (e.g. once the MR title is known)."""
+        self._write({"type": "footer", "counts": dict(self.counts), "sync": sync})
+        return self._writer.commit(final_path)
+
+    def abort(self) -> None:
+        self._writer.abort()
+
+def iter_records(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (type, record) lazily; diff/comment records yield their `data` object."""
+    with open_text(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            kind = rec.get("type")
+            yield kind, (rec.get("data") if kind in ("diff", "comment") else rec)
+
+def is_stream_export(path: str) -> bool:
+    return strip_compression(path).endswith(".jsonl")
+
+def load_export(path: str, include_diffs: bool = True) -> Dict[str, Any]:
+    """Load either export format into the classic .mr.json dict (diff records skipped if include_diffs=False).
+
+    Without diffs a classic .mr.json is decoded one diff at a time and each is dropped,
+    so the (possibly huge) diffs array is never held in memory.
+    """
+    if not is_stream_export(path):
+        with open_text(path) as f:
+            if include_diffs:
+                return json.load(f)
+            data: Dict[str, Any] = {}
+            chunks = iter(lambda: f.read(1 << 16).encode("utf-8"), b"")
+            for _ in iter_json_array_items(chunks, "diffs", data):
+                pass
+            data.setdefault("diffs", [])
+            return data
+    payload: Dict[str, Any] = {"fetched_at": None, "mr": {}, "diffs": [], "comments": [], "counts": {}}
+    for kind, rec in iter_records(path):
+        if kind == "header":
+            payload["fetched_at"] = rec.get("fetched_at")
+            payload["mr"] = rec.get("mr") or {}
+        elif kind == "diff":
+            if include_diffs:
+                payload["diffs"].append(rec)
+        elif kind == "comment":
+            payload["comments"].append(rec)
+        elif kind == "footer":
+            payload["counts"] = rec.get("counts") or {}
+            if rec.get("sync") is not None:
+                payload["sync"] = rec["sync"]
+    return payload
+
+def _indent(text: str, prefix: str) -> str:
+    return text.replace("\n", "\n" + prefix)
+
+def iter_export_json_chunks(path: str) -> Iterator[str]:
+    """Yield the classic indent=2 .mr.json text for a stream export, one record at a time."""
+    header: Dict[str, Any] = {}
+    footer: Dict[str, Any] = {}
+    section: Optional[str] = None
+    first_in_section = True
+
+    def dump(obj: Any, level: int) -> str:
+        return _indent(json.dumps(obj, ensure_ascii=False, indent=2), "  " * level)
+
+    for kind, rec in iter_records(path):
+        if kind == "header":
+            header = rec
+            yield "{\n"
+            yield f'  "fetched_at": {dump(header.get("fetched_at"), 1)},\n'
+            yield f'  "mr": {dump(header.get("mr") or {}, 1)},\n'
+            yield '  "diffs": ['
+            section, first_in_section = "diffs", True
+        elif kind in ("diff", "comment"):
+            want = "diffs" if kind == "diff" else "comments"
+            if section != want:
+                yield ("\n  ],\n" if not first_in_section else "],\n") + '  "comments": ['
+                section, first_in_section = want, True
+            yield ("\n" if first_in_section else ",\n") + "    " + dump(rec, 2)
+            first_in_section = False
+        elif kind == "footer":
+            footer = rec
+    if section == "diffs":
+        yield ("\n  ],\n" if not first_in_section else "],\n") + '  "comments": ['
+        first_in_section = True
+    yield ("\n  ],\n" if not first_in_section else "],\n")
+    yield f'  "counts": {dump(footer.get("counts") or {}, 1)}'
+    if footer.get("sync") is not None:
+        yield f',\n  "sync": {dump(footer["sync"], 1)}'
+    yield "\n}"
+
+TEXT_CHUNK_CHARS = 1 << 20
+
+def iter_json_text(payload: Any, chunk_chars: int = TEXT_CHUNK_CHARS) -> Iterator[str]:
+    """json.dumps(payload, ensure_ascii=False, indent=2) in pieces of about chunk_chars, without the full string."""
+    parts: List[str] = []
+    size = 0
+    for piece in json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(payload):
+        parts.append(piece)
+        size += len(piece)
+        if size >= chunk_chars:
+            yield "".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts)
+
+def iter_export_text(path: str, chunk_chars: int = TEXT_CHUNK_CHARS) -> Iterator[str]:
+    """read_export_text() in pieces: plain indent=2 files are copied through chunk by chunk.
+
+    Compact / compressed single-document exports still have to be parsed as a
+    whole before they can be re-rendered.
+    """
+    if is_stream_export(path):
+        yield from iter_export_json_chunks(path)
+        return
+    with open_text(path) as f:
+        head = f.read(chunk_chars)
+        if head.startswith("{\n  \""):
+            while head:
+                yield head
+                head = f.read(chunk_chars)
+            return
+        text = head + f.read()
+    if text.strip() == "{}":
+        yield text
+        return
+    yield from iter_json_text(json.loads(text), chunk_chars)
+
+def read_export_text(path: str) -> str:
+    """Classic indent=2 JSON text of any export (.mr.json / .comments.json / .mr.jsonl, compact or compressed).
+
+    Plain indent=2 files are returned as-is; the other variants are re-rendered, so a
+    prompt pack is byte-identical whichever format the export was written in.
+    """
+    return "".join(iter_export_text(path))
+
+_WS = " \t\r\n"
+
+def iter_json_array_items(chunks: Iterable[bytes], key: str, others: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    """Incrementally decode the items of a top-level `key: [...]` array in a JSON object stream.
+
+    Only one array item (plus one network chunk) is held in memory at a time, so a
+    multi-hundred-MB `/changes` body never has to be materialized. Other top-level
+    values are decoded and stored in `others` (if given) once the stream is consumed.
+    """
+    decoder = json.JSONDecoder()
+    it = iter(chunks)
+    buf = ""
+    pos = 0
+    pending = b""
+    eof = False
+
+    def more(min_new: int = 1) -> bool:
+        """Append at least min_new characters (or the rest of the stream) to buf."""
+        nonlocal buf, pos, pending, eof
+        if eof:
+            return False
+        parts: List[str] = []
+        got = 0
+        for chunk in it:
+            if not chunk:
+                continue
+            data = pending + chunk
+            try:
+                text = data.decode("utf-8")
+                pending = b""
+            except UnicodeDecodeError as e:
+                # Chunk boundary split a multi-byte character; keep the tail for next time.
+                text = data[:e.start].decode("utf-8")
+                pending = data[e.start:]
+            parts.append(text)
+            got += len(text)
+            if got >= min_new:
+                break
+        else:
+            eof = True
+        if parts:
+            buf = buf[pos:] + "".join(parts)
+            pos = 0
+        return bool(parts)
+
+    def skip_ws() -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WS:
+                pos += 1
+            if pos < len(buf) or not more():
+                return
+
+    def expect(ch: str) -> bool:
+        nonlocal pos
+        skip_ws()
+        if pos < len(buf) and buf[pos] == ch:
+            pos += 1
+            return True
+        return False
+
+    def decode_value() -> Any:
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Value is incomplete: at least double the buffered text before retrying.
+                if not more(max(len(buf) - pos, 1 << 16)):
+                    raise
+                continue
+            if end == len(buf) and isinstance(value, (int, float)) and not isinstance(value, bool) and more():
+                continue  # a number at the buffer edge may continue in the next chunk
+            pos = end
+            return value
+
+    if not expect("{"):
+        raise ValueError("expected a JSON object")
+    if expect("}"):
+        return
+    while True:
+        name = decode_value()
+        if not expect(":"):
+            raise ValueError("malformed JSON object")
+        skip_ws()
+        if name == key and pos < len(buf) and buf[pos] == "[":
+            pos += 1
+            if not expect("]"):
+                while True:
+                    yield decode_value()
+                    if expect(","):
+                        continue
+                    if expect("]"):
+                        break
+                    raise ValueError("malformed JSON array")
+        else:
+            value = decode_value()
+            if others is not None:
+                others[name] = value
+        if expect(","):
+            continue
+        if expect("}"):
+            return
+        raise ValueError("malformed JSON object")
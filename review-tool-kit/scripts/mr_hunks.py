@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Index of commentable diff lines, built offline from an export's `diffs`.
+
+GitLab only accepts an inline discussion on a line shown in the MR diff:
+an added line (new_line), a removed line (old_line) or a context line (both).
+HunkIndex maps each file/side to those lines so gitlab_post_ai_review.py can
+validate every finding locally, snap near misses to the closest shown line,
+and fill in the old/new pair GitLab expects, instead of paying a 400 per
+bad position.
+
+Files whose diff was not exported (omitted as too large / filtered, see
+mr_diffs.py) are "unchecked": the position is passed through unvalidated.
+"""
+
+import re
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+# Result of HunkIndex.locate()
+EXACT = "exact"
+SNAPPED = "snapped"
+UNCHECKED = "unchecked"
+OUTSIDE = "outside"  # file is in the diff, line is not (and nothing within snap distance)
+UNKNOWN_FILE = "unknown_file"
+
+def diff_line_map(diff: str) -> Tuple[Dict[int, Optional[int]], Dict[int, Optional[int]]]:
+    """({new_line: old_line or None}, {old_line: new_line or None}) for the lines shown in a unified diff."""
+    new_map: Dict[int, Optional[int]] = {}
+    old_map: Dict[int, Optional[int]] = {}
+    old = new = 0
+    in_hunk = False
+    for line in diff.split("\n"):
+        m = HUNK_RE.match(line)
+        if m:
+            old, new = int(m.group(1)), int(m.group(2))
+            in_hunk = True
+            continue
+        if not in_hunk or not line or line.startswith("\\"):
+            continue  # "\ No newline at end of file", trailing newline
+        tag = line[0]
+        if tag == "+":
+            new_map[new] = None
+            new += 1
+        elif tag == "-":
+            old_map[old] = None
+            old += 1
+        elif tag == " ":
+            new_map[new] = old
+            old_map[old] = new
+            old += 1
+            new += 1
+    return new_map, old_map
+
+class HunkIndex:
+    def __init__(self) -> None:
+        # (side, path) -> {line on that side: line on the other side or None}
+        self.lines: Dict[Tuple[str, str], Dict[int, Optional[int]]] = {}
+        # path on either side -> (old_path, new_path)
+        self.paths: Dict[str, Tuple[str, str]] = {}
+        self.unchecked: Set[str] = set()
+
+    @classmethod
+    def from_diffs(cls, diffs: Iterable[Dict[str, Any]]) -> "HunkIndex":
+        index = cls()
+        for d in diffs:
+            if not isinstance(d, dict):
+                continue
+            old_path = d.get("old_path") or d.get("new_path") or ""
+            new_path = d.get("new_path") or old_path
+            index.paths[new_path] = (old_path, new_path)
+            index.paths.setdefault(old_path, (old_path, new_path))
+            diff = d.get("diff") or ""
+            if d.get("omitted") or not diff.strip():
+                index.unchecked.update((old_path, new_path))
+                continue
+            new_map, old_map = diff_line_map(diff)
+            index.lines[("new", new_path)] = new_map
+            index.lines[("old", old_path)] = old_map
+        return index
+
+    def locate(self, path: str, side: str, line: int, snap: int = 0) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """(status, position line fields) for a finding; fields is None when status is OUTSIDE / UNKNOWN_FILE.
+
+        Fields always carry both old_path and new_path, plus old_line and/or new_line
+        as GitLab expects for added / removed / context lines.
+        """
+        if path not in self.paths:
+            return UNKNOWN_FILE, None
+        old_path, new_path = self.paths[path]
+        side = "old" if side == "old" else "new"
+        if path in self.unchecked:
+            return UNCHECKED, {"old_path": old_path, "new_path": new_path, f"{side}_line": line}
+        shown = self.lines.get((side, old_path if side == "old" else new_path)) or {}
+        status = EXACT
+        if line not in shown:
+            near = [n for n in shown if abs(n - line) <= snap]
+            if not near:
+                return OUTSIDE, None
+            line = min(near, key=lambda n: (abs(n - line), n))
+            status = SNAPPED
+        other = shown[line]
+        fields: Dict[str, Any] = {"old_path": old_path, "new_path": new_path, f"{side}_line": line}
+        if other is not None:
+            fields["new_line" if side == "old" else "old_line"] = other
+        return status, fields
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Share fetched MR data between gitlab_export_mr.py and gitlab_fetch_mr_comments.py.
+
+Both scripts need the MR metadata and the full discussions list. Their outputs
+under OUT_DIR act as the common local store:
+
+- `.comments.json` is a projection of `.mr.json` / `.mr.jsonl` (same comment
+  records, mr fields are a subset), so the comments script derives it from a
+  fresh export without any API call.
+- The exporter still needs the MR itself (diff_refs) and the diffs, but takes
+  comments + sync state from a fresh `.comments.json` instead of re-paging
+  discussions.
+
+"Fresh" = fetched within SHARED_FETCH_MAX_AGE_SEC (the original fetch time is
+carried over when one output is derived from the other, so data never gets
+older than the window by bouncing between the two files) and fetched with the
+same INCLUDE_SYSTEM_NOTES setting.
+"""
+
+import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mr_sync import load_previous
+
+COMMENTS_SUFFIX = ".comments.json"
+COMMENT_MR_KEYS = ("project_path", "iid", "title", "web_url", "source_branch", "target_branch", "state")
+
+def max_age_from_config(config: Any) -> int:
+    return max(0, int(getattr(config, "SHARED_FETCH_MAX_AGE_SEC", 0) or 0))
+
+def _age_seconds(fetched_at: Optional[str]) -> Optional[float]:
+    if not fetched_at:
+        return None
+    try:
+        ts = datetime.datetime.fromisoformat(fetched_at.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return (datetime.datetime.now(datetime.timezone.utc) - ts).total_seconds()
+
+def comments_fetched_at(data: Dict[str, Any]) -> Optional[str]:
+    # sync.fetched_at is set when the comments were reused from the other output.
+    return (data.get("sync") or {}).get("fetched_at") or data.get("fetched_at")
+
+def is_fresh(data: Dict[str, Any], include_system_notes: bool, max_age: int) -> bool:
+    sync = data.get("sync") or {}
+    if "include_system_notes" not in sync or bool(sync["include_system_notes"]) != include_system_notes:
+        return False
+    age = _age_seconds(comments_fetched_at(data))
+    return age is not None and 0 <= age <= max_age
+
+def find_fresh(
+    directory: str,
+    project_path: str,
+    iid: int,
+    suffixes: Iterable[str],
+    include_system_notes: bool,
+    max_age: int,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Newest output for (project, iid) under directory that is still fresh (diffs are not loaded)."""
+    if max_age <= 0:
+        return None, None
+    for suffix in suffixes:
+        path, data = load_previous(directory, project_path, iid, suffix, include_diffs=False)
+        if data is not None and is_fresh(data, include_system_notes, max_age):
+            return path, data
+    return None, None
+
+def comments_payload(export: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the .comments.json payload from a .mr.json / .mr.jsonl export."""
+    mr = export.get("mr") or {}
+    comments: List[Dict[str, Any]] = [c for c in (export.get("comments") or []) if isinstance(c, dict)]
+    return {
+        "fetched_at": export.get("fetched_at"),
+        "mr": {k: mr.get(k) for k in COMMENT_MR_KEYS},
+        "comments": comments,
+        "counts": {"comments": len(comments)},
+        "sync": export.get("sync"),
+    }
+
+def shared_comments(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """(comments, sync_info) from a fresh output, in the shape mr_sync.sync_comments returns."""
+    comments = [c for c in (data.get("comments") or []) if isinstance(c, dict)]
+    sync = dict(data.get("sync") or {})
+    sync["fetched_at"] = comments_fetched_at(data)
+    return comments, sync
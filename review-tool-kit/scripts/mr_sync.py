@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Incremental MR discussion sync shared by gitlab_export_mr.py / gitlab_fetch_mr_comments.py.
+
+A previous export carries a `sync` block with a watermark (max note updated_at).
+On the next run:
+1. `/notes?order_by=updated_at&sort=desc` is paged only until the watermark,
+   giving every note created/edited/resolved since the last sync.
+2. Notes already in the export are patched in place (merged by note_id).
+3. Notes that are new need their discussion_id, which the notes API does not
+   return; the discussions list is walked from its tail (where new threads
+   land) until every new note is located, and those discussions are replaced.
+4. If MR.user_notes_count disagrees with the merged note set, something was
+   deleted; the comments are rebuilt with a full discussions fetch.
+
+Step 4 is a heuristic: the notes API cannot list deletions, and comparing note
+id sets would mean paging every note, i.e. the cost of a full sync. A deletion
+that the count does not reveal (e.g. offset by a note the count includes but
+the watermark query missed) would stay in the output, so an incremental sync
+also falls back to a full one after `full_every` incremental runs in a row or
+when the last full sync is older than `full_max_age` seconds (recorded in the
+`sync` block as incremental_runs / full_sync_at).
+"""
+
+import datetime
+import glob
+import math
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+from gitlab_client import GitLabClient
+from export_io import strip_compression
+from mr_export_stream import load_export
+
+PER_PAGE = 100
+FULL_SYNC_EVERY = 10
+FULL_SYNC_MAX_AGE_SEC = 24 * 3600
+
+def note_to_comment(discussion_id: Any, n: Dict[str, Any]) -> Dict[str, Any]:
+    """The comment record of .mr.json / .comments.json for one GitLab note."""
+    author = n.get("author") or {}
+    return {
+        "discussion_id": discussion_id,
+        "note_id": n.get("id"),
+        "created_at": n.get("created_at"),
+        "updated_at": n.get("updated_at"),
+        "author": {
+            "id": author.get("id"),
+            "name": author.get("name"),
+            "username": author.get("username"),
+            "web_url": author.get("web_url"),
+        },
+        "body": n.get("body"),
+        "position": n.get("position"),
+        "resolved": n.get("resolved"),
+        "system": n.get("system"),
+        "note_url": n.get("url"),
+    }
+
+def full_sync_policy(config: Any) -> Tuple[int, int]:
+    """(full_every, full_max_age) from config.INCREMENTAL_FULL_SYNC_EVERY / INCREMENTAL_FULL_SYNC_MAX_AGE_SEC."""
+    return (
+        max(0, int(getattr(config, "INCREMENTAL_FULL_SYNC_EVERY", FULL_SYNC_EVERY) or 0)),
+        max(0, int(getattr(config, "INCREMENTAL_FULL_SYNC_MAX_AGE_SEC", FULL_SYNC_MAX_AGE_SEC) or 0)),
+    )
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def load_previous(
+    directory: str,
+    project_path: str,
+    iid: int,
+    suffix: Union[str, Sequence[str]],
+    include_diffs: bool = True,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Find the newest earlier output for (project, iid) in directory, whatever its title-based name or compression.
+
+    With several suffixes (e.g. .mr.json and .mr.jsonl) the newest file of any of them wins;
+    files are loaded newest first until one belongs to project_path.
+    """
+    suffixes = (suffix,) if isinstance(suffix, str) else tuple(suffix)
+    candidates = {
+        p for s in suffixes for p in glob.glob(os.path.join(glob.escape(directory), f"*__iid_{iid}{s}*"))
+        if strip_compression(p).endswith(f"__iid_{iid}{s}")
+    }
+    for path in sorted(candidates, key=os.path.getmtime, reverse=True):
+        try:
+            data = load_export(path, include_diffs=include_diffs)
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, dict) and (data.get("mr") or {}).get("project_path") == project_path:
+            return path, data
+    return None, None
+
+def _max_ts(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    # GitLab timestamps share one ISO8601 format, so string order == time order.
+    if not a:
+        return b
+    if not b:
+        return a
+    return a if a >= b else b
+
+def _list_json(r: Any) -> List[Any]:
+    data = r.json() if r.text.strip() else []
+    return data if isinstance(data, list) else []
+
+def comments_from_discussions(discussions: Iterable[Any], include_system_notes: bool) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    comments: List[Dict[str, Any]] = []
+    watermark: Optional[str] = None
+    for d in discussions:
+        if not isinstance(d, dict):
+            continue
+        discussion_id = d.get("id")
+        for n in (d.get("notes") or []):
+            if not isinstance(n, dict):
+                continue
+            watermark = _max_ts(watermark, n.get("updated_at"))
+            if (not include_system_notes) and n.get("system") is True:
+                continue
+            comments.append(note_to_comment(discussion_id, n))
+    return comments, watermark
+
+def full_sync(gl: GitLabClient, project_enc: str, iid: int, include_system_notes: bool) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    discussions = gl.get_all_pages(f"/projects/{project_enc}/merge_requests/{iid}/discussions", params={"per_page": PER_PAGE})
+    comments, watermark = comments_from_discussions(discussions, include_system_notes)
+    return comments, {
+        "mode": "full",
+        "watermark": watermark,
+        "discussion_count": sum(1 for d in discussions if isinstance(d, dict)),
+        "notes_fetched": sum(len(d.get("notes") or []) for d in discussions if isinstance(d, dict)),
+        "full_sync_at": _now(),
+        "incremental_runs": 0,
+    }
+
+def stream_full_sync(
+    gl: GitLabClient,
+    project_enc: str,
+    iid: int,
+    include_system_notes: bool,
+    emit: Callable[[Dict[str, Any]], None],
+) -> Dict[str, Any]:
+    """Like full_sync, but pages are processed one at a time and each comment is handed to emit()."""
+    watermark: Optional[str] = None
+    discussion_count = 0
+    notes_fetched = 0
+    path = f"/projects/{project_enc}/merge_requests/{iid}/discussions"
+    for page in gl.iter_pages(path, params={"per_page": PER_PAGE}):
+        comments, page_watermark = comments_from_discussions(page, include_system_notes)
+        for c in comments:
+            emit(c)
+        watermark = _max_ts(watermark, page_watermark)
+        discussion_count += sum(1 for d in page if isinstance(d, dict))
+        notes_fetched += sum(len(d.get("notes") or []) for d in page if isinstance(d, dict))
+    return {
+        "mode": "full",
+        "watermark": watermark,
+        "discussion_count": discussion_count,
+        "notes_fetched": notes_fetched,
+        "include_system_notes": include_system_notes,
+        "full_sync_at": _now(),
+        "incremental_runs": 0,
+    }
+
+def fetch_notes_since(gl: GitLabClient, project_enc: str, iid: int, watermark: str) -> List[Dict[str, Any]]:
+    """Notes with updated_at >= watermark, newest first (stops paging at the watermark)."""
+    notes: List[Dict[str, Any]] = []
+    page = 1
+    while True:
+        r = gl.check(gl.get(
+            f"/projects/{project_enc}/merge_requests/{iid}/notes",
+            params={"order_by": "updated_at", "sort": "desc", "per_page": PER_PAGE, "page": page},
+        ))
+        batch = [n for n in _list_json(r) if isinstance(n, dict)]
+        for n in batch:
+            if (n.get("updated_at") or "") < watermark:
+                return notes
+            notes.append(n)
+        nxt = r.headers.get("X-Next-Page")
+        if not batch or not nxt:
+            return notes
+        page = int(nxt)
+
+def locate_discussions(gl: GitLabClient, project_enc: str, iid: int, note_ids: Set[Any], prev_discussion_count: int) -> Optional[List[Dict[str, Any]]]:
+    """Find the discussions containing note_ids, scanning from the tail page backwards.
+
+    Returns None if the total page count is not reported (caller falls back to a full sync).
+    """
+    path = f"/projects/{project_enc}/merge_requests/{iid}/discussions"
+    est = max(1, math.ceil(prev_discussion_count / PER_PAGE))
+    r = gl.check(gl.get(path, params={"per_page": PER_PAGE, "page": est}))
+    total = r.headers.get("X-Total-Pages")
+    if not (total and total.isdigit()):
+        return None
+    total_pages = int(total)
+    order = [est] + list(range(est + 1, total_pages + 1)) + list(range(min(est, total_pages + 1) - 1, 0, -1))
+
+    remaining = set(note_ids)
+    found: List[Dict[str, Any]] = []
+    for page in order:
+        if not remaining:
+            break
+        if page != est:
+            r = gl.check(gl.get(path, params={"per_page": PER_PAGE, "page": page}))
+        for d in _list_json(r):
+            if not isinstance(d, dict):
+                continue
+            ids = {n.get("id") for n in (d.get("notes") or []) if isinstance(n, dict)}
+            if ids & remaining:
+                found.append(d)
+                remaining -= ids
+    return found
+
+def full_sync_due(prev_sync: Dict[str, Any], full_every: int, full_max_age: int) -> bool:
+    """True when the next sync must be a full one (see module docstring); 0 disables either limit."""
+    if full_every > 0 and int(prev_sync.get("incremental_runs") or 0) >= full_every:
+        return True
+    if full_max_age <= 0:
+        return False
+    try:
+        last = datetime.datetime.fromisoformat(str(prev_sync.get("full_sync_at") or "").replace("Z", "+00:00"))
+    except ValueError:
+        return True  # exports written before full_sync_at was recorded
+    if last.tzinfo is None:
+        last = last.replace(tzinfo=datetime.timezone.utc)
+    return (datetime.datetime.now(datetime.timezone.utc) - last).total_seconds() > full_max_age
+
+def incremental_sync(
+    gl: GitLabClient,
+    project_enc: str,
+    iid: int,
+    mr: Dict[str, Any],
+    previous: Dict[str, Any],
+    include_system_notes: bool,
+    full_every: int = FULL_SYNC_EVERY,
+    full_max_age: int = FULL_SYNC_MAX_AGE_SEC,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    prev_sync = previous.get("sync") or {}
+    watermark = prev_sync.get("watermark")
+    prev_comments = [c for c in (previous.get("comments") or []) if isinstance(c, dict)]
+    if not watermark:
+        return full_sync(gl, project_enc, iid, include_system_notes)
+    runs = int(prev_sync.get("incremental_runs") or 0)
+    if full_sync_due(prev_sync, full_every, full_max_age):
+        comments, info = full_sync(gl, project_enc, iid, include_system_notes)
+        info["reason"] = "periodic full sync (deleted notes)"
+        return comments, info
+
+    changed = fetch_notes_since(gl, project_enc, iid, watermark)
+    new_watermark = watermark
+    for n in changed:
+        new_watermark = _max_ts(new_watermark, n.get("updated_at"))
+
+    # Deletion check: every current user note is either in the old export or just changed.
+    user_ids = {c.get("note_id") for c in prev_comments if c.get("system") is not True}
+    user_ids |= {n.get("id") for n in changed if n.get("system") is not True}
+    user_notes_count = mr.get("user_notes_count")
+    if isinstance(user_notes_count, int) and user_notes_count != len(user_ids):
+        comments, info = full_sync(gl, project_enc, iid, include_system_notes)
+        info["reason"] = "note count mismatch (deleted notes)"
+        return comments, info
+
+    by_id: Dict[Any, Dict[str, Any]] = {c.get("note_id"): c for c in prev_comments}
+    wanted = [n for n in changed if include_system_notes or n.get("system") is not True]
+    unknown = {n.get("id") for n in wanted if n.get("id") not in by_id}
+
+    # Patch notes we already have; discussion_id / note_url are not in the notes API.
+    for n in wanted:
+        old = by_id.get(n.get("id"))
+        if old is None:
+            continue
+        merged = note_to_comment(old.get("discussion_id"), n)
+        if not merged.get("note_url"):
+            merged["note_url"] = old.get("note_url")
+        by_id[n.get("id")] = merged
+
+    replaced: Dict[Any, List[Dict[str, Any]]] = {}
+    new_discussions: List[Any] = []
+    discussion_count = int(prev_sync.get("discussion_count") or 0)
+    if unknown:
+        found = locate_discussions(gl, project_enc, iid, unknown, discussion_count)
+        if found is None:
+            comments, info = full_sync(gl, project_enc, iid, include_system_notes)
+            info["reason"] = "X-Total-Pages not reported"
+            return comments, info
+        known_discussions = {c.get("discussion_id") for c in prev_comments}
+        for d in found:
+            notes, _ = comments_from_discussions([d], include_system_notes)
+            replaced[d.get("id")] = notes
+            if d.get("id") not in known_discussions:
+                new_discussions.append(d.get("id"))
+                discussion_count += 1
+
+    # Rebuild in the previous order; replaced discussions keep their slot, new ones go last.
+    comments: List[Dict[str, Any]] = []
+    emitted: Set[Any] = set()
+    for c in prev_comments:
+        did = c.get("discussion_id")
+        if did in replaced:
+            if did not in emitted:
+                comments.extend(replaced[did])
+                emitted.add(did)
+            continue
+        comments.append(by_id[c.get("note_id")])
+    for did in new_discussions:
+        comments.extend(replaced[did])
+
+    return comments, {
+        "mode": "incremental",
+        "watermark": new_watermark,
+        "discussion_count": discussion_count,
+        "notes_fetched": len(changed),
+        "full_sync_at": prev_sync.get("full_sync_at"),
+        "incremental_runs": runs + 1,
+    }
+
+def sync_comments(
+    gl: GitLabClient,
+    project_enc: str,
+    iid: int,
+    mr: Dict[str, Any],
+    previous: Optional[Dict[str, Any]],
+    include_system_notes: bool,
+    full_every: int = FULL_SYNC_EVERY,
+    full_max_age: int = FULL_SYNC_MAX_AGE_SEC,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Return (comments, sync_info). previous=None performs a full fetch."""
+    if previous is None or bool((previous.get("sync") or {}).get("include_system_notes")) != include_system_notes:
+        comments, info = full_sync(gl, project_enc, iid, include_system_notes)
+    else:
+        comments, info = incremental_sync(gl, project_enc, iid, mr, previous, include_system_notes, full_every, full_max_age)
+    info["include_system_notes"] = include_system_notes
+    return comments, info
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Checkpoint journal for gitlab_post_ai_review.py.
+
+Lives next to the review JSON (`foo.review.json` -> `foo.review.journal.jsonl`)
+and gets one JSON line per successfully posted item, appended and fsynced
+right after GitLab answers:
+
+  {"item": "overall" | "inline:<n>", "marker": "<hash>", "id": <note/discussion id>, "posted_at": "..."}
+
+A restart skips every item whose (item, marker) pair is journaled, without
+even fetching the MR discussions when nothing is left. The marker is the
+content hash from gitlab_post_ai_review.item_marker(), so editing a finding
+in the review JSON makes it pending again. A truncated last line (crash
+mid-write) is ignored.
+"""
+
+import datetime
+import json
+import os
+import pathlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+def journal_path(review_json: str) -> str:
+    p = pathlib.Path(review_json)
+    stem = p.name[: -len(".json")] if p.name.endswith(".json") else p.name
+    return str(p.with_name(stem + ".journal.jsonl"))
+
+class PostJournal:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(rec, dict) and rec.get("item") and rec.get("marker"):
+                        self.entries[(rec["item"], rec["marker"])] = rec
+
+    def get(self, item: str, marker: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get((item, marker))
+
+    def latest(self, item: str) -> Optional[Dict[str, Any]]:
+        """Most recent record for `item`, whatever its marker."""
+        found = [rec for (key, _), rec in self.entries.items() if key == item]
+        return max(found, key=lambda rec: rec.get("posted_at") or "") if found else None
+
+    def record(self, item: str, marker: str, posted_id: Any) -> None:
+        rec = {
+            "item": item,
+            "marker": marker,
+            "id": posted_id,
+            "posted_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[(item, marker)] = rec
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Incremental batch builds for the build_*_prompt_pack.py scripts (--batch).
+
+Every export in a directory gets its prompt pack built in a process pool;
+the MR-independent inputs (templates, guidelines, rules) are read once by the
+parent and handed to each worker at start-up.
+
+A manifest in the output directory (`.<kind>.manifest.json`) records, per
+export, the sha256 of the export file, a key over the shared inputs and
+options, and the pack files written with their shared-prefix stats
+(prompt_prefix.prompt_stats, so skipped packs count in the batch report). A pack is rebuilt only when that key
+changed or one of its files is missing; size + mtime unchanged means the
+export's recorded sha256 is reused instead of re-hashing a large file.
+Outputs of a previous build that are no longer produced (e.g. shard files
+after the MR shrank) are deleted.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from export_io import strip_compression, write_json_file
+
+MANIFEST_VERSION = 2
+
+def shared_key(*parts: Any) -> str:
+    """sha256 over JSON-serializable build inputs (template texts, options, ...)."""
+    h = hashlib.sha256(str(MANIFEST_VERSION).encode())
+    for part in parts:
+        h.update(json.dumps(part, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def file_digest(path: str, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """{size, mtime_ns, sha256} of a file; the sha256 is taken from `previous` if size and mtime match."""
+    st = os.stat(path)
+    if previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns and previous.get("sha256"):
+        return previous
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+
+def find_exports(directory: str, suffixes: Sequence[str]) -> List[str]:
+    """Exports in `directory` whose name (compression suffix aside) ends with one of `suffixes`, sorted.
+
+    When two files would produce the same pack (x.mr.json and x.mr.jsonl), the newer one wins.
+    """
+    newest: Dict[str, str] = {}
+    for path in glob.glob(os.path.join(directory, "*")):
+        base = strip_compression(os.path.basename(path))
+        suffix = next((s for s in suffixes if base.endswith(s)), None)
+        if suffix is None or not os.path.isfile(path):
+            continue
+        stem = base[: -len(suffix)]
+        if stem not in newest or os.path.getmtime(path) > os.path.getmtime(newest[stem]):
+            newest[stem] = path
+    return sorted(newest.values())
+
+@dataclass
+class BatchResult:
+    built: int = 0
+    skipped: int = 0
+    failed: int = 0
+    # output path -> what the worker returned for it, for every pack of the batch (built or skipped)
+    outputs: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+class BuildManifest:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get("version") == MANIFEST_VERSION:
+                self.entries = data.get("entries") or {}
+        except (OSError, ValueError):
+            pass
+
+    def up_to_date(self, source: str, key: str) -> bool:
+        entry = self.entries.get(source)
+        return bool(entry and entry.get("key") == key and entry.get("outputs")
+                    and all(os.path.exists(p) for p in entry["outputs"]))
+
+    def save(self) -> None:
+        write_json_file(self.path, {"version": MANIFEST_VERSION, "entries": self.entries})
+
+def _init_worker(initializer: Callable[..., None], initargs: Tuple[Any, ...]) -> None:
+    # Flush per line so the OK:/WARN: lines of concurrent workers do not interleave mid-line.
+    for stream in (sys.stdout, sys.stderr):
+        if hasattr(stream, "reconfigure"):
+            stream.reconfigure(line_buffering=True, write_through=False)
+    initializer(*initargs)
+
+def run_batch(
+    sources: List[str],
+    manifest_path: str,
+    inputs_key: str,
+    worker: Callable[[str], Dict[str, Dict[str, Any]]],
+    initializer: Callable[..., None],
+    initargs: Tuple[Any, ...],
+    jobs: int,
+    force: bool = False,
+) -> BatchResult:
+    """Build the pack of each source that changed.
+
+    `worker(source)` must be a module-level function (it runs in a pool process
+    set up by `initializer(*initargs)`) and return {path written: stats}.
+    """
+    manifest = BuildManifest(manifest_path)
+    todo: List[Tuple[str, str, Dict[str, Any]]] = []
+    result = BatchResult()
+    for source in sources:
+        digest = file_digest(source, (manifest.entries.get(source) or {}).get("source"))
+        key = hashlib.sha256(f"{inputs_key}:{digest['sha256']}".encode()).hexdigest()
+        if not force and manifest.up_to_date(source, key):
+            manifest.entries[source]["source"] = digest
+            result.skipped += 1
+            continue
+        todo.append((source, key, digest))
+
+    def finish(source: str, key: str, digest: Dict[str, Any], outputs: Dict[str, Dict[str, Any]]) -> None:
+        previous = (manifest.entries.get(source) or {}).get("outputs") or {}
+        for stale in set(previous) - set(outputs):
+            if os.path.exists(stale):
+                os.unlink(stale)
+        manifest.entries[source] = {"key": key, "source": digest, "outputs": outputs}
+        result.built += 1
+
+    try:
+        if jobs <= 1 or len(todo) <= 1:
+            initializer(*initargs)
+            for source, key, digest in todo:
+                try:
+                    finish(source, key, digest, worker(source))
+                except Exception as e:  # same as the pool path: one malformed export must not abort the batch
+                    result.failed += 1
+                    print(f"ERROR: {source}: {type(e).__name__}: {e}", file=sys.stderr)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(initializer, initargs)) as pool:
+                futures: List[Tuple[str, str, Dict[str, Any], Future]] = [
+                    (source, key, digest, pool.submit(worker, source)) for source, key, digest in todo
+                ]
+                for source, key, digest, fut in futures:
+                    try:
+                        finish(source, key, digest, fut.result())
+                    except Exception as e:  # anything raised in the worker process
+                        result.failed += 1
+                        print(f"ERROR: {source}: {type(e).__name__}: {e}", file=sys.stderr)
+    finally:
+        # Only this run's sources: deleted exports, and ones superseded by a newer file for the same pack, drop out.
+        wanted = set(sources)
+        manifest.entries = {s: e for s, e in manifest.entries.items() if s in wanted}
+        manifest.save()
+    for entry in manifest.entries.values():
+        result.outputs.update(entry.get("outputs") or {})
+    return result
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Compact text rendering of an MR export for the review prompt (--mr-format compact).
+
+Instead of the pretty-printed export JSON, the prompt gets:
+
+  MR g/p!17 "Title" (feature -> main, opened)
+  === src/app.py
+  @@ -10,3 +10,4 @@ def handler():
+   x = 1
+  -y = 2
+  +y = 3
+  >>> src/app.py:11
+  @alice: 例外を握りつぶしています
+    @bob: 修正しました
+  === src/old.py (deleted)
+  >>> general (resolved)
+  @carol: ...
+
+- Diff context is trimmed to `diff_context` lines around each change (hunks are
+  split and their @@ headers recomputed, so line numbers stay exact).
+  A negative width keeps the diff as exported.
+- Dropped: fetched_at, diff_refs, web URLs, note/author ids, timestamps,
+  counts, system notes and the per-file new/renamed/deleted booleans (shown as
+  a short tag instead).
+- Comments are grouped into threads (discussion_id) and placed under the file
+  they are anchored to as `>>> path:line` (`(old)` for old-side lines);
+  threads on files outside the diff and general threads come last. Replies
+  are indented two spaces, continuation lines of a note four; blank lines are dropped.
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from mr_hunks import HUNK_RE
+
+def _hunk_header(old_start: int, old_count: int, new_start: int, new_count: int, suffix: str) -> str:
+    # Like git: an empty side points at the line before the insertion / deletion
+    # (0 for a new / deleted file, whose start is already 0).
+    if old_count == 0:
+        old_start = max(0, old_start - 1)
+    if new_count == 0:
+        new_start = max(0, new_start - 1)
+    return f"@@ -{old_start},{old_count} +{new_start},{new_count} @@{suffix}"
+
+def _trim_hunk(old: int, new: int, suffix: str, body: List[str], context: int) -> List[str]:
+    rows: List[Tuple[str, str, int, int]] = []
+    for line in body:
+        if not line:
+            continue
+        tag = line[0]
+        rows.append((tag, line, old, new))
+        if tag == "+":
+            new += 1
+        elif tag == "-":
+            old += 1
+        elif tag != "\\":
+            old += 1
+            new += 1
+    keep = [False] * len(rows)
+    for k, row in enumerate(rows):
+        if row[0] in "+-":
+            for j in range(max(0, k - context), min(len(rows), k + context + 1)):
+                keep[j] = True
+    for k, row in enumerate(rows):
+        if row[0] == "\\":  # "\ No newline at end of file" belongs to the line before it
+            keep[k] = k > 0 and keep[k - 1]
+
+    out: List[str] = []
+    k = 0
+    while k < len(rows):
+        if not keep[k]:
+            k += 1
+            continue
+        group = []
+        while k < len(rows) and keep[k]:
+            group.append(rows[k])
+            k += 1
+        numbered = [r for r in group if r[0] != "\\"]
+        old_count = sum(1 for r in numbered if r[0] != "+")
+        new_count = sum(1 for r in numbered if r[0] != "-")
+        out.append(_hunk_header(numbered[0][2], old_count, numbered[0][3], new_count, suffix if not out else ""))
+        out.extend(r[1] for r in group)
+    return out
+
+def trim_context(diff: str, context: int) -> str:
+    """Unified diff with at most `context` unchanged lines around each change (context < 0: unchanged)."""
+    if context < 0 or not diff:
+        return diff
+    lines = diff.split("\n")
+    out: List[str] = []
+    i = 0
+    while i < len(lines):
+        m = HUNK_RE.match(lines[i])
+        if not m:
+            if lines[i]:
+                out.append(lines[i])  # text before the first hunk ("Binary files differ" etc.)
+            i += 1
+            continue
+        header = lines[i]
+        body: List[str] = []
+        i += 1
+        while i < len(lines) and not HUNK_RE.match(lines[i]):
+            body.append(lines[i])
+            i += 1
+        out.extend(_trim_hunk(int(m.group(1)), int(m.group(2)), header[m.end():], body, context))
+    return "\n".join(out) + ("\n" if out else "")
+
+def _file_tag(d: Dict[str, Any]) -> str:
+    tags = []
+    if d.get("new_file"):
+        tags.append("new")
+    if d.get("deleted_file"):
+        tags.append("deleted")
+    if d.get("renamed_file") and d.get("old_path") != d.get("new_path"):
+        tags.append(f"renamed from {d.get('old_path')}")
+    if d.get("omitted"):
+        tags.append(f"diff omitted: {d['omitted']}")
+    return f" ({', '.join(tags)})" if tags else ""
+
+def _anchor(position: Any) -> Tuple[Optional[str], str]:
+    """(path, 'path:line' / 'path:line (old)') for a comment position; (None, 'general') without one."""
+    if not isinstance(position, dict):
+        return None, "general"
+    if position.get("old_line") and not position.get("new_line"):
+        path = position.get("old_path") or position.get("new_path")
+        return path, f"{path}:{position['old_line']} (old)"
+    path = position.get("new_path") or position.get("old_path")
+    if not path:
+        return None, "general"
+    return path, f"{path}:{position['new_line']}" if position.get("new_line") else path
+
+def _note_lines(c: Dict[str, Any], indent: str) -> List[str]:
+    author = (c.get("author") or {}).get("username") or (c.get("author") or {}).get("name") or "?"
+    body = [line for line in (c.get("body") or "").strip().split("\n") if line.strip()] or [""]
+    return [f"{indent}@{author}: {body[0]}"] + [f"{indent}    {line}" for line in body[1:]]
+
+def _threads(comments: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    threads: Dict[Any, List[Dict[str, Any]]] = {}
+    for n, c in enumerate(comments):
+        if not isinstance(c, dict) or c.get("system"):
+            continue
+        threads.setdefault(c.get("discussion_id") or f"#{n}", []).append(c)
+    return list(threads.values())
+
+def _thread_text(thread: List[Dict[str, Any]], anchor: str) -> str:
+    lines = [f">>> {anchor}" + (" (resolved)" if thread[0].get("resolved") else "")]
+    for n, c in enumerate(thread):
+        lines.extend(_note_lines(c, "" if n == 0 else "  "))
+    return "\n".join(lines) + "\n"
+
+def iter_compact_mr(payload: Dict[str, Any], diff_context: int = 3) -> Iterator[str]:
+    """Compact text of an MR export (see module docstring), one file / thread block at a time."""
+    mr = payload.get("mr") or {}
+    ref = f"{mr.get('project_path') or ''}!{mr.get('iid')}"
+    yield f"MR {ref} \"{mr.get('title') or ''}\" ({mr.get('source_branch')} -> {mr.get('target_branch')}, {mr.get('state')})\n"
+    shard = payload.get("shard")
+    if isinstance(shard, dict):
+        yield f"[shard {shard.get('index')}/{shard.get('total')}: only the files below]\n"
+
+    by_path: Dict[str, List[Tuple[str, List[Dict[str, Any]]]]] = {}
+    unplaced: List[Tuple[str, List[Dict[str, Any]]]] = []
+    diff_paths = set()
+    for d in payload.get("diffs") or []:
+        diff_paths.update(p for p in (d.get("old_path"), d.get("new_path")) if p)
+    for thread in _threads(payload.get("comments") or []):
+        path, anchor = _anchor(thread[0].get("position"))
+        if path in diff_paths:
+            by_path.setdefault(path, []).append((anchor, thread))  # type: ignore[arg-type]
+        else:
+            unplaced.append((anchor, thread))
+
+    for d in payload.get("diffs") or []:
+        path = d.get("new_path") or d.get("old_path") or ""
+        parts = [f"=== {path}{_file_tag(d)}\n", trim_context(d.get("diff") or "", diff_context)]
+        for p in dict.fromkeys(p for p in (d.get("new_path"), d.get("old_path")) if p):
+            parts.extend(_thread_text(thread, anchor) for anchor, thread in by_path.pop(p, []))
+        yield "".join(parts)
+    for anchor, thread in unplaced:
+        yield _thread_text(thread, anchor)
+
+def compact_mr_text(payload: Dict[str, Any], diff_context: int = 3) -> str:
+    return "".join(iter_compact_mr(payload, diff_context))
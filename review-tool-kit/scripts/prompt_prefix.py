@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Shared-prefix layout of the compiled prompts, for provider-side prompt caching.
+
+The templates put everything that is the same for every MR of a run (system
+and user prompt, guidelines, the shared coding rules, format notes) first and
+mark the end of it with {{PROMPT_PREFIX_END}}, rendered as the PREFIX_MARKER
+line. Everything after the marker is per MR (rules picked for the MR, MR data).
+
+A model plug-in can send split_prompt(prompt)[0] as the cached part of the
+request. prompt_stats() digests a prompt into {prefix_sha256, prefix_tokens,
+tokens}; prefix_report() checks that a batch of prompts shares one
+byte-identical prefix and reports the share of prompt tokens it covers.
+"""
+
+import hashlib
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+
+PREFIX_PLACEHOLDER = "PROMPT_PREFIX_END"
+PREFIX_MARKER = "<!-- end of shared prompt prefix: per-MR input follows -->"
+PREFIX_VALUE = PREFIX_MARKER + "\n"
+
+def split_prompt(text: str) -> Tuple[str, str]:
+    """(prefix, suffix) around the marker line (which is dropped); ("", text) without a marker."""
+    head, sep, tail = text.partition("\n" + PREFIX_VALUE)
+    if sep:
+        return head + "\n", tail
+    if text.startswith(PREFIX_VALUE):
+        return "", text[len(PREFIX_VALUE):]
+    return "", text
+
+def _add_tokens(counts: List[int], text: str) -> None:
+    # Same arithmetic as prompt_shards.estimate_tokens(), accumulated over chunks.
+    n = len(text.encode("ascii", "ignore"))
+    counts[0] += n
+    counts[1] += len(text) - n
+
+def _tokens(counts: List[int]) -> int:
+    return (counts[0] + 3) // 4 + counts[1]
+
+def prompt_stats(lines: Iterable[str]) -> Dict[str, Any]:
+    """{prefix_sha256, prefix_tokens, tokens} of a prompt given as lines (keepends); prefix_sha256 is None without a marker."""
+    h = hashlib.sha256()
+    prefix = [0, 0]
+    total = [0, 0]
+    found = False
+    for line in lines:
+        _add_tokens(total, line)
+        if found:
+            continue
+        if line.rstrip("\n") == PREFIX_MARKER:
+            found = True
+            continue
+        h.update(line.encode("utf-8"))
+        _add_tokens(prefix, line)
+    return {
+        "prefix_sha256": h.hexdigest() if found else None,
+        "prefix_tokens": _tokens(prefix) if found else 0,
+        "tokens": _tokens(total),
+    }
+
+def prompt_file_stats(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return prompt_stats(f)
+
+def prefix_report(stats: Dict[str, Dict[str, Any]]) -> Tuple[str, bool]:
+    """(report line, ok): ok when every prompt has a marker and the same prefix bytes.
+
+    The share is the prefix tokens of all prompts over all prompt tokens: what a
+    provider cache can serve once the prefix is warm.
+    """
+    if not stats:
+        return "INFO: no prompts to compare", True
+    digests = Counter(s.get("prefix_sha256") for s in stats.values())
+    common, _ = digests.most_common(1)[0]
+    odd = sorted(name for name, s in stats.items() if s.get("prefix_sha256") != common or common is None)
+    total = sum(int(s.get("tokens") or 0) for s in stats.values())
+    if odd:
+        shown = ", ".join(odd[:5]) + (f", ... (+{len(odd) - 5})" if len(odd) > 5 else "")
+        unmarked = sum(1 for name in odd if stats[name].get("prefix_sha256") is None)
+        return (f"ERROR: shared prompt prefix check failed for {len(odd)}/{len(stats)} prompts "
+                f"({unmarked} without the prefix marker, {len(odd) - unmarked} with a different prefix): {shown}"), False
+    prefix_tokens = int(next(iter(stats.values())).get("prefix_tokens") or 0)
+    cached = prefix_tokens * len(stats)
+    share = cached / total * 100 if total else 0.0
+    return (f"INFO: shared prompt prefix identical across {len(stats)} prompts (sha256 {str(common)[:12]}): "
+            f"~{prefix_tokens} tokens each, {share:.1f}% of ~{total} batch prompt tokens cacheable"), True
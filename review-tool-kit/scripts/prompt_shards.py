@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Token-budgeted sharding of MR review prompts, and merging of the shard reviews.
+
+An MR whose prompt would exceed the budget is split by files into several MR
+payloads. Related files (foo.py / test_foo.py / foo_test.go / Foo.spec.ts ...)
+are kept in the same shard and shards are filled in path order, so a directory
+tends to stay together. Each shard carries the full `mr` metadata plus a
+`shard` object ({index, total, files}); comments go with the file they are on,
+general comments and comments on a path that is not in the diffs (outdated or
+removed files) go to shard 1. The shared preamble (prompts, guidelines,
+rules) is repeated by the caller for every shard.
+
+merge_reviews() turns the per-shard review JSONs back into one
+mr_overall + inline_comments result.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Overall statuses from in/mr_review/system_prompt.md, least to most severe.
+STATUS_ORDER = ("マージ可能", "リファクタあり", "指摘あり")
+SHARD_NAME_RE = re.compile(r"\.shard(\d+)of(\d+)")
+
+_TEST_AFFIX_RE = re.compile(r"^(?:test_)?(.+?)(?:_test|_spec|\.test|\.spec|Test|Tests|Spec)?$")
+# Basenames too generic to relate files across directories.
+_GENERIC_STEMS = {"__init__", "index", "main", "mod", "readme", "conftest", "utils", "types", "constants"}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: ~4 ASCII chars per token, ~1 token per non-ASCII (e.g. Japanese) char.
+
+    Errs on the high side for code, which is what a budget needs.
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+def estimate_tokens_iter(chunks: Iterable[str]) -> int:
+    """estimate_tokens() of the concatenated chunks, without concatenating them."""
+    ascii_chars = other = 0
+    for chunk in chunks:
+        n = len(chunk.encode("ascii", "ignore"))
+        ascii_chars += n
+        other += len(chunk) - n
+    return (ascii_chars + 3) // 4 + other
+
+def related_key(path: str) -> str:
+    """Files with the same key are placed in the same shard."""
+    directory, name = os.path.split(path)
+    stem = name.split(".", 1)[0]
+    core = _TEST_AFFIX_RE.match(stem).group(1) if stem else name  # type: ignore[union-attr]
+    if core.lower() in _GENERIC_STEMS:
+        return f"{directory}/{core}"
+    return core.lower()
+
+def _diff_path(d: Dict[str, Any]) -> str:
+    return d.get("new_path") or d.get("old_path") or ""
+
+def _comment_path(c: Dict[str, Any]) -> Optional[str]:
+    pos = c.get("position") if isinstance(c.get("position"), dict) else None
+    if not pos:
+        return None
+    return pos.get("new_path") or pos.get("old_path")
+
+def _diff_index(diffs: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Path -> index of the diff it belongs to (new paths first, then old paths of renames)."""
+    index: Dict[str, int] = {}
+    for key in ("new_path", "old_path"):
+        for i, d in enumerate(diffs):
+            if d.get(key):
+                index.setdefault(d[key], i)
+    return index
+
+def _comment_diff(c: Dict[str, Any], index: Dict[str, int]) -> Optional[int]:
+    """Index of the diff the comment is on; None for general comments and paths not in the diffs."""
+    path = _comment_path(c)
+    return index.get(path) if path else None
+
+def _cost(obj: Any) -> int:
+    return estimate_tokens(json.dumps(obj, ensure_ascii=False, indent=2))
+
+def plan_shards(payload: Dict[str, Any], budget: int) -> List[List[int]]:
+    """Indexes into payload["diffs"] for each shard, so that each shard's MR JSON fits `budget` tokens.
+
+    A related group larger than the budget is split into single files; a single
+    file larger than the budget gets a shard of its own (and is over budget).
+    """
+    diffs = payload.get("diffs") or []
+    index = _diff_index(diffs)
+    cost = [_cost(d) for d in diffs]
+    general_cost = 0
+    for c in payload.get("comments") or []:
+        i = _comment_diff(c, index)
+        if i is None:
+            general_cost += _cost(c)
+        else:
+            cost[i] += _cost(c)
+
+    groups: Dict[str, List[int]] = {}
+    for i in sorted(range(len(diffs)), key=lambda i: _diff_path(diffs[i])):
+        groups.setdefault(related_key(_diff_path(diffs[i])), []).append(i)
+    units: List[List[int]] = []
+    for members in sorted(groups.values(), key=lambda m: _diff_path(diffs[m[0]])):
+        if sum(cost[i] for i in members) <= budget:
+            units.append(members)
+        else:
+            units.extend([i] for i in members)
+
+    shards: List[List[int]] = [[]]
+    used = general_cost  # general and unmatched comments always go to shard 1
+    for unit in units:
+        unit_cost = sum(cost[i] for i in unit)
+        if shards[-1] and used + unit_cost > budget:
+            shards.append([])
+            used = 0
+        shards[-1].extend(unit)
+        used += unit_cost
+    return shards
+
+def pack_items(costs: List[int], budget: int) -> List[List[int]]:
+    """Indexes grouped into as few bins of `budget` as first-fit decreasing finds, each bin in index order.
+
+    Unlike plan_shards() the items are independent, so their order does not matter;
+    an item larger than the budget gets a bin of its own.
+    """
+    bins: List[List[int]] = []
+    room: List[int] = []
+    for i in sorted(range(len(costs)), key=lambda i: (-costs[i], i)):
+        for b, left in enumerate(room):
+            if costs[i] <= left:
+                bins[b].append(i)
+                room[b] -= costs[i]
+                break
+        else:
+            bins.append([i])
+            room.append(budget - costs[i])
+    return [sorted(b) for b in bins] or [[]]
+
+def shard_payloads(payload: Dict[str, Any], budget: int) -> List[Dict[str, Any]]:
+    """[payload] unchanged when it fits `budget`, else one payload per shard (see module docstring)."""
+    if _cost(payload) <= budget:
+        return [payload]
+    base = {k: v for k, v in payload.items() if k not in ("diffs", "comments")}
+    # Every shard repeats the metadata; the shard header itself is small.
+    overhead = _cost(base) + _cost({"shard": {"index": 0, "total": 0, "files": []}})
+    diffs = payload.get("diffs") or []
+    plan = plan_shards(payload, max(1, budget - overhead))
+    index = _diff_index(diffs)
+    out: List[Dict[str, Any]] = []
+    for n, indexes in enumerate(plan, start=1):
+        members = set(indexes)
+        shard: Dict[str, Any] = {}
+        for k, v in payload.items():
+            if k == "diffs":
+                shard["diffs"] = [diffs[i] for i in indexes]
+            elif k == "comments":
+                shard["comments"] = [
+                    c for c in v or []
+                    for i in [_comment_diff(c, index)]
+                    if (i in members) or (n == 1 and i is None)
+                ]
+            else:
+                shard[k] = v
+            if k == "mr":
+                shard["shard"] = {"index": n, "total": len(plan), "files": [_diff_path(diffs[i]) for i in indexes]}
+        out.append(shard)
+    return out
+
+def shard_stem(stem: str, index: int, total: int) -> str:
+    return stem if total <= 1 else f"{stem}.shard{index}of{total}"
+
+def merged_name(shard_name: str) -> str:
+    """'x__iid_1.shard2of3.review.json' -> 'x__iid_1.review.json'."""
+    return SHARD_NAME_RE.sub("", shard_name, count=1)
+
+def shard_number(name: str) -> Optional[Tuple[int, int]]:
+    """(index, total) from a '.shard<i>of<n>' file name, else None."""
+    m = SHARD_NAME_RE.search(name)
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+def _norm(text: Any) -> str:
+    return " ".join(str(text or "").split())
+
+def merge_reviews(reviews: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One review from per-shard reviews: most severe status, distinct summaries, de-duplicated findings.
+
+    Findings are duplicates when path, side, line and the whitespace-normalized
+    detail match; the first one (shard order) is kept.
+    """
+    status_rank = {s: i for i, s in enumerate(STATUS_ORDER)}
+    status: Optional[str] = None
+    summaries: List[str] = []
+    risks: List[str] = []
+    inline: List[Dict[str, Any]] = []
+    seen: Set[Tuple[Any, ...]] = set()
+    for review in reviews:
+        overall = review.get("mr_overall") or {}
+        s = (overall.get("status") or "").strip()
+        if s and (status is None or status_rank.get(s, len(STATUS_ORDER)) > status_rank.get(status, len(STATUS_ORDER))):
+            status = s
+        for text, acc in ((overall.get("changes_summary"), summaries), (overall.get("risk_impact"), risks)):
+            text = (text or "").strip()
+            if text and text not in acc:
+                acc.append(text)
+        for c in review.get("inline_comments") or []:
+            if not isinstance(c, dict):
+                continue
+            key: Tuple[Any, ...] = ((c.get("path") or "").strip(), (c.get("side") or "new").strip(), c.get("line"), _norm(c.get("detail")))
+            if key in seen:
+                continue
+            seen.add(key)
+            inline.append(c)
+    return {
+        "mr_overall": {
+            "status": status or STATUS_ORDER[-1],
+            "changes_summary": "\n".join(summaries),
+            "risk_impact": "\n".join(risks),
+        },
+        "inline_comments": inline,
+    }
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Single-pass template renderer shared by the build_*_prompt_pack.py scripts.
+
+A template is split once into literal text and {{NAME}} placeholders. Each
+value is one of:
+
+  str       inserted as-is
+  Template  a nested template (e.g. review_request.md), rendered with the same values
+  callable  returning an iterable of text chunks (file contents, an export
+            re-rendered by mr_export_stream.iter_export_text, ...), called once per use
+
+Values are never scanned for placeholders, so "{{MR_JSON}}" inside an MR
+comment stays literal text. check_values() reports every placeholder without a
+value before anything is written; render_to_file() then streams the pieces to
+the output file without building the compiled prompt in memory.
+"""
+
+import functools
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Union
+
+from export_io import AtomicTextWriter
+
+PLACEHOLDER_RE = re.compile(r"\{\{([A-Z][A-Z0-9_]*)\}\}")
+FILE_CHUNK_CHARS = 1 << 20
+
+class TemplateError(ValueError):
+    pass
+
+class Template:
+    def __init__(self, text: str, name: str = "<template>") -> None:
+        self.name = name
+        # Even indexes are literal text, odd indexes placeholder names.
+        self.parts: List[str] = PLACEHOLDER_RE.split(text)
+
+    @property
+    def placeholders(self) -> List[str]:
+        return self.parts[1::2]
+
+Value = Union[str, Template, Callable[[], Iterable[str]]]
+
+@functools.lru_cache(maxsize=64)
+def parse_template(text: str, name: str = "<template>") -> Template:
+    """Template for `text`, parsed once per process for the same text."""
+    return Template(text, name)
+
+def file_chunks(path: str, chunk_chars: int = FILE_CHUNK_CHARS) -> Callable[[], Iterator[str]]:
+    """Value that streams a UTF-8 text file in chunks."""
+    def chunks() -> Iterator[str]:
+        with open(path, "r", encoding="utf-8") as f:
+            while True:
+                chunk = f.read(chunk_chars)
+                if not chunk:
+                    return
+                yield chunk
+    return chunks
+
+def check_values(template: Template, values: Dict[str, Value]) -> None:
+    """Raise TemplateError if a placeholder (in `template` or a nested one) has no value, or templates nest in a loop."""
+    missing: Dict[str, Set[str]] = {}
+
+    def walk(t: Template, stack: List[str]) -> None:
+        if t.name in stack:
+            raise TemplateError(f"template includes itself: {' -> '.join(stack + [t.name])}")
+        for name in t.placeholders:
+            if name not in values:
+                missing.setdefault(t.name, set()).add(name)
+            elif isinstance(values[name], Template):
+                walk(values[name], stack + [t.name])  # type: ignore[arg-type]
+
+    walk(template, [])
+    if missing:
+        detail = "; ".join(f"{t}: {', '.join('{{' + n + '}}' for n in sorted(names))}" for t, names in missing.items())
+        raise TemplateError(f"unresolved template placeholders ({detail})")
+
+def iter_render(template: Template, values: Dict[str, Value]) -> Iterator[str]:
+    """Yield the rendered text piece by piece (call check_values() first for a clear error)."""
+    for i, part in enumerate(template.parts):
+        if i % 2 == 0:
+            if part:
+                yield part
+            continue
+        value = values[part]
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, Template):
+            yield from iter_render(value, values)
+        else:
+            yield from value()
+
+def render(template: Template, values: Dict[str, Value]) -> str:
+    check_values(template, values)
+    return "".join(iter_render(template, values))
+
+def render_to_file(template: Template, values: Dict[str, Value], path: str) -> None:
+    """Stream the rendered template into `path` (atomically replaced; nothing is written if a value is missing)."""
+    check_values(template, values)
+    w = AtomicTextWriter(path)
+    try:
+        for chunk in iter_render(template, values):
+            w.f.write(chunk)
+        w.commit()
+    except BaseException:
+        w.abort()
+        raise
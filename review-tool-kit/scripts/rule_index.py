@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""BM25 index over the coding-rule stock, used to inject only the rules relevant to an MR.
+
+Each rule is indexed on title, description, category and tags (category and
+tags count double). Text is tokenized into lower-cased ASCII words, with
+camelCase / snake_case split, plus character bigrams for Japanese and other
+non-ASCII runs, so "ログ出力" in a rule matches "ログ" in a diff comment.
+
+The MR query is built from the changed paths (directory and file names, plus
+the language of the extension at half weight: .py -> python) and the tokens
+of the added / removed diff lines. select_rules() keeps every rule whose importance is at
+least `always_importance`, then fills up to `top_k` with the best BM25 scores.
+
+The index is persisted as JSON (config.RULE_INDEX_FILE, default
+<OUT_DIR>/.rule_index.json) together with the sha256 of the rules file, and
+rebuilt only when the rules file content changes.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from export_io import write_json_file
+
+INDEX_FORMAT = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z][a-z0-9]*|[0-9]+|[^\x00-\x7f\s]+")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+_STOPWORDS = {"the", "and", "for", "not", "with", "self", "this", "return", "if", "in", "is", "of", "to", "a", "an"}
+# The extension's language says little about which rules apply (every .py MR has it), so it counts half.
+LANG_QUERY_WEIGHT = 0.5
+_LANG_BY_EXT = {
+    "py": "python", "js": "javascript", "jsx": "javascript", "mjs": "javascript", "ts": "typescript",
+    "tsx": "typescript", "go": "go", "java": "java", "kt": "kotlin", "rb": "ruby", "rs": "rust",
+    "php": "php", "cs": "csharp", "c": "c", "h": "c", "cc": "cpp", "cpp": "cpp", "hpp": "cpp",
+    "swift": "swift", "scala": "scala", "sql": "sql", "sh": "shell", "bash": "shell",
+    "yml": "yaml", "yaml": "yaml", "tf": "terraform", "vue": "vue", "html": "html", "css": "css", "scss": "css",
+}
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for part in _NON_WORD_RE.split(text):
+        for word in _WORD_RE.findall(part):
+            if word.isascii():
+                word = word.lower()
+                if len(word) > 1 and word not in _STOPWORDS:
+                    tokens.append(word)
+            elif len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+def rule_terms(rule: Dict[str, Any]) -> List[str]:
+    tags = rule.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tags]
+    fields = [str(rule.get("title") or ""), str(rule.get("description") or "")]
+    fields += [str(rule.get("category") or ""), " ".join(str(t) for t in tags)] * 2
+    return tokenize("\n".join(fields))
+
+def mr_query_terms(payload: Dict[str, Any]) -> Dict[str, float]:
+    """{term: query weight} for an MR: path components and changed-line tokens (1.0), extension languages."""
+    terms: Dict[str, float] = {}
+    for d in payload.get("diffs") or []:
+        if not isinstance(d, dict):
+            continue
+        for path in {d.get("old_path"), d.get("new_path")} - {None, ""}:
+            terms.update(dict.fromkeys(tokenize(path), 1.0))
+            lang = _LANG_BY_EXT.get(os.path.splitext(path)[1].lstrip(".").lower())
+            if lang:
+                terms.setdefault(lang, LANG_QUERY_WEIGHT)
+        for line in (d.get("diff") or "").split("\n"):
+            if line[:1] in ("+", "-") and not line.startswith(("+++", "---")):
+                terms.update(dict.fromkeys(tokenize(line[1:]), 1.0))
+    return terms
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class RuleIndex:
+    """Inverted index: term -> [[rule position, term frequency], ...], plus each rule's length in terms."""
+
+    def __init__(self, rules_sha256: str, postings: Dict[str, List[List[int]]], lengths: List[int]) -> None:
+        self.rules_sha256 = rules_sha256
+        self.postings = postings
+        self.lengths = lengths
+        self.avgdl = (sum(lengths) / len(lengths)) if lengths else 0.0
+        n = len(lengths)
+        self.idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in postings.items()}
+
+    @classmethod
+    def build(cls, rules: List[Dict[str, Any]], rules_sha256: str) -> "RuleIndex":
+        postings: Dict[str, List[List[int]]] = {}
+        lengths: List[int] = []
+        for i, rule in enumerate(rules):
+            tf = Counter(rule_terms(rule))
+            lengths.append(sum(tf.values()))
+            for term, count in tf.items():
+                postings.setdefault(term, []).append([i, count])
+        return cls(rules_sha256, postings, lengths)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"format": INDEX_FORMAT, "rules_sha256": self.rules_sha256, "lengths": self.lengths, "postings": self.postings}
+
+    def scores(self, query: Dict[str, float]) -> List[float]:
+        """BM25 score of every rule for {term: query weight}."""
+        out = [0.0] * len(self.lengths)
+        avgdl = self.avgdl or 1.0
+        for term, weight in query.items():
+            for i, f in self.postings.get(term, ()):
+                norm = 1 - BM25_B + BM25_B * self.lengths[i] / avgdl
+                out[i] += weight * self.idf[term] * f * (BM25_K1 + 1) / (f + BM25_K1 * norm)
+        return out
+
+def load_rule_index(rules_file: str, rules: List[Dict[str, Any]], index_file: str) -> Tuple[RuleIndex, bool]:
+    """(index, rebuilt): the persisted index when it was built from the current rules file, else a fresh one (saved)."""
+    sha = file_sha256(rules_file)
+    try:
+        with open(index_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") == INDEX_FORMAT and data.get("rules_sha256") == sha and len(data.get("lengths") or []) == len(rules):
+            return RuleIndex(sha, data["postings"], data["lengths"]), False
+    except (OSError, ValueError, AttributeError):
+        pass
+    index = RuleIndex.build(rules, sha)
+    os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+    write_json_file(index_file, index.to_json(), compact=True)
+    return index, True
+
+def rule_index_file(config: Any) -> str:
+    explicit = str(getattr(config, "RULE_INDEX_FILE", "") or "").strip()
+    if explicit:
+        return explicit
+    return os.path.join(str(getattr(config, "OUT_DIR", "./out")).strip(), ".rule_index.json")
+
+def _importance(rule: Dict[str, Any]) -> int:
+    try:
+        return int(rule.get("importance") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def select_rules(
+    index: RuleIndex,
+    rules: List[Dict[str, Any]],
+    payload: Dict[str, Any],
+    top_k: int,
+    always_importance: int = 0,
+) -> List[int]:
+    """Indexes (file order) of the rules to inject: importance >= always_importance, then best BM25 up to top_k.
+
+    always_importance <= 0 disables the always-include list. Rules with no
+    matching term are never picked by score, so a small MR can get fewer than top_k.
+    """
+    always = [i for i, r in enumerate(rules) if always_importance > 0 and _importance(r) >= always_importance]
+    picked = set(always)
+    scores = index.scores(mr_query_terms(payload))
+    ranked = sorted((i for i in range(len(rules)) if i not in picked and scores[i] > 0),
+                    key=lambda i: (-scores[i], -_importance(rules[i]), i))
+    picked.update(ranked[:max(0, top_k - len(always))])
+    return sorted(picked)
+
+class RuleSelector:
+    """Per-MR coding rules for the review prompt (see module docstring).
+
+    The always-include rules are the same for every MR and go into the shared,
+    cacheable prompt prefix (shared_json); rules_json() gives only the ones
+    picked for the MR on top of them.
+    """
+
+    def __init__(self, rules_file: str, index_file: str, top_k: int, always_importance: int) -> None:
+        with open(rules_file, "r", encoding="utf-8-sig") as f:
+            self.stock = json.load(f)
+        self.rules: List[Dict[str, Any]] = [r for r in (self.stock.get("rules") or []) if isinstance(r, dict)]
+        self.top_k = top_k
+        self.always_importance = always_importance
+        self.index, self.rebuilt = load_rule_index(rules_file, self.rules, index_file)
+        self.always = {i for i, r in enumerate(self.rules) if always_importance > 0 and _importance(r) >= always_importance}
+        self.shared_json = self._subset_json(sorted(self.always))
+
+    def _subset_json(self, keep: List[int]) -> str:
+        subset = dict(self.stock)
+        subset["rules"] = [self.rules[i] for i in keep]
+        return json.dumps(subset, ensure_ascii=False, indent=2)
+
+    def rules_json(self, payload: Dict[str, Any]) -> Tuple[str, int]:
+        """(JSON shaped like the rules file of the rules picked for this MR besides the always-include ones, their number)."""
+        keep = [i for i in select_rules(self.index, self.rules, payload, self.top_k, self.always_importance) if i not in self.always]
+        return self._subset_json(keep), len(keep)
+
+def open_rule_selector(config: Any, top_k: Optional[int] = None) -> Optional[RuleSelector]:
+    """Selector from config (RULES_TOP_K / RULES_ALWAYS_IMPORTANCE / CODING_RULES_FILE), or None if disabled.
+
+    None also when the stock has no more rules than top_k: the full file is injected as before.
+    """
+    if top_k is None:
+        top_k = int(getattr(config, "RULES_TOP_K", 0) or 0)
+    if top_k <= 0:
+        return None
+    rules_file = str(getattr(config, "CODING_RULES_FILE", "./rules/coding_rules.json"))
+    selector = RuleSelector(
+        rules_file, rule_index_file(config), top_k, int(getattr(config, "RULES_ALWAYS_IMPORTANCE", 0) or 0)
+    )
+    return selector if len(selector.rules) > top_k else None
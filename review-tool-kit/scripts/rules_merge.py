@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Merge the AI's rules update outputs into the coding rules file locally.
+
+A rules update prompt is answered either with a rule patch (--patch, see
+in/rules_update/output_patch.md), checked against the base rules file by
+validate_patch(), or with a full coding rules JSON built from the base file,
+which rules_delta() reduces to the same operations:
+
+  {"op": "add", "rule": {...}}                       a new rule (its id is assigned here)
+  {"op": "bump", "id": "R-001", "by": 1}             importance went up
+  {"op": "merge_tags", "id": "R-001", "tags": [...]}  tags the base rule did not have
+  {"op": "edit", "id": "R-001", "fields": {...}}      title / description / category / examples changed
+
+apply_ops() applies the operations of several outputs (the packs of an aggregated
+run, see build_rules_update_prompt_pack.py --aggregate) to the base, so packs
+answered independently merge without overwriting each other:
+
+- bumps add up and tags are united;
+- a field edited differently by two outputs keeps the first edit (reported);
+- an added rule whose normalized title equals an existing or already added rule
+  is merged into it (importance added, tags united) instead of duplicated;
+- added rules get fresh ids after the highest R-<n> in the file, in output order.
+
+Rules the AI dropped from its output are never deleted; they are only reported.
+"""
+
+import copy
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from comment_clusters import normalize_body
+
+TEXT_FIELDS = ("title", "description", "category", "examples")
+RULE_FIELDS = TEXT_FIELDS + ("tags", "importance")
+PATCH_OPS = ("add", "bump", "merge_tags", "edit")
+_ID_RE = re.compile(r"^R-(\d+)$")
+
+def _importance(rule: Dict[str, Any]) -> int:
+    try:
+        return int(rule.get("importance") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _tags(rule: Dict[str, Any]) -> List[str]:
+    return [str(t) for t in rule.get("tags") or [] if isinstance(t, (str, int))]
+
+def _rules(stock: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [r for r in stock.get("rules") or [] if isinstance(r, dict)]
+
+def rule_ids(stock: Dict[str, Any]) -> Iterator[str]:
+    """Fresh R-<n> ids after the highest one in stock (zero-padded like the existing ids, at least 3 digits)."""
+    width, top = 3, 0
+    for r in _rules(stock):
+        m = _ID_RE.match(str(r.get("id") or ""))
+        if m:
+            width = max(width, len(m.group(1)))
+            top = max(top, int(m.group(1)))
+    taken = {str(r.get("id")) for r in _rules(stock)}
+    while True:
+        top += 1
+        rid = f"R-{top:0{width}d}"
+        if rid not in taken:
+            yield rid
+
+def rules_delta(base: Dict[str, Any], updated: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """(operations turning base into updated, ids of base rules missing from updated)."""
+    base_by_id = {str(r.get("id")): r for r in _rules(base)}
+    ops: List[Dict[str, Any]] = []
+    seen = set()
+    for rule in _rules(updated):
+        rid = str(rule.get("id"))
+        old = base_by_id.get(rid)
+        # A base id reused for a different rule (neither title nor description kept) counts as a new rule.
+        if old is None or not any(
+            normalize_body(str(old.get(k) or "")) == normalize_body(str(rule.get(k) or "")) for k in ("title", "description")
+        ):
+            ops.append({"op": "add", "rule": rule})
+            continue
+        seen.add(rid)
+        by = _importance(rule) - _importance(old)
+        if by > 0:
+            ops.append({"op": "bump", "id": rid, "by": by})
+        new_tags = [t for t in _tags(rule) if t not in _tags(old)]
+        if new_tags:
+            ops.append({"op": "merge_tags", "id": rid, "tags": new_tags})
+        fields = {k: rule[k] for k in TEXT_FIELDS if k in rule and rule[k] != old.get(k)}
+        if fields:
+            ops.append({"op": "edit", "id": rid, "fields": fields})
+    return ops, [rid for rid in base_by_id if rid not in seen]
+
+def _text(value: Any) -> bool:
+    return isinstance(value, str) and bool(value.strip())
+
+def _str_list(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(_text(v) for v in value)
+
+def _field_error(field: str, value: Any) -> Optional[str]:
+    if field == "examples":
+        return None if isinstance(value, dict) and all(isinstance(v, str) for v in value.values()) else "examples must be an object of strings"
+    if field == "tags":
+        return None if _str_list(value) else "tags must be a non-empty list of strings"
+    if field == "importance":
+        return None if isinstance(value, int) and not isinstance(value, bool) and value > 0 else "importance must be a positive integer"
+    return None if _text(value) else f"{field} must be a non-empty string"
+
+def validate_patch(stock: Dict[str, Any], patch: Any) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """(operations, errors) of a rule patch {"ops": [...]} checked against stock; apply nothing when errors is not empty."""
+    if not isinstance(patch, dict) or not isinstance(patch.get("ops"), list):
+        return [], ["not a rule patch (no 'ops' list)"]
+    ids = {str(r.get("id")) for r in _rules(stock)}
+    ops: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    for n, op in enumerate(patch["ops"]):
+        kind = op.get("op") if isinstance(op, dict) else None
+        label = " ".join(str(x) for x in (kind, op.get("id")) if x) if isinstance(op, dict) else ""
+        where = f"ops[{n}]" + (f" ({label})" if label else "")
+        problems: List[str] = []
+        if kind not in PATCH_OPS:
+            problems.append(f"op must be one of {', '.join(PATCH_OPS)}")
+        elif kind == "add":
+            rule = op.get("rule")
+            if not isinstance(rule, dict):
+                problems.append("rule must be an object")
+            else:
+                if "title" not in rule:
+                    problems.append("rule.title is required")
+                problems += [e for k in RULE_FIELDS if k in rule for e in [_field_error(k, rule[k])] if e]
+                # ids are assigned by apply_ops(); unknown keys are dropped.
+                op = {"op": "add", "rule": {k: rule[k] for k in RULE_FIELDS if k in rule}}
+        elif str(op.get("id")) not in ids:
+            problems.append("no such rule id")
+        elif kind == "bump":
+            by = op.get("by")
+            if not isinstance(by, int) or isinstance(by, bool) or by <= 0:
+                problems.append("by must be a positive integer")
+        elif kind == "merge_tags":
+            problems += [e for e in [_field_error("tags", op.get("tags"))] if e]
+        elif kind == "edit":
+            fields = op.get("fields")
+            if not isinstance(fields, dict) or not fields:
+                problems.append("fields must be a non-empty object")
+            else:
+                problems += [f"{k} cannot be edited" for k in fields if k not in TEXT_FIELDS]
+                problems += [e for k in TEXT_FIELDS if k in fields for e in [_field_error(k, fields[k])] if e]
+        errors += [f"{where}: {p}" for p in problems]
+        ops.append(op)
+    return ops, errors
+
+def apply_ops(stock: Dict[str, Any], patches: List[Tuple[str, List[Dict[str, Any]]]]) -> List[str]:
+    """Apply (source name, operations) in order to stock in place; returns one INFO:/WARN: line per notable event."""
+    messages: List[str] = []
+    rules = stock.setdefault("rules", [])
+    by_id: Dict[str, Dict[str, Any]] = {str(r.get("id")): r for r in _rules(stock)}
+    by_title: Dict[str, Dict[str, Any]] = {normalize_body(str(r.get("title") or "")): r for r in _rules(stock)}
+    edited: Dict[Tuple[str, str], str] = {}
+    new_ids = rule_ids(stock)
+
+    def merge_tags(rule: Dict[str, Any], tags: List[str]) -> None:
+        merged = _tags(rule) + [t for t in tags if t not in _tags(rule)]
+        if merged:
+            rule["tags"] = merged
+
+    for source, ops in patches:
+        for op in ops:
+            kind = op.get("op")
+            if kind == "add":
+                rule = copy.deepcopy(op["rule"])
+                same = by_title.get(normalize_body(str(rule.get("title") or "")))
+                if same is not None:
+                    same["importance"] = _importance(same) + max(1, _importance(rule))
+                    merge_tags(same, _tags(rule))
+                    messages.append(f"INFO: {source}: new rule \"{rule.get('title')}\" merged into {same.get('id')} (importance {same['importance']})")
+                    continue
+                # Same key order as the rules file: id, title, importance, then the rest.
+                rule = {"id": next(new_ids), "title": rule.get("title"), "importance": max(1, _importance(rule)),
+                        **{k: v for k, v in rule.items() if k not in ("id", "title", "importance")}}
+                rules.append(rule)
+                by_id[rule["id"]] = rule
+                by_title[normalize_body(str(rule.get("title") or ""))] = rule
+                messages.append(f"INFO: {source}: added {rule['id']} \"{rule.get('title')}\"")
+                continue
+            target: Optional[Dict[str, Any]] = by_id.get(str(op.get("id")))
+            if target is None:
+                messages.append(f"WARN: {source}: {kind} {op.get('id')}: no such rule, skipped")
+            elif kind == "bump":
+                target["importance"] = _importance(target) + int(op["by"])
+                messages.append(f"INFO: {source}: {op['id']} importance +{op['by']} -> {target['importance']}")
+            elif kind == "merge_tags":
+                merge_tags(target, [str(t) for t in op.get("tags") or []])
+            elif kind == "edit":
+                for field, value in (op.get("fields") or {}).items():
+                    first = edited.get((str(op["id"]), field))
+                    if first is not None and first != source and target.get(field) != value:
+                        messages.append(f"WARN: {source}: {op['id']}.{field} was already edited by {first}; kept that edit")
+                        continue
+                    edited[(str(op["id"]), field)] = source
+                    target[field] = value
+                    if field == "title":
+                        by_title[normalize_body(str(value))] = target
+    return messages
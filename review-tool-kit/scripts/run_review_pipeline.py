@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+"""Run MR review end-to-end in one process:
+  export (gitlab_export_mr) -> prompt pack (build_mr_review_prompt_pack)
+  -> model (pluggable; local stub by default) -> post (gitlab_post_ai_review)
+
+One GitLabClient session is shared by every stage and MR; the MR payload, prompt
+and review JSON are handed between stages in memory. Files are written only
+with --write-artifacts. Posting to GitLab requires --post (otherwise dry-run),
+which is refused with the stub model.
+With config.PROMPT_MAX_TOKENS set, an MR over the budget is reviewed per shard
+and the shard reviews are merged before posting (see prompt_shards.py).
+
+Model plug-in: --model "package.module:function", called as
+  function(prompt: str, mr_payload: dict) -> review dict (mr_overall + inline_comments)
+The prompt starts with a prefix shared by every MR of the run; prompt_prefix.split_prompt()
+separates it so the plug-in can send it as the provider's cached part of the request.
+
+Usage:
+  python scripts/run_review_pipeline.py
+  python scripts/run_review_pipeline.py --mr-url "https://.../-/merge_requests/17" --write-artifacts
+  python scripts/run_review_pipeline.py --model my_llm:review --post
+"""
+
+import argparse
+import importlib
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+import build_mr_review_prompt_pack as prompt_pack
+import gitlab_export_mr as exporter
+import gitlab_post_ai_review as poster
+from export_io import output_stem, write_json_file
+from gitlab_cache import format_cache_stats, open_response_cache
+from gitlab_client import GitLabAPIError, GitLabClient, build_session
+from gitlab_ratelimit import format_rate_stats, open_rate_limiter
+from mr_diffs import DiffFilter
+from mr_hunks import HunkIndex
+from prompt_prefix import prefix_report, prompt_stats
+from prompt_shards import merge_reviews, shard_stem
+from rule_index import RuleSelector, open_rule_selector
+
+config = exporter.config
+
+ModelFn = Callable[[str, Dict[str, Any]], Dict[str, Any]]
+STAGES = ("export", "prompt", "model", "post")
+
+def stub_model(prompt: str, mr_payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Local stand-in for the LLM: a deterministic review with no inline findings."""
+    counts = mr_payload.get("counts") or {}
+    return {
+        "mr_overall": {
+            "status": "指摘あり",
+            "changes_summary": f"（stub）{counts.get('diff_files', 0)} files / {counts.get('comments', 0)} comments, prompt {len(prompt)} chars",
+            "risk_impact": "（stub model: 実際のレビューは行っていません）",
+        },
+        "inline_comments": [],
+    }
+
+def load_model(spec: str) -> ModelFn:
+    if spec in ("", "stub"):
+        return stub_model
+    module_name, _, func_name = spec.partition(":")
+    if not func_name:
+        raise ValueError(f"--model must be 'stub' or 'module:function': {spec}")
+    return getattr(importlib.import_module(module_name), func_name)
+
+def review_one(
+    gl: GitLabClient,
+    mr_url: str,
+    opts: exporter.ExportOptions,
+    inputs: Dict[str, str],
+    selector: Optional[RuleSelector],
+    model: ModelFn,
+    post: bool,
+    artifacts: bool,
+    prefix_stats: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    mr_base, project_path, iid = exporter.parse_mr_url(mr_url)
+    if mr_base.rstrip("/") != gl.base_url.rstrip("/"):
+        raise ValueError(f"host mismatch: {mr_url}")
+
+    t = time.perf_counter()
+    payload = exporter.export_one_mr(gl, project_path, iid, opts)
+    timings["export"] = time.perf_counter() - t
+    mr = payload["mr"]
+    stem = output_stem(mr)
+
+    t = time.perf_counter()
+    inputs = prompt_pack.inputs_for_mr(inputs, payload, selector)
+    max_tokens = int(getattr(config, "PROMPT_MAX_TOKENS", 0) or 0)
+    mr_format = str(getattr(config, "PROMPT_MR_FORMAT", "json") or "json")
+    diff_context = int(getattr(config, "PROMPT_DIFF_CONTEXT", 3))
+    if max_tokens > 0:
+        shards = prompt_pack.compile_shards(inputs, payload, max_tokens, mr_format, diff_context)
+    else:
+        mr_text = prompt_pack.mr_prompt_text(payload, mr_format, diff_context)
+        shards = [(payload, prompt_pack.compile_prompt(inputs, mr_text, mr_format))]
+    timings["prompt"] = time.perf_counter() - t
+    if prefix_stats is not None:
+        for n, (_, shard_prompt) in enumerate(shards, start=1):
+            prefix_stats[shard_stem(stem, n, len(shards))] = prompt_stats(shard_prompt.splitlines(keepends=True))
+
+    t = time.perf_counter()
+    reviews = [model(shard_prompt, shard_payload) for shard_payload, shard_prompt in shards]
+    review = reviews[0] if len(reviews) == 1 else merge_reviews(reviews)
+    timings["model"] = time.perf_counter() - t
+
+    if artifacts:
+        out_dir = str(getattr(config, "OUT_DIR", "./out")).strip()
+        review_dir = str(getattr(config, "REVIEW_OUT_DIR", "./review_out")).strip()
+        compiled_dir = pathlib.Path("./in/compiled")
+        os.makedirs(os.path.join(out_dir, "mr"), exist_ok=True)
+        os.makedirs(review_dir, exist_ok=True)
+        compiled_dir.mkdir(parents=True, exist_ok=True)
+        write_json_file(os.path.join(out_dir, "mr", f"{stem}.mr.json"), payload)
+        for n, (_, shard_prompt) in enumerate(shards, start=1):
+            (compiled_dir / f"{shard_stem(stem + '.mr', n, len(shards))}.mr_review.prompt.md").write_text(shard_prompt, encoding="utf-8")
+        write_json_file(os.path.join(review_dir, f"{stem}.review.json"), review)
+
+    diff_refs = mr.get("diff_refs") or {}
+    if not (diff_refs.get("base_sha") and diff_refs.get("start_sha") and diff_refs.get("head_sha")):
+        raise GitLabAPIError(f"MR diff_refs missing (base_sha/start_sha/head_sha): {mr_url}")
+    t = time.perf_counter()
+    poster.post_review(
+        gl, project_path, iid, review, diff_refs, dry_run=not post,
+        jobs=int(getattr(config, "POST_JOBS", 4) or 4),
+        hunks=HunkIndex.from_diffs(payload["diffs"]),
+        snap_lines=int(getattr(config, "POSITION_SNAP_LINES", 3) or 0),
+    )
+    timings["post"] = time.perf_counter() - t
+    return timings
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Export -> prompt pack -> model -> post, in one process.")
+    ap.add_argument("--mr-url", action="append", help="MR URL (repeatable). If omitted, uses config.MR_URLS.")
+    ap.add_argument("--model", default=str(getattr(config, "REVIEW_MODEL", "stub") or "stub"),
+                    help="'stub' or 'module:function' (default: config.REVIEW_MODEL or stub)")
+    ap.add_argument("--jobs", type=int, default=int(getattr(config, "EXPORT_JOBS", 1) or 1), help="MRs processed concurrently")
+    ap.add_argument("--write-artifacts", action="store_true", help="Also write .mr.json / prompt / review json files")
+    ap.add_argument("--post", action="store_true", help="Post to GitLab (default: dry-run print)")
+    args = ap.parse_args()
+
+    base_url = str(getattr(config, "GITLAB_BASE_URL", "")).strip()
+    token = str(getattr(config, "GITLAB_TOKEN", "")).strip()
+    mr_urls = list(args.mr_url or getattr(config, "MR_URLS", []) or [])
+    if not base_url or not token:
+        print("ERROR: config.py の GITLAB_BASE_URL / GITLAB_TOKEN を設定してください。", file=sys.stderr)
+        return 2
+    if not mr_urls:
+        print("ERROR: MR URL がありません。config.py の MR_URLS を設定してください。", file=sys.stderr)
+        return 2
+    if args.jobs < 1:
+        print("ERROR: --jobs は 1 以上を指定してください。", file=sys.stderr)
+        return 2
+
+    if args.post and args.model in ("", "stub"):
+        print("ERROR: stub モデルの結果は投稿できません。--model（config.REVIEW_MODEL）に実際のモデルを指定してください。", file=sys.stderr)
+        return 2
+    model = load_model(args.model)
+    inputs = prompt_pack.load_prompt_inputs()
+    selector = open_rule_selector(config)
+    opts = exporter.ExportOptions(
+        include_system_notes=bool(getattr(config, "INCLUDE_SYSTEM_NOTES", False)),
+        diff_source=str(getattr(config, "DIFF_SOURCE", "changes") or "changes"),
+        diff_page_size=int(getattr(config, "DIFF_PAGE_SIZE", 20) or 20),
+        diff_filter=DiffFilter.from_config(config),
+    )
+    jobs = min(args.jobs, len(mr_urls))
+    page_jobs = max(1, int(getattr(config, "PAGE_FETCH_JOBS", 1) or 1))
+    limiter = open_rate_limiter(config)
+    gl = GitLabClient(
+        base_url=base_url,
+        token=token,
+        session=build_session(pool_size=max(jobs * page_jobs, 10), retry_429=limiter is None),
+        page_jobs=page_jobs,
+        cache=open_response_cache(config),
+        limiter=limiter,
+    )
+
+    results: List[Tuple[str, Dict[str, float]]] = []
+    prefix_stats: Dict[str, Dict[str, Any]] = {}
+    failures: List[Tuple[str, str]] = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [(u, pool.submit(review_one, gl, u, opts, inputs, selector, model, args.post, args.write_artifacts, prefix_stats)) for u in mr_urls]
+        for mr_url, fut in futures:
+            try:
+                results.append((mr_url, fut.result()))
+            except Exception as e:  # a model plug-in may raise anything; the other MRs still run
+                failures.append((mr_url, f"{type(e).__name__}: {e}"))
+                print(f"ERROR: pipeline failed: {mr_url}\n{type(e).__name__}: {e}", file=sys.stderr)
+
+    print("---- Stage timings (s) ----", file=sys.stderr)
+    print("  " + " ".join(f"{s:>8}" for s in STAGES) + "  MR", file=sys.stderr)
+    totals = {s: 0.0 for s in STAGES}
+    for mr_url, timings in results:
+        for s in STAGES:
+            totals[s] += timings.get(s, 0.0)
+        print("  " + " ".join(f"{timings.get(s, 0.0):8.2f}" for s in STAGES) + f"  {mr_url}", file=sys.stderr)
+    print("  " + " ".join(f"{totals[s]:8.2f}" for s in STAGES) + "  TOTAL", file=sys.stderr)
+    if prefix_stats:
+        print(prefix_report(prefix_stats)[0], file=sys.stderr)
+    if gl.cache is not None:
+        print(format_cache_stats(gl.cache), file=sys.stderr)
+    if gl.limiter is not None:
+        print(format_rate_stats(gl.limiter), file=sys.stderr)
+    print(f"DONE: {len(results)} reviewed, {len(failures)} failed", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    try:
+        raise SystemExit(main())
+    except requests.RequestException as e:
+        print(f"ERROR: network/request failed: {e}", file=sys.stderr)
+        raise SystemExit(1)